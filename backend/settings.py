@@ -15,9 +15,6 @@ import sys
 import os
 from dotenv import load_dotenv
 
-
-from django.core.cache import cache
-cache.clear()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(BASE_DIR / ".env.dev")
@@ -52,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "currency.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -88,7 +86,8 @@ WSGI_APPLICATION = "backend.wsgi.application"
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        # в docker-compose база лежит на общем томе app и refresher
+        "NAME": os.getenv("DATABASE_PATH", BASE_DIR / "db.sqlite3"),
     }
 }
 
@@ -171,6 +170,68 @@ CACHES = {
 }
 CACHE_MIDDLEWARE_ALIAS = "default"
 
+# currency rates refresh
+# в тестах синхронизация с ЕЦБ выполняется в потоке запроса
+CURRENCY_REFRESH_ASYNC = not TESTING
+# сколько хранить последние удачные данные, сек.
+CURRENCY_STALE_TIMEOUT = 7 * 86400
+# L1-кеш в памяти воркера перед Redis: срок жизни записи, сек. (0 - выключен),
+# и число записей; сбрасывается во всех воркерах через Redis pub/sub
+CURRENCY_LOCAL_CACHE_TTL = 0 if TESTING else 5
+CURRENCY_LOCAL_CACHE_SIZE = 1024
+# повтор синхронизации, если ЕЦБ недоступен или еще не опубликовал курсы, сек.
+CURRENCY_REFRESH_RETRY = 15 * 60
+# блокировка синхронизации на все воркеры и ожидание чужой синхронизации, сек.
+CURRENCY_REFRESH_LOCK_TIMEOUT = 60
+CURRENCY_REFRESH_WAIT = 5
+# max-age для кешируемых GET-ответов (не дальше следующей публикации ЕЦБ), сек.
+CURRENCY_HTTP_MAX_AGE = 60
+# режим округления результата конвертации (имя из модуля decimal)
+CURRENCY_ROUNDING = "ROUND_HALF_EVEN"
+# источники курсов в порядке приоритета: опрашиваются параллельно, валюты
+# берутся из первого источника с самой свежей датой, недостающие - из следующих.
+# provider - класс из currency.providers, остальное - его параметры (timeout,
+# mirrors и hedge_after для HTTP-источников)
+CURRENCY_PROVIDERS = [
+    {"provider": "currency.providers.ECBDailyProvider", "timeout": 10},
+]
+# сколько ждать остальные источники после первого удачного ответа, сек.
+CURRENCY_PROVIDERS_GRACE = 0.5
+# keep-alive соединений на хост в общей HTTP-сессии источников
+CURRENCY_HTTP_POOL_SIZE = 10
+# через сколько дней удаленные валюты стираются командой purge_deleted_currencies
+CURRENCY_PURGE_AFTER_DAYS = 30
+# размер страницы истории курсов валюты по умолчанию и наибольший
+CURRENCY_HISTORY_PAGE_SIZE = 1000
+CURRENCY_HISTORY_MAX_PAGE_SIZE = 10000
+# строк в пакете потоковой выгрузки курсов (чтение курсором и запись ответа)
+CURRENCY_EXPORT_CHUNK_SIZE = 2000
+# файл снимка курсов и истории: пишется задачей синхронизации, воркеры
+# отображают его в память при старте; пустое значение отключает файл
+CURRENCY_SNAPSHOT_PATH = (
+    None
+    if TESTING
+    else os.getenv("CURRENCY_SNAPSHOT_PATH", str(BASE_DIR / "data" / "rates.snapshot"))
+)
+
+# logging
+# DEBUG-логи синхронизации включаются через LOG_LEVEL=DEBUG,
+# по умолчанию они отсекаются до форматирования
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "default": {
+            "format": "[%(asctime)s] [%(name)s] [%(levelname)s] > %(message)s",
+            "datefmt": "%Y-%m-%d %H:%M:%S",
+        },
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "default"},
+    },
+    "root": {"handlers": ["console"], "level": os.getenv("LOG_LEVEL", "INFO")},
+}
+
 INTERNAL_IPS = [
     # ...
     "127.0.0.1",  # Add your development machine's IP address here
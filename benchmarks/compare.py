@@ -0,0 +1,42 @@
+"""
+Сравнение двух отчетов benchmarks.run:
+    python -m benchmarks.compare before.json after.json
+"""
+
+import argparse
+import json
+
+METRICS = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "queries_per_request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение отчетов benchmarks.run")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    args = parser.parse_args()
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"{base['meta']['commit']} -> {new['meta']['commit']}")
+    print(f"{'scenario':<16}{'metric':<22}{'base':>12}{'new':>12}{'change':>10}")
+    for name, result in new["results"].items():
+        before = base["results"].get(name)
+        if before is None:
+            continue
+        for metric in METRICS:
+            old_value, new_value = before.get(metric), result.get(metric)
+            print(
+                f"{name:<16}{metric:<22}{old_value!s:>12}{new_value!s:>12}"
+                f"{_change(old_value, new_value):>10}"
+            )
+
+
+def _change(old_value, new_value):
+    if not old_value or new_value is None:
+        return "-"
+    return f"{(new_value - old_value) / old_value:+.1%}"
+
+
+if __name__ == "__main__":
+    main()
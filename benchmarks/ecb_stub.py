@@ -0,0 +1,111 @@
+"""
+Локальная заглушка ЕЦБ: отдает сохраненный eurofxref-daily.xml
+с настраиваемой задержкой и долей отказов (503). Поддерживает условные
+запросы: на совпавший If-None-Match отвечает 304 без тела.
+
+Отдельный запуск, например для сервера под нагрузкой:
+    python -m benchmarks.ecb_stub --port 8081 --latency 0.2 --failure-rate 0.1
+    ECB_URL=http://127.0.0.1:8081/stats/eurofxref/eurofxref-daily.xml gunicorn ...
+"""
+
+import argparse
+import hashlib
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+FIXTURE = Path(__file__).parent / "fixtures" / "eurofxref-daily.xml"
+PATH = "/stats/eurofxref/eurofxref-daily.xml"
+
+
+class ECBStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self, host="127.0.0.1", port=0, latency=0.0, failure_rate=0.0, seed=None
+    ):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.body = FIXTURE.read_bytes()
+        self.etag = f'"{hashlib.md5(self.body).hexdigest()}"'
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.failures = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{PATH}"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="ecb-stub", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def should_fail(self):
+        with self._lock:
+            self.requests += 1
+            fail = self.random.random() < self.failure_rate
+            self.failures += fail
+        return fail
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != PATH:
+            self.send_error(404)
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.should_fail():
+            self.send_error(503)
+            return
+        if self.headers.get("If-None-Match") == self.server.etag:
+            with self.server._lock:
+                self.server.not_modified += 1
+            self.send_response(304)
+            self.send_header("ETag", self.server.etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("ETag", self.server.etag)
+        self.send_header("Content-Length", str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка, сек.")
+    parser.add_argument(
+        "--failure-rate", type=float, default=0.0, help="Доля ответов 503 (0..1)"
+    )
+    args = parser.parse_args()
+    stub = ECBStub(args.host, args.port, args.latency, args.failure_rate)
+    print(f"ECB_URL={stub.url}", flush=True)
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        stub.server_close()
+
+
+if __name__ == "__main__":
+    main()
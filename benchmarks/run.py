@@ -0,0 +1,319 @@
+"""
+Воспроизводимые замеры производительности API.
+
+Поднимает заглушку ЕЦБ вместо utils.ECB_URL и тестовую БД, гоняет
+конкурентную нагрузку по сценариям и выводит p50/p95/p99, пропускную
+способность и число запросов к БД на запрос в JSON для сравнения коммитов.
+
+Запуск из корня репозитория:
+    python -m benchmarks.run --concurrency 8 --requests 500 --output before.json
+    python -m benchmarks.run --url http://127.0.0.1:8000  # по запущенному серверу
+    python -m benchmarks.compare before.json after.json
+"""
+
+import argparse
+import copy
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from io import StringIO
+from benchmarks.ecb_stub import ECBStub
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, connections  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+import httpx  # noqa: E402
+from currency import caching, utils  # noqa: E402
+
+CONVERT = {"from_currency": "USD", "to_currency": "JPY", "amount": 100}
+
+# сценарий: (метод, путь, тело, форма вместо JSON)
+HTTP_SCENARIOS = {
+    "list": ("GET", "/api/currencies/", None, False),
+    "retrieve": ("GET", "/api/currencies/USD/", None, False),
+    "convert": ("POST", "/api/currencies/convert/", CONVERT, False),
+    "calc_get": ("GET", "/calc/", None, False),
+    "calc_post": ("POST", "/calc/", CONVERT, True),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности API")
+    parser.add_argument("--url", help="Адрес запущенного сервера вместо in-process")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=500, help="На сценарий")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--cold-iterations", type=int, default=20)
+    parser.add_argument("--ecb-latency", type=float, default=0.05, help="сек.")
+    parser.add_argument("--ecb-failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=[*HTTP_SCENARIOS, "cold_sync", "import_command"],
+        help="Только указанные сценарии (можно повторять)",
+    )
+    parser.add_argument("--output", help="Файл для JSON (по умолчанию stdout)")
+    parser.add_argument(
+        "--verbose", action="store_true", help="Не глушить DEBUG-логи приложения"
+    )
+    args = parser.parse_args()
+    if not args.verbose:
+        # вывод DEBUG-логов в консоль искажает замеры и засоряет отчет
+        logging.disable(logging.INFO)
+
+    stub = ECBStub(
+        latency=args.ecb_latency, failure_rate=args.ecb_failure_rate, seed=args.seed
+    ).start()
+    utils.ECB_URL = stub.url
+    scenarios = args.scenario or [*HTTP_SCENARIOS, "cold_sync", "import_command"]
+    results = {}
+    try:
+        if args.url:
+            for name in scenarios:
+                if name in HTTP_SCENARIOS:
+                    results[name] = run_http(args, name)
+        else:
+            results = run_in_process(args, scenarios)
+    finally:
+        stub.stop()
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "mode": "http" if args.url else "in-process",
+            "target": args.url,
+            "cache": settings.CACHES["default"]["BACKEND"],
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "ecb_latency": args.ecb_latency,
+            "ecb_failure_rate": args.ecb_failure_rate,
+            "ecb_stub_requests": stub.requests,
+            "ecb_stub_failures": stub.failures,
+            "ecb_stub_not_modified": stub.not_modified,
+        },
+        "results": results,
+    }
+    _print_table(results)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+def run_in_process(args, scenarios):
+    """Сценарии через полный стек Django без сети, на тестовой БД."""
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, keepdb=False)
+    try:
+        with override_settings(CACHES=_benchmark_caches()):
+            try:
+                _clear_cache()
+                return _run_scenarios(args, scenarios)
+            finally:
+                _clear_cache()
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def _benchmark_caches():
+    # ключи бенчмарка - под своим префиксом в том же Redis: сброс кеша
+    # между сценариями не задевает данные приложения и других процессов
+    caches = copy.deepcopy(settings.CACHES)
+    caches["default"]["KEY_PREFIX"] = f"benchmark-{os.getpid()}"
+    return caches
+
+
+def _clear_cache():
+    """Удаляет только ключи бенчмарка, а не весь кеш (cache.clear())."""
+    if hasattr(cache, "delete_pattern"):
+        # django-redis: шаблон дополняется префиксом ключей бенчмарка
+        cache.delete_pattern("*")
+    elif settings.CACHES["default"]["BACKEND"].endswith("LocMemCache"):
+        # кеш в памяти этого процесса
+        cache.clear()
+    else:
+        raise RuntimeError("Бенчмарк поддерживает django-redis и LocMemCache")
+    caching.publish_invalidation()
+
+
+def _run_scenarios(args, scenarios):
+    results = {}
+    for name in scenarios:
+        if name in HTTP_SCENARIOS:
+            results[name] = _measure(
+                lambda client, n=name: _request(client, *HTTP_SCENARIOS[n]),
+                Client,
+                args.requests,
+                args.concurrency,
+                args.warmup,
+            )
+        elif name == "cold_sync":
+            results[name] = _cold_sync(args.cold_iterations)
+        elif name == "import_command":
+            results[name] = _measure(
+                _import_command, lambda: None, args.cold_iterations, 1, 0
+            )
+    return results
+
+
+def _cold_sync(iterations):
+    """Первый запрос после сброса кеша: синхронизация с ЕЦБ в потоке запроса."""
+
+    def cold_request(client):
+        _clear_cache()
+        return _request(client, *HTTP_SCENARIOS["list"])
+
+    with override_settings(CURRENCY_REFRESH_ASYNC=False):
+        return _measure(cold_request, Client, iterations, 1, 0)
+
+
+def _import_command(_):
+    call_command("import_exchange_rates", stdout=StringIO())
+    return True
+
+
+def run_http(args, name):
+    """Сценарий по HTTP к запущенному серверу; запросы к БД не видны."""
+    return _measure(
+        lambda client: _request(client, *HTTP_SCENARIOS[name]),
+        lambda: httpx.Client(base_url=args.url, timeout=30),
+        args.requests,
+        args.concurrency,
+        args.warmup,
+        count_queries=False,
+    )
+
+
+def _request(client, method, path, body, form):
+    if method == "GET":
+        response = client.get(path)
+    elif form:
+        response = client.post(path, data=body)
+    elif isinstance(client, httpx.Client):
+        response = client.post(path, json=body)
+    else:
+        response = client.post(path, data=body, content_type="application/json")
+    return response.status_code < 400
+
+
+def _measure(operation, make_client, total, concurrency, warmup, count_queries=True):
+    latencies, queries, errors = [], [], []
+    lock = threading.Lock()
+    per_worker = [
+        total // concurrency + (i < total % concurrency) for i in range(concurrency)
+    ]
+
+    def worker(count):
+        client = make_client()
+        for _ in range(warmup):
+            operation(client)
+        counter = _QueryCounter()
+        with connection.execute_wrapper(counter):
+            for _ in range(count):
+                counter.count = 0
+                start = time.perf_counter()
+                try:
+                    ok = operation(client)
+                except Exception:
+                    ok = False
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    queries.append(counter.count)
+                    errors.append(not ok)
+        connection.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, per_worker))
+    wall = time.perf_counter() - start
+    return _summary(latencies, queries if count_queries else None, sum(errors), wall)
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _summary(latencies, queries, errors, wall):
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "wall_s": round(wall, 4),
+        "throughput_rps": round(len(ordered) / wall, 2) if wall else None,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None,
+        "p50_ms": _percentile(ordered, 50),
+        "p95_ms": _percentile(ordered, 95),
+        "p99_ms": _percentile(ordered, 99),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else None,
+        "queries_per_request": (
+            round(sum(queries) / len(queries), 2) if queries else None
+        ),
+    }
+
+
+def _percentile(ordered, p):
+    if not ordered:
+        return None
+    index = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return round(ordered[index] * 1000, 3)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_table(results):
+    print(
+        f"{'scenario':<16}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}"
+        f"{'queries':>10}{'errors':>8}",
+        file=sys.stderr,
+    )
+    for name, r in results.items():
+        print(
+            f"{name:<16}{r['throughput_rps']!s:>10}{r['p50_ms']!s:>10}"
+            f"{r['p95_ms']!s:>10}{r['p99_ms']!s:>10}"
+            f"{r['queries_per_request']!s:>10}{r['errors']:>8}",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
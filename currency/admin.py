@@ -1,6 +1,18 @@
 from django.contrib import admin
-from currency.models import Currency
+from currency.models import Currency, CurrencyQuote, CurrencyRate
 
 # Register your models here.
 @admin.register(Currency)
 class ChatAdmin(admin.ModelAdmin): ...
+
+
+@admin.register(CurrencyRate)
+class CurrencyRateAdmin(admin.ModelAdmin):
+    list_display = ("currency_name", "rate", "actual_date")
+    list_filter = ("currency_name",)
+
+
+@admin.register(CurrencyQuote)
+class CurrencyQuoteAdmin(admin.ModelAdmin):
+    list_display = ("base", "currency_name", "rate", "actual_date")
+    list_filter = ("base",)
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class CurrencyConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "currency"
+
+    def ready(self):
+        from currency import snapfile
+
+        # файл снимка отображается в память при старте воркера,
+        # курсы из него собираются при первом запросе без обращения к БД
+        snapfile.mapped()
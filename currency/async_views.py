@@ -0,0 +1,241 @@
+import json
+from datetime import date
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import render
+from django.urls import URLPattern
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAcceptable, NotFound
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+from currency import caching, export, sync
+from currency.responses import PrerenderedResponse
+from currency.serializers import CurrencyConvertSerializer
+from currency.views import (
+    build_currencies_entry,
+    build_currency_entry,
+    cacheable_get_response,
+    cacheable_get_serializer,
+    calc_rates_script,
+)
+
+# Async-представления канонических маршрутов чтения и конвертации: под ASGI
+# они не занимают поток, кеш читается через async API Django. Ответы
+# совпадают с представлениями DRF. Запросы, которые они не обслуживают
+# (запись, браузерный API, ошибки разбора тела), передаются представлению
+# DRF того же URL - см. dispatch.
+
+# тела запросов, которые разбирают и async-представления, и парсеры DRF
+FORM_TYPES = ("application/x-www-form-urlencoded", "multipart/form-data")
+
+
+def dispatch(view, fallback):
+    """
+    Маршрут для async-представления view. Если view вернуло None,
+    запрос обрабатывает fallback - синхронное представление DRF.
+    """
+
+    @wraps(view)
+    async def dispatcher(request, *args, **kwargs):
+        response = await view(request, *args, **kwargs)
+        if response is None:
+            response = await sync_to_async(fallback)(request, *args, **kwargs)
+        return response
+
+    # CSRF проверяют, как и раньше, представления DRF (APIView.as_view)
+    return csrf_exempt(dispatcher)
+
+
+def with_async_views(urls, views):
+    """
+    Маршруты роутера DRF, в которых запросы сначала получают
+    async-представления views (имя маршрута -> представление).
+    Маршруты с суффиксом формата (.json, .api) остаются у DRF.
+    """
+    return [
+        (
+            URLPattern(
+                url.pattern,
+                dispatch(views[url.name], url.callback),
+                url.default_args,
+                url.name,
+            )
+            if url.name in views and "format" not in url.pattern.regex.groupindex
+            else url
+        )
+        for url in urls
+    ]
+
+
+async def currency_list(request):
+    if request.method not in ("GET", "HEAD") or not _accepts_json(request):
+        return None
+    entry = await _aget_rendered(_key(caching.acurrencies_key), build_currencies_entry)
+    return _render(PrerenderedResponse(request, entry))
+
+
+async def currency_detail(request, currency):
+    if request.method not in ("GET", "HEAD") or not _accepts_json(request):
+        return None
+    currency_name = currency.upper()
+    entry = await _aget_rendered(
+        _key(caching.acurrency_key, currency_name),
+        lambda currencies: build_currency_entry(currencies, currency_name),
+    )
+    if entry is None:
+        return _drf_error(NotFound(f"Валюта {currency_name} не найдена"))
+    return _render(PrerenderedResponse(request, entry))
+
+
+async def currency_convert(request):
+    if not _accepts_json(request):
+        return None
+    if request.method in ("GET", "HEAD"):
+        serializer = cacheable_get_serializer(
+            CurrencyConvertSerializer, request.GET, await sync.aget_rate_snapshot()
+        )
+        await _validate(serializer)
+        try:
+            return _render(cacheable_get_response(request, serializer))
+        except APIException as e:
+            return _drf_error(e)
+    if request.method != "POST":
+        return None
+    data = _request_data(request)
+    if data is None:
+        return None
+    serializer = CurrencyConvertSerializer(
+        data=data, context={"snapshot": await sync.aget_rate_snapshot()}
+    )
+    await _validate(serializer)
+    if serializer.errors:
+        return _render(Response(serializer.errors, status.HTTP_400_BAD_REQUEST))
+    return _render(Response(serializer.data))
+
+
+async def calc(request):
+    if request.method not in ("GET", "HEAD", "POST"):
+        return None
+    snapshot = await sync.aget_rate_snapshot()
+    context = {"rates_script": calc_rates_script(snapshot)}
+    if request.method != "POST":
+        context["serializer"] = CurrencyConvertSerializer(
+            context={"snapshot": snapshot}
+        )
+        return render(request, "calc.html", context)
+    data = _request_data(request)
+    if data is None:
+        return None
+    serializer = CurrencyConvertSerializer(data=data, context={"snapshot": snapshot})
+    await _validate(serializer)
+    if serializer.errors:
+        result = "Нельзя указывать одинаковые валюты"
+    else:
+        result = serializer.data.get("result")
+    context.update(serializer=serializer, result=result)
+    return render(request, "calc.html", context)
+
+
+@require_GET
+async def export_rates(request, table, fmt):
+    """
+    Потоковая выгрузка текущих курсов или истории (NDJSON или CSV).
+    Итератор под тип сервера: под ASGI синхронный, а под WSGI асинхронный
+    ответ был бы собран целиком.
+    """
+    params = request.GET
+    filters = {"currencies": [c.upper() for c in params.getlist("currency")]}
+    try:
+        for param, name in (("from", "start"), ("to", "end")):
+            if param in params:
+                filters[name] = date.fromisoformat(params[param])
+    except ValueError as e:
+        return JsonResponse({"detail": f"Неверная дата - {e}"}, status=400)
+    if isinstance(request, ASGIRequest):
+        chunks = export.aiter_export(table, fmt, **filters)
+    else:
+        chunks = export.iter_export(table, fmt, **filters)
+    response = StreamingHttpResponse(chunks, content_type=export.CONTENT_TYPES[fmt])
+    response["Content-Disposition"] = f'attachment; filename="rates-{table}.{fmt}"'
+    return response
+
+
+def _accepts_json(request):
+    # рендерер, который выбрал бы DRF: остальные (браузерный API) - у DRF
+    renderers = [renderer() for renderer in api_settings.DEFAULT_RENDERER_CLASSES]
+    try:
+        renderer, _ = DefaultContentNegotiation().select_renderer(
+            Request(request), renderers
+        )
+    except NotAcceptable:
+        return False
+    return isinstance(renderer, JSONRenderer)
+
+
+def _request_data(request):
+    """Тело запроса или None, если его разбор надо оставить парсерам DRF."""
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    if request.content_type in FORM_TYPES or not request.body:
+        return request.POST
+    return None
+
+
+async def _validate(serializer):
+    if serializer.initial_data.get("date"):
+        # конвертация на дату читает историю курсов из БД
+        await sync_to_async(serializer.is_valid)()
+    else:
+        serializer.is_valid()
+
+
+def _render(response):
+    """Ответ DRF в JSON - так же, как его отрендерило бы представление DRF."""
+    response.accepted_renderer = JSONRenderer()
+    response.accepted_media_type = response.accepted_renderer.media_type
+    response.renderer_context = {}
+    if len(api_settings.DEFAULT_RENDERER_CLASSES) > 1:
+        patch_vary_headers(response, ["Accept"])
+    return response.render()
+
+
+def _drf_error(exc):
+    return _render(exception_handler(exc, {}))
+
+
+def _key(make_key, *args):
+    async def key():
+        return f"{await make_key(*args)}:rendered"
+
+    return key
+
+
+async def _aget_rendered(make_key, build):
+    key = await make_key()
+    cached = await caching.aget_many([key, "currencies_fresh"])
+    entry = cached.get(key)
+    if entry is not None and cached.get("currencies_fresh"):
+        return entry
+    currencies = await sync.acheck_cached_currencies()
+    if entry is not None and await make_key() == key:
+        return entry
+    entry = build(currencies)
+    if entry is not None:
+        await caching.aset(
+            await make_key(), entry, timeout=settings.CURRENCY_STALE_TIMEOUT
+        )
+    return entry
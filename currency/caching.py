@@ -0,0 +1,273 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+
+# Двухуровневый кеш: L1 - ограниченный LRU с TTL в памяти процесса,
+# L2 - общий кеш Django (Redis). Горячие чтения (версии ключей, флаг
+# свежести, готовые тела ответов) обслуживаются из L1 без сетевого запроса.
+# При изменении данных L1 очищается во всех воркерах через Redis pub/sub;
+# пока подписка не активна, L1 не используется. С другим бэкендом кеша
+# расхождение воркеров ограничено CURRENCY_LOCAL_CACHE_TTL.
+
+GENERATION_KEY = "currencies:generation"
+INVALIDATION_CHANNEL = "currencies:invalidate"
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCache:
+    """LRU-кеш процесса: записи живут не дольше заданного при записи ttl."""
+
+    def __init__(self):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # номер сброса: запись, прочитанная из L2 до сброса, в L1 не попадает
+        self.epoch = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl, epoch, maxsize):
+        with self._lock:
+            if epoch != self.epoch:
+                return
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.epoch += 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+local = LocalCache()
+
+_listener = None
+_listener_lock = threading.Lock()
+# L1 согласован с другими воркерами: подписка на инвалидацию активна
+_coherent = False
+
+
+def redis_client():
+    """Клиент Redis из django-redis или None для другого бэкенда кеша."""
+    try:
+        from django_redis import get_redis_connection
+
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def _local_enabled():
+    if not settings.CURRENCY_LOCAL_CACHE_TTL:
+        return False
+    if _listener is None:
+        _start_listener()
+    return _coherent
+
+
+def _start_listener():
+    global _listener, _coherent
+    with _listener_lock:
+        if _listener is not None:
+            return
+        connection = redis_client()
+        if connection is None:
+            _listener, _coherent = False, True
+            return
+        # поток запускается при первом чтении, то есть уже в воркере
+        _listener = threading.Thread(
+            target=_listen,
+            args=(connection,),
+            name="currency-cache-invalidation",
+            daemon=True,
+        )
+        _listener.start()
+
+
+def _listen(connection):
+    global _coherent
+    channel = cache.make_key(INVALIDATION_CHANNEL)
+    while True:
+        pubsub = connection.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(channel)
+            local.clear()
+            _coherent = True
+            for _ in pubsub.listen():
+                local.clear()
+        except Exception as e:
+            logger.warning(f"Подписка на инвалидацию кеша потеряна: {e}")
+        finally:
+            _coherent = False
+            local.clear()
+            pubsub.close()
+        time.sleep(1)
+
+
+def publish_invalidation():
+    """Очищает L1 этого процесса и всех воркеров, подписанных через Redis."""
+    local.clear()
+    connection = redis_client()
+    if connection is None:
+        return
+    try:
+        connection.publish(cache.make_key(INVALIDATION_CHANNEL), b"1")
+    except Exception as e:
+        logger.warning(f"Инвалидация кеша не разослана: {e}")
+
+
+def _local_set(key, value, timeout, epoch):
+    ttl = settings.CURRENCY_LOCAL_CACHE_TTL
+    if timeout is not None:
+        ttl = min(ttl, timeout)
+    local.set(key, value, ttl, epoch, settings.CURRENCY_LOCAL_CACHE_SIZE)
+
+
+def get(key):
+    """cache.get через L1; отсутствующие в L2 ключи в L1 не запоминаются."""
+    if not _local_enabled():
+        return cache.get(key)
+    value = local.get(key)
+    if value is None:
+        epoch = local.epoch
+        value = cache.get(key)
+        if value is not None:
+            _local_set(key, value, None, epoch)
+    return value
+
+
+def get_many(keys):
+    if not _local_enabled():
+        return cache.get_many(keys)
+    found = {}
+    for key in keys:
+        value = local.get(key)
+        if value is not None:
+            found[key] = value
+    missing = [key for key in keys if key not in found]
+    if missing:
+        epoch = local.epoch
+        for key, value in cache.get_many(missing).items():
+            found[key] = value
+            _local_set(key, value, None, epoch)
+    return found
+
+
+def set(key, value, timeout):
+    cache.set(key, value, timeout=timeout)
+    if _local_enabled():
+        _local_set(key, value, timeout, local.epoch)
+
+
+async def aget(key):
+    if not _local_enabled():
+        return await cache.aget(key)
+    value = local.get(key)
+    if value is None:
+        epoch = local.epoch
+        value = await cache.aget(key)
+        if value is not None:
+            _local_set(key, value, None, epoch)
+    return value
+
+
+async def aget_many(keys):
+    if not _local_enabled():
+        return await cache.aget_many(keys)
+    found = {}
+    for key in keys:
+        value = local.get(key)
+        if value is not None:
+            found[key] = value
+    missing = [key for key in keys if key not in found]
+    if missing:
+        epoch = local.epoch
+        for key, value in (await cache.aget_many(missing)).items():
+            found[key] = value
+            _local_set(key, value, None, epoch)
+    return found
+
+
+async def aset(key, value, timeout):
+    await cache.aset(key, value, timeout=timeout)
+    if _local_enabled():
+        _local_set(key, value, timeout, local.epoch)
+
+
+def _counter(key):
+    value = get(key)
+    if value is None:
+        # после вытеснения счетчик продолжается с текущего времени,
+        # чтобы не совпасть со старыми версиями ключей
+        cache.add(key, time.time_ns(), timeout=None)
+        value = cache.get(key)
+    return value
+
+
+async def _acounter(key):
+    value = await aget(key)
+    if value is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        value = await cache.aget(key)
+    return value
+
+
+def _bump(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+        return cache.incr(key)
+
+
+def generation():
+    """Поколение набора курсов: меняется при любом изменении валют."""
+    return _counter(GENERATION_KEY)
+
+
+def currencies_key():
+    return f"currencies:v{generation()}"
+
+
+async def acurrencies_key():
+    return f"currencies:v{await _acounter(GENERATION_KEY)}"
+
+
+def currency_key(currency_name):
+    version = _counter(f"currency:{currency_name}:version")
+    return f"currency:{currency_name}:v{version}"
+
+
+async def acurrency_key(currency_name):
+    version = await _acounter(f"currency:{currency_name}:version")
+    return f"currency:{currency_name}:v{version}"
+
+
+def invalidate(currency_names=()):
+    """
+    Инвалидирует записи, зависящие от всего набора курсов, и записи
+    перечисленных валют. Кеш остальных валют остается теплым.
+    """
+    for currency_name in currency_names:
+        _bump(f"currency:{currency_name}:version")
+    generation = _bump(GENERATION_KEY)
+    publish_invalidation()
+    return generation
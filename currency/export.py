@@ -0,0 +1,100 @@
+import csv
+import io
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from currency.models import Currency, CurrencyRate
+
+# Выгрузка таблиц курсов для хранилища данных. Строки читаются из БД
+# курсором пакетами по CURRENCY_EXPORT_CHUNK_SIZE (на PostgreSQL - курсор
+# на стороне сервера), каждый пакет сразу форматируется и отдается,
+# поэтому память не зависит от числа строк.
+
+FIELDS = {
+    "current": ("currency_name", "rate", "actual_date", "is_modified"),
+    "history": ("currency_name", "actual_date", "rate"),
+}
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def queryset(table, start=None, end=None, currencies=()):
+    """Строки таблицы current (текущие курсы) или history кортежами FIELDS."""
+    if table == "current":
+        rows = Currency.objects.filter(deleted_date=None).order_by("currency_name")
+    else:
+        # порядок уникального индекса (валюта, дата) - без сортировки в БД
+        rows = CurrencyRate.objects.order_by("currency_name", "actual_date")
+    if start is not None:
+        rows = rows.filter(actual_date__gte=start)
+    if end is not None:
+        rows = rows.filter(actual_date__lte=end)
+    if currencies:
+        rows = rows.filter(currency_name__in=currencies)
+    return rows.values_list(*FIELDS[table])
+
+
+def iter_export(table, fmt, **filters):
+    """Выгрузка в формате ndjson или csv кусками текста по пакету строк."""
+    chunk_size = settings.CURRENCY_EXPORT_CHUNK_SIZE
+    formatter = _Formatter(table, fmt)
+    header = formatter.header()
+    if header:
+        yield header
+    chunk = []
+    for row in queryset(table, **filters).iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield formatter.rows(chunk)
+            chunk = []
+    if chunk:
+        yield formatter.rows(chunk)
+
+
+async def aiter_export(table, fmt, **filters):
+    """
+    То же для ASGI: синхронный итератор Django буферизует ответ целиком.
+    Каждый пакет читается и форматируется в потоке для синхронного кода
+    (всегда одном, с тем же соединением и курсором).
+    """
+    chunks = iter_export(table, fmt, **filters)
+    while True:
+        chunk = await sync_to_async(next)(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+class _Formatter:
+    def __init__(self, table, fmt):
+        if fmt not in CONTENT_TYPES:
+            raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+        self.fields = FIELDS[table]
+        self.fmt = fmt
+
+    def header(self):
+        if self.fmt == "csv":
+            return self._csv([self.fields])
+        return ""
+
+    def rows(self, rows):
+        rows = [[_value(value) for value in row] for row in rows]
+        if self.fmt == "csv":
+            return self._csv(rows)
+        return "".join(
+            json.dumps(dict(zip(self.fields, row)), separators=(",", ":")) + "\n"
+            for row in rows
+        )
+
+    def _csv(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        return buffer.getvalue()
+
+
+def _value(value):
+    # курсы - строкой без потери точности, как в API; даты - ISO
+    if isinstance(value, bool):
+        return value
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
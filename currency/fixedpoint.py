@@ -0,0 +1,119 @@
+from decimal import (
+    ROUND_CEILING,
+    ROUND_DOWN,
+    ROUND_FLOOR,
+    ROUND_HALF_DOWN,
+    ROUND_HALF_EVEN,
+    ROUND_HALF_UP,
+    ROUND_UP,
+    Decimal,
+)
+
+# Точная конвертация в целых числах: курсы хранятся как целые
+# с масштабом 10**RATE_PLACES, суммы - как дробь (числитель, знаменатель).
+# Результат делится один раз с выбранным режимом округления.
+
+RATE_PLACES = 7  # как decimal_places у Currency.rate
+RATE_SCALE = 10**RATE_PLACES
+RESULT_PLACES = 7
+CROSS_RATE_PLACES = 10
+
+# режимы округления - имена из модуля decimal
+ROUNDING_MODES = (
+    ROUND_HALF_EVEN,
+    ROUND_HALF_UP,
+    ROUND_HALF_DOWN,
+    ROUND_UP,
+    ROUND_DOWN,
+    ROUND_CEILING,
+    ROUND_FLOOR,
+)
+
+_HALF_MODES = frozenset((ROUND_HALF_EVEN, ROUND_HALF_UP, ROUND_HALF_DOWN))
+
+# ISO 4217: знаков после запятой у валют ЕЦБ, если не 2
+MINOR_UNITS = {"ISK": 0, "JPY": 0, "KRW": 0}
+DEFAULT_MINOR_UNITS = 2
+
+_POWERS = [10**i for i in range(64)]
+
+
+def minor_units(currency_name):
+    return MINOR_UNITS.get(currency_name, DEFAULT_MINOR_UNITS)
+
+
+def to_units(value, places=RATE_PLACES, rounding=ROUND_HALF_EVEN):
+    """Decimal (или строка/int) в целое с масштабом 10**places."""
+    numerator, denominator = split(value)
+    return divide(numerator * _power(places), denominator, rounding)
+
+
+def split(value):
+    """Точное представление числа дробью (числитель, знаменатель > 0)."""
+    if isinstance(value, int):
+        return value, 1
+    if not isinstance(value, Decimal):
+        value = Decimal(value)
+    return value.as_integer_ratio()
+
+
+def divide(numerator, denominator, rounding=ROUND_HALF_EVEN):
+    """Целочисленное деление (denominator > 0) с режимом округления."""
+    quotient, remainder = divmod(numerator, denominator)
+    if not remainder:
+        return quotient
+    # divmod округляет вниз: quotient - ближайшее меньшее, quotient + 1 - большее
+    if rounding in _HALF_MODES:
+        twice = 2 * remainder
+        if twice != denominator:
+            return quotient + (twice > denominator)
+        # ровно посередине
+        if rounding == ROUND_HALF_EVEN:
+            return quotient + (quotient & 1)
+        if rounding == ROUND_HALF_UP:
+            return quotient + (numerator > 0)
+        return quotient + (numerator < 0)
+    if rounding == ROUND_FLOOR:
+        return quotient
+    if rounding == ROUND_CEILING:
+        return quotient + 1
+    if rounding == ROUND_DOWN:
+        return quotient + (numerator < 0)
+    if rounding == ROUND_UP:
+        return quotient + (numerator > 0)
+    raise ValueError(f"Неизвестный режим округления: {rounding}")
+
+
+def convert(amount, from_rate, to_rate, places=RESULT_PLACES, rounding=ROUND_HALF_EVEN):
+    """
+    amount * to_rate / from_rate с масштабом 10**places.
+    amount - дробь из split, курсы - целые из to_units с одинаковым масштабом.
+    """
+    numerator, denominator = amount
+    return divide(
+        numerator * to_rate * _power(places), denominator * from_rate, rounding
+    )
+
+
+def cross_rate(from_rate, to_rate, places=CROSS_RATE_PLACES):
+    return divide(to_rate * _power(places), from_rate)
+
+
+def format_units(units, places):
+    """Целое с масштабом 10**places в строку с places знаками."""
+    sign = "-" if units < 0 else ""
+    digits = str(abs(units)).rjust(places + 1, "0")
+    if not places:
+        return sign + digits
+    return f"{sign}{digits[:-places]}.{digits[-places:]}"
+
+
+def plain(value):
+    """Decimal без лишних нулей и экспоненты: 20.5000 -> "20.5"."""
+    return format(Decimal(value).normalize(), "f")
+
+
+def _power(exponent):
+    if exponent < len(_POWERS):
+        return _POWERS[exponent]
+    return 10**exponent
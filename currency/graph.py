@@ -0,0 +1,144 @@
+import heapq
+from math import gcd
+from currency import fixedpoint
+
+# Граф котировок: вершины - валюты, ребра - котировки пар в обе стороны.
+# Лучшие пути между всеми парами считаются один раз при смене курсов,
+# поиск маршрута при запросе - обращение по индексу.
+#
+# Лучший путь - с наименьшим числом пересчетов, при равенстве - тот,
+# у которого самая старая котировка свежее. Курс маршрута хранится
+# точной дробью (произведение курсов по пути), округляется один раз.
+
+
+class Quote:
+    """Котировка пары: 1 base = units / 10**RATE_PLACES quote на дату actual_date."""
+
+    __slots__ = ("base", "quote", "units", "actual_date")
+
+    def __init__(self, base, quote, units, actual_date):
+        self.base = base
+        self.quote = quote
+        self.units = units
+        self.actual_date = actual_date
+
+    def __repr__(self):
+        return f"<Quote {self.base}/{self.quote}={self.units} {self.actual_date}>"
+
+
+class Hop:
+    """Шаг маршрута: курс from -> to дробью numerator / denominator."""
+
+    __slots__ = ("from_currency", "to_currency", "numerator", "denominator", "quote")
+
+    def __init__(self, quote, inverse=False):
+        self.quote = quote
+        if inverse:
+            self.from_currency, self.to_currency = quote.quote, quote.base
+            self.numerator, self.denominator = fixedpoint.RATE_SCALE, quote.units
+        else:
+            self.from_currency, self.to_currency = quote.base, quote.quote
+            self.numerator, self.denominator = quote.units, fixedpoint.RATE_SCALE
+
+    @property
+    def actual_date(self):
+        return self.quote.actual_date
+
+    def rate(self, places=fixedpoint.CROSS_RATE_PLACES):
+        return fixedpoint.cross_rate(self.denominator, self.numerator, places)
+
+
+class Route:
+    __slots__ = ("path", "hops", "numerator", "denominator", "actual_date")
+
+    def __init__(self, path, hops):
+        numerator = denominator = 1
+        for hop in hops:
+            numerator *= hop.numerator
+            denominator *= hop.denominator
+        common = gcd(numerator, denominator)
+        self.path = path
+        self.hops = hops
+        self.numerator = numerator // common
+        self.denominator = denominator // common
+        # дата самой старой котировки на пути
+        self.actual_date = min((hop.actual_date for hop in hops), default=None)
+
+    def cross_rate(self, places=fixedpoint.CROSS_RATE_PLACES):
+        """Курс маршрута целым с масштабом 10**places."""
+        return fixedpoint.cross_rate(self.denominator, self.numerator, places)
+
+    def __repr__(self):
+        return f"<Route {'->'.join(self.path)}>"
+
+
+class RateGraph:
+    """
+    Граф котировок с лучшими маршрутами между всеми парами валют.
+    codes - порядок позиций (валюты без котировок недостижимы),
+    по умолчанию - в порядке появления в котировках.
+    """
+
+    __slots__ = ("codes", "index", "routes")
+
+    def __init__(self, quotes, codes=()):
+        edges = {}
+        for quote in quotes:
+            # нулевой или отрицательный курс в обратную сторону не делится:
+            # такая котировка пропускается, а не ломает весь граф
+            if quote.units <= 0:
+                continue
+            # из нескольких котировок пары остается самая свежая, при
+            # равенстве - первая (источник с большим приоритетом)
+            for hop in (Hop(quote), Hop(quote, inverse=True)):
+                key = hop.from_currency, hop.to_currency
+                current = edges.get(key)
+                if current is None or current.actual_date < hop.actual_date:
+                    edges[key] = hop
+        order = dict.fromkeys(codes)
+        for from_currency, to_currency in edges:
+            order.setdefault(from_currency)
+            order.setdefault(to_currency)
+        self.codes = tuple(order)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        adjacency = [[] for _ in self.codes]
+        for (from_currency, to_currency), hop in edges.items():
+            adjacency[self.index[from_currency]].append(hop)
+        self.routes = tuple(
+            self._routes_from(source, adjacency) for source in range(len(self.codes))
+        )
+
+    def _routes_from(self, source, adjacency):
+        # Дейкстра по стоимости (число шагов, -ordinal самой старой котировки):
+        # стоимость не убывает вдоль пути, поэтому первый снятый из кучи
+        # путь до вершины - лучший; счетчик упорядочивает равные пути
+        # по порядку ребер
+        index = self.index
+        best = {source: (0, 0)}
+        heap = [((0, 0), 0, source, ())]
+        routes = [None] * len(self.codes)
+        counter = 0
+        while heap:
+            cost, _, vertex, hops = heapq.heappop(heap)
+            if routes[vertex] is not None:
+                continue
+            path = (self.codes[source], *(hop.to_currency for hop in hops))
+            routes[vertex] = Route(path, hops)
+            for hop in adjacency[vertex]:
+                target = index[hop.to_currency]
+                if routes[target] is not None:
+                    continue
+                age = -hop.actual_date.toordinal()
+                new_cost = (cost[0] + 1, max(cost[1], age) if hops else age)
+                if target not in best or new_cost < best[target]:
+                    best[target] = new_cost
+                    counter += 1
+                    heapq.heappush(heap, (new_cost, counter, target, hops + (hop,)))
+        return tuple(routes)
+
+    def route(self, from_currency, to_currency):
+        """Лучший маршрут или None, если валюты не связаны котировками."""
+        f, t = self.index.get(from_currency), self.index.get(to_currency)
+        if f is None or t is None:
+            return None
+        return self.routes[f][t]
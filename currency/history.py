@@ -0,0 +1,190 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from decimal import Decimal
+from itertools import islice
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import cache
+from currency import caching, fixedpoint, snapfile, sync
+from currency.models import Currency, CurrencyRate
+
+
+def import_history(rows, chunk_size=5000):
+    """
+    Записывает поток (дата, валюта, курс) в историю курсов чанками
+    bulk_create. Уже загруженные пары (валюта, дата) пропускаются.
+    Возвращает количество обработанных строк.
+    """
+    rows = iter(rows)
+    total = 0
+    while True:
+        chunk = [
+            CurrencyRate(currency_name=currency, rate=Decimal(rate), actual_date=day)
+            for day, currency, rate in islice(rows, chunk_size)
+        ]
+        if not chunk:
+            break
+        CurrencyRate.objects.bulk_create(chunk, ignore_conflicts=True)
+        total += len(chunk)
+    cache.set("rate_history_version", uuid4().hex, timeout=None)
+    caching.publish_invalidation()
+    return total
+
+
+class RateHistoryIndex:
+    """
+    Индекс истории курсов в памяти: отсортированный массив дат фиксингов
+    и по колонке курсов на каждую валюту (None - курса в этот день нет).
+    Поиск курса на дату - бинарный поиск по датам без запросов к БД.
+    """
+
+    __slots__ = ("version", "dates", "columns")
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        self.dates = array("l")
+        self.columns = {}
+        for day, currency, rate in rows:
+            self._set(day, currency, rate)
+        for column in self.columns.values():
+            column.extend([None] * (len(self.dates) - len(column)))
+
+    @classmethod
+    def from_arrays(cls, dates, columns, version=None):
+        """Индекс поверх готовых массивов (например, из файла снимка)."""
+        index = cls((), version)
+        index.dates = dates
+        index.columns = columns
+        return index
+
+    def _set(self, day, currency, rate):
+        ordinal = day.toordinal()
+        if not self.dates or ordinal > self.dates[-1]:
+            self.dates.append(ordinal)
+            position = len(self.dates) - 1
+        else:
+            position = bisect_right(self.dates, ordinal) - 1
+            if position < 0 or self.dates[position] != ordinal:
+                return
+        column = self.columns.setdefault(currency, [])
+        if len(column) <= position:
+            column.extend([None] * (position + 1 - len(column)))
+        column[position] = fixedpoint.to_units(str(rate))
+
+    def fixing(self, day):
+        """Номер последнего фиксинга ЕЦБ не позже day или None."""
+        position = bisect_right(self.dates, day.toordinal()) - 1
+        return position if position >= 0 else None
+
+    def fixing_date(self, position):
+        return date.fromordinal(self.dates[position])
+
+    def rate(self, currency, position):
+        """Курс к EUR целым с масштабом 10**RATE_PLACES или None."""
+        if currency == "EUR":
+            return fixedpoint.RATE_SCALE
+        column = self.columns.get(currency)
+        if column is None or position >= len(column):
+            return None
+        # в массивах из файла снимка 0 - курса нет
+        return column[position] or None
+
+    def fixing_rates(self, from_currency, to_currency, day):
+        """
+        Курсы пары по последнему фиксингу не позже day.
+        Возвращает (курс from, курс to, дата фиксинга) или None, если курса нет.
+        """
+        position = self.fixing(day)
+        if position is None:
+            return None
+        from_rate = self.rate(from_currency, position)
+        to_rate = self.rate(to_currency, position)
+        if from_rate is None or to_rate is None:
+            return None
+        return from_rate, to_rate, self.fixing_date(position)
+
+    def series(self, currency, base="EUR", start=None, end=None):
+        """
+        Курсы currency и base по фиксингам с start по end включительно:
+        (дата, курс currency, курс base), дни без курса одной из валют
+        пропускаются. Начало периода находится бинарным поиском.
+        """
+        low = 0 if start is None else bisect_left(self.dates, start.toordinal())
+        high = len(self.dates)
+        if end is not None:
+            high = bisect_right(self.dates, end.toordinal())
+        for position in range(low, high):
+            rate = self.rate(currency, position)
+            base_rate = self.rate(base, position)
+            if rate is not None and base_rate is not None:
+                yield self.fixing_date(position), rate, base_rate
+
+    def __len__(self):
+        return len(self.dates)
+
+
+_history_index = None
+
+
+def get_history_index():
+    """
+    Индекс истории текущего процесса: загруженная история плюс текущие
+    (не измененные вручную) курсы ЕЦБ. Пересобирается только при записи
+    истории - импортом или синхронизацией с ЕЦБ, которая единственная
+    меняет текущие курсы ЕЦБ; ручные изменения валют индекс не трогают.
+    """
+    global _history_index
+    version = caching.get("rate_history_version")
+    if version is None:
+        # после сброса кеша версия берется из файла снимка, если он есть
+        mapped = snapfile.mapped()
+        initial = (mapped and mapped.history_version) or uuid4().hex
+        cache.add("rate_history_version", initial, timeout=None)
+        version = cache.get("rate_history_version")
+    index = _history_index
+    if index is not None and index.version == version:
+        return index
+    mapped = snapfile.mapped()
+    if mapped is not None and mapped.history_version == version:
+        _history_index = RateHistoryIndex.from_arrays(*mapped.history_arrays(), version)
+    else:
+        _history_index = RateHistoryIndex(_iter_index_rows(), version)
+    return _history_index
+
+
+def save_snapshot_file(path=None, only_changed=False):
+    """
+    Записывает текущие снимок курсов и индекс истории в файл снимка
+    для воркеров. С only_changed файл с теми же версиями не перезаписывается.
+    Возвращает путь или None, если файл отключен.
+    """
+    path = path or settings.CURRENCY_SNAPSHOT_PATH
+    if not path:
+        return None
+    snapshot, index = sync.get_rate_snapshot(), get_history_index()
+    history = index if len(index) else None
+    mapped = None
+    if only_changed and path == settings.CURRENCY_SNAPSHOT_PATH:
+        mapped = snapfile.mapped()
+    if (
+        mapped is not None
+        and mapped.version == snapshot.version
+        and mapped.history_version == (history and history.version)
+    ):
+        return path
+    snapfile.write(path, snapshot, history)
+    return path
+
+
+def _iter_index_rows():
+    yield from (
+        CurrencyRate.objects.order_by("actual_date")
+        .values_list("actual_date", "currency_name", "rate")
+        .iterator(chunk_size=10000)
+    )
+    yield from (
+        Currency.objects.filter(deleted_date=None, is_modified=False)
+        .order_by("actual_date")
+        .values_list("actual_date", "currency_name", "rate")
+    )
@@ -0,0 +1,84 @@
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from currency import caching
+
+# Проверка и запись одним скриптом Redis: между чтением токена и записью
+# (удалением) ключ не может смениться. Целые числа django-redis хранит
+# как есть, без сериализации, поэтому токены сравниваются строками.
+FENCE_SCRIPT = """
+local committed = tonumber(redis.call("GET", KEYS[1]) or "0")
+if tonumber(ARGV[1]) < committed then
+    return 0
+end
+redis.call("SET", KEYS[1], ARGV[1])
+return 1
+"""
+RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class CacheLock:
+    """
+    Распределенная блокировка поверх кеша (в Redis - SET NX PX) с fencing token.
+
+    Каждый захват получает монотонно растущий токен. Записи защищенных
+    данных выполняются только после fence(): владелец, чья блокировка
+    истекла и была перехвачена, получает отказ и ничего не перезаписывает.
+    """
+
+    def __init__(self, name, timeout):
+        self.key = f"lock:{name}"
+        self.fence_key = f"lock:{name}:fence"
+        self.committed_key = f"lock:{name}:committed"
+        self.timeout = timeout
+        self.token = None
+
+    def acquire(self):
+        cache.add(self.fence_key, 0, timeout=None)
+        token = cache.incr(self.fence_key)
+        if cache.add(self.key, token, timeout=self.timeout):
+            self.token = token
+            return True
+        return False
+
+    async def aacquire(self):
+        await cache.aadd(self.fence_key, 0, timeout=None)
+        token = await cache.aincr(self.fence_key)
+        if await cache.aadd(self.key, token, timeout=self.timeout):
+            self.token = token
+            return True
+        return False
+
+    def is_current(self):
+        return self.token is not None and cache.get(self.key) == self.token
+
+    def fence(self):
+        """Разрешает запись, только если токен не старее последнего записавшего."""
+        if self.token is None:
+            return False
+        client = caching.redis_client()
+        if client is not None:
+            return bool(self._eval(client, FENCE_SCRIPT, self.committed_key))
+        if self.token < cache.get(self.committed_key, 0):
+            return False
+        cache.set(self.committed_key, self.token, timeout=None)
+        return True
+
+    def release(self):
+        """Снимает блокировку, только если она все еще принадлежит владельцу."""
+        client = caching.redis_client() if self.token is not None else None
+        if client is not None:
+            self._eval(client, RELEASE_SCRIPT, self.key)
+        elif self.is_current():
+            cache.delete(self.key)
+        self.token = None
+
+    async def arelease(self):
+        await sync_to_async(self.release)()
+
+    def _eval(self, client, script, key):
+        return client.eval(script, 1, cache.make_key(key), self.token)
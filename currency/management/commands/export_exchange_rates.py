@@ -0,0 +1,59 @@
+import time
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from currency import export
+
+
+class Command(BaseCommand):
+    help = (
+        "Выгружает текущие курсы (current) или историю курсов (history) "
+        "в NDJSON или CSV потоком, без загрузки таблицы в память."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("table", choices=export.FIELDS)
+        parser.add_argument(
+            "--format", choices=export.CONTENT_TYPES, default="ndjson", dest="fmt"
+        )
+        parser.add_argument("--output", help="Файл (по умолчанию stdout)")
+        parser.add_argument(
+            "--from", type=date.fromisoformat, dest="start", help="С даты (ISO)"
+        )
+        parser.add_argument(
+            "--to", type=date.fromisoformat, dest="end", help="По дату (ISO)"
+        )
+        parser.add_argument(
+            "--currency",
+            action="append",
+            default=[],
+            help="Только указанные валюты (можно повторять)",
+        )
+
+    def handle(self, *args, **options):
+        chunks = export.iter_export(
+            options["table"],
+            options["fmt"],
+            start=options["start"],
+            end=options["end"],
+            currencies=[c.upper() for c in options["currency"]],
+        )
+        try:
+            start = time.perf_counter()
+            if not options["output"]:
+                for chunk in chunks:
+                    self.stdout.write(chunk, ending="")
+                return
+            lines = 0
+            with open(options["output"], "w", encoding="utf-8", newline="") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    lines += chunk.count("\n")
+        except Exception as e:
+            raise CommandError(f"Ошибка: {e}")
+        rows = lines - (options["fmt"] == "csv")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Выгружено строк: {rows} в {options['output']} "
+                f"за {time.perf_counter() - start:.3f} с"
+            )
+        )
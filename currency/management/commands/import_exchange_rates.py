@@ -1,15 +1,36 @@
-from django.core.management.base import BaseCommand
-from currency.utils import fetch_exchange_rates_cmd
+import time
+from django.core.management.base import BaseCommand, CommandError
+from currency import metrics, providers, sync
+from currency.history import save_snapshot_file
 
 
 class Command(BaseCommand):
     help = (
-        "Загружает курсы валют от Европейского Центрального Банка и выводит в консоль."
+        "Загружает курсы валют от Европейского Центрального Банка в БД "
+        "(upsert по валюте и дате), прогревает кеш и пишет файл снимка курсов. "
+        "Для запуска по cron."
     )
 
     def handle(self, *args, **options):
         try:
-            rates = fetch_exchange_rates_cmd()
-            self.stdout.write(self.style.SUCCESS(f"Курс валют актуальный на {rates[-1]}: {rates[:-1]}"))
+            start = time.perf_counter()
+            with metrics.ecb_fetch():
+                ecb_data = providers.fetch_exchange_rates_for_db()
+            fetch_seconds = time.perf_counter() - start
+            counts = sync.import_exchange_rates(ecb_data)
+            snapshot_path = save_snapshot_file()
         except Exception as e:
-            self.stderr.write(self.style.ERROR(f"Ошибка: {e}"))
+            raise CommandError(f"Ошибка: {e}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Курсы валют на {counts['actual_date']}: "
+                f"добавлено {counts['inserted']}, обновлено {counts['updated']}, "
+                f"без изменений {counts['unchanged']}"
+            )
+        )
+        self.stdout.write(
+            f"Загрузка {fetch_seconds:.3f} с, запись {counts['write_seconds']:.3f} с, "
+            f"прогрев кеша {counts['cache_seconds']:.3f} с"
+        )
+        if snapshot_path:
+            self.stdout.write(f"Снимок курсов записан в {snapshot_path}")
@@ -0,0 +1,43 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from currency.history import import_history, save_snapshot_file
+from currency.models import CurrencyRate
+from currency.utils import ECB_HIST_URL, iter_history_rates
+
+
+class Command(BaseCommand):
+    help = (
+        "Загружает историю курсов валют ЕЦБ (eurofxref-hist.xml или zip с CSV) "
+        "из файла или по URL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--source",
+            default=ECB_HIST_URL,
+            help="Путь к файлу или URL (.xml, .zip, .csv)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help="Размер пакета для записи в БД",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            started = time.monotonic()
+            before = CurrencyRate.objects.count()
+            total = import_history(
+                iter_history_rates(options["source"]), options["chunk_size"]
+            )
+            created = CurrencyRate.objects.count() - before
+            save_snapshot_file()
+        except Exception as e:
+            raise CommandError(f"Ошибка: {e}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Обработано курсов: {total}, новых: {created} "
+                f"за {time.monotonic() - started:.2f} сек."
+            )
+        )
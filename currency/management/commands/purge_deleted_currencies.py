@@ -0,0 +1,50 @@
+import time
+from datetime import date, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from currency import sync
+
+
+class Command(BaseCommand):
+    help = (
+        "Стирает из БД валюты, удаленные больше --days дней назад, пакетами "
+        "в коротких транзакциях. Для запуска по cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.CURRENCY_PURGE_AFTER_DAYS,
+            help="Сколько дней хранить удаленные валюты",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Строк в одной транзакции удаления",
+        )
+        parser.add_argument(
+            "--archive",
+            help="Дописать удаляемые строки в файл (JSON Lines)",
+        )
+
+    def handle(self, *args, **options):
+        before = date.today() - timedelta(days=options["days"])
+        try:
+            start = time.perf_counter()
+            if options["archive"]:
+                with open(options["archive"], "a", encoding="utf-8") as archive:
+                    purged = sync.purge_deleted_currencies(
+                        before, options["chunk_size"], archive
+                    )
+            else:
+                purged = sync.purge_deleted_currencies(before, options["chunk_size"])
+        except Exception as e:
+            raise CommandError(f"Ошибка: {e}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Стерто валют, удаленных не позже {before}: {purged} "
+                f"за {time.perf_counter() - start:.3f} с"
+            )
+        )
@@ -0,0 +1,46 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from currency import sync
+from currency.history import save_snapshot_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Синхронизирует курсы валют с ЕЦБ, прогревает кеш и пишет файл снимка. "
+        "С --loop работает постоянно, просыпаясь после каждой публикации ЕЦБ."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Обновлять курсы по расписанию публикаций ЕЦБ",
+        )
+        parser.add_argument(
+            "--delay",
+            type=int,
+            default=300,
+            help="Задержка после времени публикации ЕЦБ, сек.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                sync.refresh_currencies()
+                snapshot = sync.get_rate_snapshot()
+                # лента без изменений (304) файл не перезаписывает
+                save_snapshot_file(only_changed=True)
+                wait = sync.refresh_timeout(snapshot) + options["delay"]
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Курсы валют обновлены, актуальны на {snapshot.actual_date}"
+                    )
+                )
+            except Exception as e:
+                wait = settings.CURRENCY_REFRESH_RETRY
+                self.stderr.write(self.style.ERROR(f"Ошибка: {e}"))
+            if not options["loop"]:
+                return
+            self.stdout.write(f"Следующее обновление через {wait} сек.")
+            time.sleep(wait)
@@ -0,0 +1,137 @@
+import os
+import time
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connection
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from currency.responses import published_at
+
+# Метрики процесса в формате Prometheus. Под gunicorn с несколькими
+# воркерами задайте PROMETHEUS_MULTIPROC_DIR - /metrics суммирует все воркеры.
+
+REQUEST_LATENCY = Histogram(
+    "currency_http_request_duration_seconds",
+    "Время обработки запроса",
+    ["method", "endpoint", "status"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUEST_QUERIES = Histogram(
+    "currency_http_request_db_queries",
+    "Запросов к БД на HTTP-запрос",
+    ["endpoint"],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+CACHE_REQUESTS = Counter(
+    "currency_cache_requests_total",
+    "Чтения набора курсов из кеша: hit - свежие, stale - устаревшие, miss - нет",
+    ["result"],
+)
+ECB_FETCH_LATENCY = Histogram(
+    "currency_ecb_fetch_duration_seconds",
+    "Время загрузки курсов ЕЦБ",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+ECB_FETCH_FAILURES = Counter(
+    "currency_ecb_fetch_failures_total", "Неудачные загрузки курсов ЕЦБ"
+)
+PROVIDER_RESPONSES = Counter(
+    "currency_provider_responses_total",
+    "Ответы HTTP-источников курсов: fetched - загружены, not_modified - 304",
+    ["provider", "result"],
+)
+SYNC_OUTCOMES = Counter(
+    "currency_sync_total",
+    "Результаты синхронизации с ЕЦБ: fresh, updated, created",
+    ["outcome"],
+)
+RATES_AGE = Gauge(
+    "currency_rates_age_seconds",
+    "Возраст текущих курсов с момента их публикации ЕЦБ",
+    multiprocess_mode="mostrecent",
+)
+
+
+@contextmanager
+def ecb_fetch():
+    """Замер загрузки ЕЦБ; исключения считаются отказами и пробрасываются."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ECB_FETCH_FAILURES.inc()
+        raise
+    finally:
+        ECB_FETCH_LATENCY.observe(time.perf_counter() - start)
+
+
+def render(actual_date=None):
+    """Текст для /metrics; actual_date - дата текущих курсов."""
+    if actual_date:
+        RATES_AGE.set(max(time.time() - published_at(actual_date), 0))
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+class MetricsMiddleware:
+    """
+    Латентность и число запросов к БД по эндпоинтам (имя маршрута,
+    а не путь, чтобы не плодить метки). Для async-представлений запросы
+    к БД выполняются в других потоках и не считаются.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        counter = _QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        endpoint = _observe(request, response, start)
+        REQUEST_QUERIES.labels(endpoint).observe(counter.count)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        _observe(request, response, start)
+        return response
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _observe(request, response, start):
+    match = request.resolver_match
+    endpoint = (match.view_name or match.route) if match else "unmatched"
+    REQUEST_LATENCY.labels(request.method, endpoint, response.status_code).observe(
+        time.perf_counter() - start
+    )
+    return endpoint
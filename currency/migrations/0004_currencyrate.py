@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 19:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currency', '0003_rename_is_deleted_currency_deleted_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrencyRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency_name', models.CharField(max_length=255)),
+                ('rate', models.DecimalField(decimal_places=7, max_digits=15)),
+                ('actual_date', models.DateField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('currency_name', 'actual_date'), name='unique_currency_rate_per_date')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2 on 2026-10-18 19:51
+
+from datetime import date
+
+from django.db import migrations, models
+
+
+def delete_duplicate_active(apps, schema_editor):
+    """Перед ограничением уникальности оставляет последнюю активную запись."""
+    Currency = apps.get_model("currency", "Currency")
+    seen = set()
+    duplicates = []
+    for obj in Currency.objects.filter(deleted_date=None).order_by("-id"):
+        if obj.currency_name in seen:
+            duplicates.append(obj.id)
+        seen.add(obj.currency_name)
+    Currency.objects.filter(id__in=duplicates).update(deleted_date=date.today())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currency', '0004_currencyrate'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_active, migrations.RunPython.noop),
+        migrations.AlterModelOptions(
+            name='currency',
+            options={'ordering': ['id']},
+        ),
+        migrations.AddIndex(
+            model_name='currency',
+            index=models.Index(condition=models.Q(('deleted_date__isnull', True), ('is_modified', False)), fields=['actual_date'], name='currency_ecb_actual_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='currency',
+            index=models.Index(condition=models.Q(('deleted_date__isnull', False)), fields=['deleted_date'], name='currency_deleted_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='currency',
+            constraint=models.UniqueConstraint(condition=models.Q(('deleted_date__isnull', True)), fields=('currency_name',), name='unique_active_currency_name'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-18 20:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currency', '0005_currency_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrencyQuote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base', models.CharField(max_length=255)),
+                ('currency_name', models.CharField(max_length=255)),
+                ('rate', models.DecimalField(decimal_places=7, max_digits=15)),
+                ('actual_date', models.DateField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('base', 'currency_name'), name='unique_currency_quote_pair')],
+            },
+        ),
+    ]
@@ -8,5 +8,72 @@ class Currency(models.Model):
     deleted_date = models.DateField(blank=True, null=True)
     is_modified = models.BooleanField(default=False)
 
+    class Meta:
+        # порядок выдачи API не должен зависеть от выбранного планировщиком индекса
+        ordering = ["id"]
+        constraints = [
+            # одна активная запись на валюту; удаленные не мешают
+            models.UniqueConstraint(
+                fields=["currency_name"],
+                condition=models.Q(deleted_date__isnull=True),
+                name="unique_active_currency_name",
+            )
+        ]
+        indexes = [
+            # курсы, обновляемые из ЕЦБ, по дате актуальности
+            models.Index(
+                fields=["actual_date"],
+                condition=models.Q(deleted_date__isnull=True, is_modified=False),
+                name="currency_ecb_actual_date_idx",
+            ),
+            # очистка давно удаленных
+            models.Index(
+                fields=["deleted_date"],
+                condition=models.Q(deleted_date__isnull=False),
+                name="currency_deleted_date_idx",
+            ),
+        ]
+
     def __str__(self):
         return self.currency_name
+
+
+class CurrencyRate(models.Model):
+    """Курс валюты к EUR на дату публикации ЕЦБ."""
+
+    currency_name = models.CharField(max_length=255)
+    rate = models.DecimalField(max_digits=15, decimal_places=7)
+    actual_date = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["currency_name", "actual_date"],
+                name="unique_currency_rate_per_date",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.currency_name} {self.actual_date}"
+
+
+class CurrencyQuote(models.Model):
+    """
+    Котировка пары к базе, отличной от EUR: 1 base = rate currency_name.
+    Последняя загруженная на пару; ребро графа котировок снимка курсов.
+    """
+
+    base = models.CharField(max_length=255)
+    currency_name = models.CharField(max_length=255)
+    rate = models.DecimalField(max_digits=15, decimal_places=7)
+    actual_date = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["base", "currency_name"], name="unique_currency_quote_pair"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.base}/{self.currency_name} {self.actual_date}"
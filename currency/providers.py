@@ -0,0 +1,484 @@
+import json
+import logging
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import groupby
+from pathlib import Path
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+from currency import fixedpoint, metrics, utils
+
+# Источники курсов. Все источники из CURRENCY_PROVIDERS опрашиваются
+# параллельно в пуле потоков, результаты объединяются по приоритету
+# (порядку в списке). Ожидание ограничено самым быстрым исправным
+# источником плюс CURRENCY_PROVIDERS_GRACE, а не самым медленным.
+#
+# HTTP-источники ходят через общую сессию с пулом keep-alive соединений
+# и условными запросами (If-None-Match / If-Modified-Since): на 304
+# возвращается ранее разобранный RateSet из кеша без загрузки и разбора.
+
+ECB_NAMESPACES = {
+    "gesmes": "http://www.gesmes.org/xml/2002-08-01",
+    "eurofxref": "http://www.ecb.int/vocabulary/2002-08-01/eurofxref",
+}
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderError(Exception):
+    pass
+
+
+class RateSet:
+    """
+    Курсы к base (обычно EUR) на дату actual_date из источника source.
+    not_modified - источник ответил, что данные не изменились (304).
+    quotes - курсы к другим базам (RateSet), добавленные merge.
+    validators - ETag и Last-Modified источников, еще не сохраненные для
+    условных запросов: (ключ кеша, значение), см. save_validators.
+    """
+
+    __slots__ = (
+        "source",
+        "actual_date",
+        "rates",
+        "base",
+        "not_modified",
+        "quotes",
+        "validators",
+    )
+
+    def __init__(
+        self,
+        source,
+        actual_date,
+        rates,
+        base="EUR",
+        not_modified=False,
+        quotes=(),
+        validators=(),
+    ):
+        self.source = source
+        self.actual_date = actual_date
+        self.rates = rates
+        self.base = base
+        self.not_modified = not_modified
+        self.quotes = quotes
+        self.validators = validators
+
+    def for_db(self):
+        """
+        Строки для ingest_exchange_rates: сначала курсы к EUR, затем
+        котировки к другим базам с ключом base.
+        """
+        return [
+            {
+                "currency_name": currency,
+                "rate": rate,
+                "actual_date": self.actual_date.isoformat(),
+                "is_modified": False,
+            }
+            for currency, rate in self.rates.items()
+        ] + [
+            {
+                "base": rate_set.base,
+                "currency_name": currency,
+                "rate": rate,
+                "actual_date": rate_set.actual_date.isoformat(),
+            }
+            for rate_set in self.quotes
+            for currency, rate in rate_set.rates.items()
+        ]
+
+    def __repr__(self):
+        return f"<RateSet {self.source} {self.actual_date} ({len(self.rates)})>"
+
+
+class Provider:
+    """
+    Источник курсов: fetch() возвращает RateSet или бросает исключение.
+    timeout - ограничение на одну попытку, deadline - на весь fetch().
+    """
+
+    name = "provider"
+
+    def __init__(self, timeout=10, name=None):
+        self.timeout = timeout
+        if name:
+            self.name = name
+
+    @property
+    def deadline(self):
+        return self.timeout
+
+    def fetch(self):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.name}>"
+
+
+class HTTPProvider(Provider):
+    """
+    Источник по URL с зеркалами: если за hedge_after сек. ответа нет,
+    тот же запрос параллельно уходит на следующее зеркало, побеждает первый
+    удачный ответ.
+    """
+
+    def __init__(self, url, mirrors=(), hedge_after=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.urls = [url, *mirrors]
+        self.hedge_after = hedge_after
+
+    @property
+    def deadline(self):
+        return self.hedge_after * (len(self.urls) - 1) + self.timeout
+
+    def fetch(self):
+        return hedged(
+            [lambda url=url: self._get(url) for url in self.urls], self.hedge_after
+        )
+
+    def _get(self, url):
+        key = f"provider:{url}"
+        cached = cache.get(key)
+        headers = {}
+        if cached is not None:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        response = session().get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and cached is not None:
+            logger.debug(f"Источник курсов {self.name}: данные не изменились")
+            metrics.PROVIDER_RESPONSES.labels(self.name, "not_modified").inc()
+            rate_set = cached[2]
+            return RateSet(
+                rate_set.source,
+                rate_set.actual_date,
+                rate_set.rates,
+                rate_set.base,
+                not_modified=True,
+            )
+        response.raise_for_status()
+        rate_set = self.parse(response.content)
+        metrics.PROVIDER_RESPONSES.labels(self.name, "fetched").inc()
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified:
+            # в кеш - только после записи курсов (save_validators)
+            entry = (etag, last_modified, rate_set)
+            return RateSet(
+                rate_set.source,
+                rate_set.actual_date,
+                rate_set.rates,
+                rate_set.base,
+                validators=((key, entry),),
+            )
+        return rate_set
+
+    def parse(self, content):
+        raise NotImplementedError
+
+
+class ECBDailyProvider(HTTPProvider):
+    """Ежедневная лента ЕЦБ eurofxref-daily.xml."""
+
+    name = "ecb"
+
+    def __init__(self, url=None, **kwargs):
+        # utils.ECB_URL читается при создании: его подменяют бенчмарки
+        super().__init__(url or utils.ECB_URL, **kwargs)
+
+    def parse(self, content):
+        return parse_ecb_daily(content, self.name)
+
+
+class JSONProvider(HTTPProvider):
+    """
+    JSON вида {"date": "2025-04-04", "base": "EUR", "rates": {"USD": 1.08}}.
+    При base, отличной от EUR, курсы пересчитываются через курс EUR из rates,
+    а без него - через граф котировок при объединении источников.
+    """
+
+    name = "json"
+
+    def parse(self, content):
+        return parse_json(content, self.name)
+
+
+class CSVProvider(HTTPProvider):
+    """CSV в формате ЕЦБ (Date, USD, JPY, ...): берется самая свежая строка."""
+
+    name = "csv"
+
+    def parse(self, content):
+        rows = utils.iter_history_csv(content.decode().splitlines())
+        return latest_fixing(rows, self.name)
+
+
+class ECBHistoryProvider(Provider):
+    """
+    Архив ЕЦБ (eurofxref-hist.xml или zip с CSV): самые свежие курсы
+    идут первыми, поэтому читается только начало потока.
+    """
+
+    name = "ecb-history"
+
+    def __init__(self, source=utils.ECB_HIST_URL, **kwargs):
+        super().__init__(**kwargs)
+        self.source = source
+
+    def fetch(self):
+        rows = utils.iter_history_rates(self.source, timeout=self.timeout)
+        try:
+            return latest_fixing(rows, self.name)
+        finally:
+            rows.close()
+
+
+class FileProvider(Provider):
+    """Локальный файл: .xml - лента ЕЦБ, .json - JSON, .csv/.zip - формат ЕЦБ."""
+
+    name = "file"
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = str(path)
+
+    def fetch(self):
+        suffix = Path(self.path).suffix.lower()
+        if suffix in (".csv", ".zip"):
+            rows = utils.iter_history_rates(self.path)
+            try:
+                return latest_fixing(rows, self.name)
+            finally:
+                rows.close()
+        content = Path(self.path).read_bytes()
+        if suffix == ".json":
+            return parse_json(content, self.name)
+        return parse_ecb_daily(content, self.name)
+
+
+def parse_ecb_daily(content, source="ecb"):
+    root = ET.fromstring(content)
+    day = root.find(".//eurofxref:Cube[@time]", ECB_NAMESPACES)
+    if day is None:
+        raise ProviderError(f"{source}: в ленте нет курсов")
+    return RateSet(
+        source,
+        date.fromisoformat(day.attrib["time"]),
+        {
+            cube.attrib["currency"]: Decimal(cube.attrib["rate"])
+            for cube in day.findall("eurofxref:Cube[@currency]", ECB_NAMESPACES)
+        },
+    )
+
+
+def parse_json(content, source="json"):
+    data = json.loads(content, parse_float=Decimal)
+    rates = {code: Decimal(str(rate)) for code, rate in data["rates"].items()}
+    base = data.get("base", "EUR")
+    actual_date = date.fromisoformat(data["date"])
+    if base != "EUR" and "EUR" not in rates:
+        return RateSet(source, actual_date, rates, base)
+    if base != "EUR":
+        eur = rates.pop("EUR")
+        rates = {code: _per_eur(rate, eur) for code, rate in rates.items()}
+        rates[base] = _per_eur(Decimal(1), eur)
+    rates.pop("EUR", None)
+    return RateSet(source, actual_date, rates)
+
+
+def _per_eur(rate, eur):
+    """Курс к EUR по курсам валюты и EUR к общей базе, точно до RATE_PLACES."""
+    rate_n, rate_d = fixedpoint.split(rate)
+    eur_n, eur_d = fixedpoint.split(eur)
+    units = fixedpoint.divide(rate_n * eur_d * fixedpoint.RATE_SCALE, rate_d * eur_n)
+    return Decimal(fixedpoint.format_units(units, fixedpoint.RATE_PLACES))
+
+
+def latest_fixing(rows, source):
+    """Курсы первой даты из потока (дата, валюта, курс), свежие - первыми."""
+    for actual_date, group in groupby(rows, key=lambda row: row[0]):
+        return RateSet(
+            source,
+            _parse_date(actual_date),
+            {currency: Decimal(rate) for _, currency, rate in group},
+        )
+    raise ProviderError(f"{source}: нет курсов")
+
+
+def _parse_date(value):
+    # в архиве ЕЦБ даты ISO, в ежедневном eurofxref.csv - "04 April 2025"
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return datetime.strptime(value, "%d %B %Y").date()
+
+
+def hedged(calls, hedge_after):
+    """
+    Запускает calls по очереди: следующий - через hedge_after сек. без ответа
+    или сразу после ошибки предыдущего. Возвращает первый удачный результат,
+    если неудачны все - пробрасывает последнюю ошибку.
+    """
+    if len(calls) == 1:
+        return calls[0]()
+    remaining = list(calls)
+    executor = ThreadPoolExecutor(len(calls), thread_name_prefix="rates-hedge")
+    pending, error = {executor.submit(remaining.pop(0))}, None
+    try:
+        while pending:
+            done, pending = wait(
+                pending,
+                hedge_after if remaining else None,
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    error = e
+            if remaining:
+                pending.add(executor.submit(remaining.pop(0)))
+        raise error
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def session():
+    """
+    Общая сессия requests с пулом keep-alive соединений. Создается при
+    первом запросе, то есть уже в воркере, а не в мастер-процессе до fork.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                new_session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_maxsize=settings.CURRENCY_HTTP_POOL_SIZE, max_retries=0
+                )
+                new_session.mount("http://", adapter)
+                new_session.mount("https://", adapter)
+                _session = new_session
+    return _session
+
+
+def configured():
+    """Источники из CURRENCY_PROVIDERS в порядке приоритета."""
+    providers = []
+    for options in settings.CURRENCY_PROVIDERS:
+        options = dict(options)
+        providers.append(import_string(options.pop("provider"))(**options))
+    return providers
+
+
+def fetch_rates(providers=None, grace=None):
+    """
+    Опрашивает источники параллельно и объединяет их курсы (merge).
+    Возвращается, когда ответили все источники, или через grace сек.
+    после первого удачного ответа, или по истечении deadline источников.
+    """
+    providers = configured() if providers is None else providers
+    if grace is None:
+        grace = settings.CURRENCY_PROVIDERS_GRACE
+    executor = ThreadPoolExecutor(len(providers), thread_name_prefix="rates-provider")
+    futures = {executor.submit(provider.fetch): provider for provider in providers}
+    deadline = time.monotonic() + max(provider.deadline for provider in providers)
+    results, errors, settle = {}, [], None
+    pending = set(futures)
+    try:
+        while pending:
+            timeout = deadline - time.monotonic()
+            if results:
+                timeout = min(timeout, settle - time.monotonic())
+            if timeout <= 0:
+                break
+            done, pending = wait(pending, timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = futures[future]
+                try:
+                    results[provider] = future.result()
+                except Exception as e:
+                    logger.warning(f"Источник курсов {provider.name} недоступен: {e}")
+                    errors.append(f"{provider.name}: {e}")
+                    continue
+                if len(results) == 1:
+                    settle = time.monotonic() + grace
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    for future in pending:
+        logger.warning(f"Источник курсов {futures[future].name} не успел ответить")
+    if not results:
+        raise ProviderError("; ".join(errors) or "Источники курсов не ответили")
+    return merge([results[p] for p in providers if p in results])
+
+
+def merge(rate_sets):
+    """
+    Объединяет курсы по приоритету: берется самая свежая дата курсов к EUR,
+    валюты заполняются из источников с этой датой, первые в списке важнее.
+    Котировки к другим базам (не старше этой даты) идут в quotes как есть,
+    без пересчета в курсы к EUR: маршруты по ним строит граф снимка курсов.
+    Результат not_modified, если не изменился ни один из использованных
+    источников.
+    """
+    anchors = [rate_set for rate_set in rate_sets if rate_set.base == "EUR"]
+    if not anchors:
+        raise ProviderError("Нет курсов к EUR ни в одном источнике")
+    actual_date = max(rate_set.actual_date for rate_set in anchors)
+    fresh = [rate_set for rate_set in anchors if rate_set.actual_date == actual_date]
+    rates = {}
+    for rate_set in fresh:
+        for currency, rate in rate_set.rates.items():
+            rates.setdefault(currency, rate)
+    cross = [
+        rate_set
+        for rate_set in rate_sets
+        if rate_set.base != "EUR" and rate_set.actual_date >= actual_date
+    ]
+    used = fresh + cross
+    return RateSet(
+        "+".join(r.source for r in used),
+        actual_date,
+        rates,
+        not_modified=all(rate_set.not_modified for rate_set in used),
+        quotes=tuple(cross),
+        validators=tuple(item for r in used for item in r.validators),
+    )
+
+
+def save_validators(rate_set):
+    """
+    Запоминает ETag и Last-Modified источников rate_set для условных
+    запросов. Вызывается после записи курсов: если запись не удалась,
+    следующий запрос снова без условий, и 304 не скроет публикацию.
+    """
+    if rate_set.validators:
+        cache.set_many(
+            dict(rate_set.validators), timeout=settings.CURRENCY_STALE_TIMEOUT
+        )
+
+
+def fetch_exchange_rates_for_db():
+    return fetch_rates().for_db()
+
+
+async def afetch_rates():
+    """fetch_rates без блокировки event loop: опрос источников идет в пуле потоков."""
+    return await sync_to_async(fetch_rates, thread_sensitive=False)()
@@ -0,0 +1,86 @@
+import hashlib
+from datetime import datetime
+from django.conf import settings
+from django.utils import timezone
+from django.utils.http import http_date, parse_etags
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from currency import sync, utils
+
+
+def render_entry(data, actual_date):
+    """
+    Запись кеша с готовым JSON-телом ответа, сильным ETag
+    и временем публикации данных (для Last-Modified).
+    """
+    body = JSONRenderer().render(data)
+    return {
+        "data": data,
+        "body": body,
+        "etag": f'"{hashlib.sha1(body).hexdigest()}"',
+        "last_modified": published_at(actual_date),
+    }
+
+
+def published_at(actual_date):
+    if not actual_date:
+        return None
+    published = datetime.combine(
+        actual_date, utils.ECB_PUBLICATION_TIME, tzinfo=utils.ECB_TIMEZONE
+    )
+    return min(published, timezone.now()).timestamp()
+
+
+def cache_control(max_age=None, snapshot=None):
+    """
+    Cache-Control не дальше момента устаревания данных, как у флага
+    свежести кеша: до следующей публикации ЕЦБ или, пока свежая
+    публикация еще не загружена, на CURRENCY_REFRESH_RETRY.
+    """
+    until_refresh = sync.refresh_timeout(snapshot)
+    if max_age is not None:
+        until_refresh = min(max_age, until_refresh)
+    return f"public, max-age={max(until_refresh, 0)}"
+
+
+def is_not_modified(request, etag):
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return "*" in etags or etag in etags
+
+
+def _set_validators(response, entry):
+    response["ETag"] = entry["etag"]
+    response["Cache-Control"] = cache_control(settings.CURRENCY_HTTP_MAX_AGE)
+    if entry["last_modified"]:
+        response["Last-Modified"] = http_date(entry["last_modified"])
+
+
+class PrerenderedResponse(Response):
+    """
+    Ответ из записи render_entry: для JSON отдается закешированное тело
+    без сериализации и рендеринга, для остальных рендереров - как обычно.
+    Если ETag клиента совпадает - 304 без тела.
+    """
+
+    def __init__(self, request, entry, **kwargs):
+        not_modified = is_not_modified(request, entry["etag"])
+        super().__init__(
+            None if not_modified else entry["data"],
+            status=status.HTTP_304_NOT_MODIFIED if not_modified else status.HTTP_200_OK,
+            **kwargs,
+        )
+        self.body = None if not_modified else entry["body"]
+        _set_validators(self, entry)
+
+    @property
+    def rendered_content(self):
+        if self.status_code == status.HTTP_304_NOT_MODIFIED:
+            return b""
+        if self.body is not None and isinstance(self.accepted_renderer, JSONRenderer):
+            self["Content-Type"] = self.accepted_renderer.media_type
+            return self.body
+        return super().rendered_content
@@ -1,6 +1,13 @@
+from datetime import timedelta
+from itertools import islice
+from django.conf import settings
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from currency import fixedpoint
+from currency.graph import Quote, RateGraph
+from currency.history import get_history_index
 from currency.models import Currency
+from currency.snapshot import RateSnapshot
 
 
 class CurrencySerializer(serializers.ModelSerializer):
@@ -9,6 +16,11 @@ class CurrencySerializer(serializers.ModelSerializer):
     deleted_date = serializers.ReadOnlyField()
     is_modified = serializers.ReadOnlyField()
 
+    def validate_rate(self, value):
+        if value <= 0:
+            raise ValidationError("Курс должен быть больше нуля")
+        return value
+
     def update(self, instance, validated_data):
         validated_data["is_modified"] = True
         return super().update(instance, validated_data)
@@ -18,48 +30,330 @@ class CurrencySerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+# суммы принимаются дробными, но не длиннее, чтобы не раздувать целые
+AMOUNT_MAX_DIGITS = 30
+AMOUNT_PLACES = 10
+
+
 class CurrencyConvertSerializer(serializers.Serializer):
     from_currency = serializers.ChoiceField(choices=[], required=True)
     to_currency = serializers.ChoiceField(choices=[], required=True)
-    amount = serializers.IntegerField(required=True)
+    amount = serializers.DecimalField(
+        max_digits=AMOUNT_MAX_DIGITS, decimal_places=AMOUNT_PLACES, required=True
+    )
+    date = serializers.DateField(required=False)
+    rounding = serializers.ChoiceField(
+        choices=fixedpoint.ROUNDING_MODES, required=False
+    )
+    minor_units = serializers.BooleanField(required=False)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         try:
-            currencies = list(
-                Currency.objects.values_list("currency_name", flat=True)
-            ) + ["EUR"]
-            choices = [(c, c) for c in currencies]
+            self.snapshot = self.context.get("snapshot")
+            if self.snapshot is None:
+                self.snapshot = RateSnapshot.from_currencies(
+                    Currency.objects.filter(deleted_date=None)
+                )
+            choices = self.snapshot.choices
             self.fields["from_currency"].choices = choices
             self.fields["to_currency"].choices = choices
         except:
+            self.snapshot = None
             self.fields["from_currency"].choices = []
             self.fields["to_currency"].choices = []
 
     def validate(self, attrs):
         if attrs.get("from_currency") == attrs.get("to_currency"):
             raise ValidationError({"response": "Нельзя указывать одинаковые валюты"})
-        if attrs["from_currency"] != "EUR":
-            attrs["from_currency"] = Currency.objects.get(
-                currency_name=attrs["from_currency"]
-            )
-        if attrs["to_currency"] != "EUR":
-            attrs["to_currency"] = Currency.objects.get(
-                currency_name=attrs["to_currency"]
+        if attrs.get("date"):
+            # курс на дату - по последнему фиксингу ЕЦБ не позже нее
+            found = get_history_index().fixing_rates(
+                attrs["from_currency"], attrs["to_currency"], attrs["date"]
             )
+            if found is None:
+                raise ValidationError({"date": "Нет курсов ЕЦБ на эту дату"})
+            attrs["rates"], attrs["rate_date"] = found[:2], found[2]
+        elif self.snapshot.route(attrs["from_currency"], attrs["to_currency"]) is None:
+            raise ValidationError({"response": "Нет маршрута конвертации"})
         return attrs
 
+    def to_representation(self, instance):
+        to_currency = instance.get("to_currency")
+        rounding = instance.get("rounding") or settings.CURRENCY_ROUNDING
+        places = fixedpoint.RESULT_PLACES
+        if instance.get("minor_units"):
+            places = fixedpoint.minor_units(to_currency)
+        if instance.get("rates"):
+            result = fixedpoint.convert(
+                fixedpoint.split(instance["amount"]),
+                *instance["rates"],
+                places,
+                rounding,
+            )
+        else:
+            result = self.snapshot.convert(
+                instance.get("from_currency"),
+                to_currency,
+                instance["amount"],
+                places,
+                rounding,
+            )
+        data = {"result": fixedpoint.format_units(result, places)}
+        if instance.get("rate_date"):
+            data["rate_date"] = instance["rate_date"].isoformat()
+        return data
+
+    class Meta:
+        fields = "__all__"
+
+
+class CurrencyRateSerializer(CurrencyConvertSerializer):
+    amount = None
+    rounding = None
+    minor_units = None
+
     def to_representation(self, instance):
         from_currency = instance.get("from_currency")
         to_currency = instance.get("to_currency")
-        amount = instance.get("amount")
-        if from_currency == "EUR":
-            return {"result": "%.7f" % float(to_currency.rate * amount)}
-        if to_currency == "EUR":
-            return {"result": "%.7f" % float(amount / from_currency.rate)}
+        if instance.get("rates"):
+            # история курсов - только к EUR
+            day = instance["rate_date"]
+            from_rate, to_rate = instance["rates"]
+            route = RateGraph(
+                [
+                    Quote("EUR", from_currency, from_rate, day),
+                    Quote("EUR", to_currency, to_rate, day),
+                ]
+            ).route(from_currency, to_currency)
+        else:
+            route = self.snapshot.route(from_currency, to_currency)
+        places = fixedpoint.CROSS_RATE_PLACES
+        data = {
+            "from_currency": from_currency,
+            "to_currency": to_currency,
+            "rate": fixedpoint.format_units(route.cross_rate(), places),
+            "path": list(route.path),
+            "hops": [
+                {
+                    "from_currency": hop.from_currency,
+                    "to_currency": hop.to_currency,
+                    "rate": fixedpoint.format_units(hop.rate(), places),
+                    "actual_date": hop.actual_date.isoformat(),
+                }
+                for hop in route.hops
+            ],
+        }
+        if instance.get("rate_date"):
+            data["rate_date"] = instance["rate_date"].isoformat()
+        return data
+
+
+class CurrencyHistorySerializer(serializers.Serializer):
+    """
+    Курсы валюты context["currency"] к base за период по индексу истории.
+    Страницы идут по дате фиксинга: after - последняя дата предыдущей
+    страницы, next - курсор следующей. shape=columns отдает даты и курсы
+    двумя массивами вместо списка объектов.
+    """
+
+    from_date = serializers.DateField(required=False)
+    to_date = serializers.DateField(required=False)
+    base = serializers.ChoiceField(choices=[], required=False)
+    after = serializers.DateField(required=False)
+    limit = serializers.IntegerField(min_value=1, required=False)
+    shape = serializers.ChoiceField(choices=("rows", "columns"), required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.index = get_history_index()
+        self.fields["base"].choices = ["EUR", *sorted(self.index.columns)]
+
+    def validate_limit(self, value):
+        if value > settings.CURRENCY_HISTORY_MAX_PAGE_SIZE:
+            raise ValidationError(
+                f"Не больше {settings.CURRENCY_HISTORY_MAX_PAGE_SIZE}"
+            )
+        return value
+
+    def validate(self, attrs):
+        if attrs.get("base", "EUR") == self.context["currency"]:
+            raise ValidationError({"base": "Нельзя указывать одинаковые валюты"})
+        start, end = attrs.get("from_date"), attrs.get("to_date")
+        if start and end and start > end:
+            raise ValidationError({"to_date": "Конец периода раньше начала"})
+        return attrs
+
+    def to_representation(self, instance):
+        currency = self.context["currency"]
+        base = instance.get("base") or "EUR"
+        limit = instance.get("limit") or settings.CURRENCY_HISTORY_PAGE_SIZE
+        start, after = instance.get("from_date"), instance.get("after")
+        if after is not None and (start is None or after >= start):
+            start = after + timedelta(days=1)
+        page = list(
+            islice(
+                self.index.series(currency, base, start, instance.get("to_date")),
+                limit + 1,
+            )
+        )
+        next_after = page[limit - 1][0].isoformat() if len(page) > limit else None
+        dates, rates = [], []
+        for day, rate, base_rate in page[:limit]:
+            dates.append(day.isoformat())
+            if base == "EUR":
+                rates.append(fixedpoint.format_units(rate, fixedpoint.RATE_PLACES))
+            else:
+                rates.append(
+                    fixedpoint.format_units(
+                        fixedpoint.cross_rate(base_rate, rate),
+                        fixedpoint.CROSS_RATE_PLACES,
+                    )
+                )
+        data = {"currency": currency, "base": base}
+        if instance.get("shape") == "columns":
+            data["dates"], data["rates"] = dates, rates
+        else:
+            data["results"] = [
+                {"date": day, "rate": rate} for day, rate in zip(dates, rates)
+            ]
+        data["next"] = next_after
+        return data
+
+
+class CurrencyBatchConvertSerializer(serializers.Serializer):
+    """
+    Пакетная конвертация: либо список items из пар валют и сумм,
+    либо одна сумма from_currency/amount во все валюты.
+    Элементы не прогоняются через CurrencyConvertSerializer,
+    ошибки возвращаются по каждому элементу отдельно.
+    """
+
+    max_items = 10000
+
+    items = serializers.ListField(required=False, max_length=max_items)
+    from_currency = serializers.CharField(required=False)
+    amount = serializers.DecimalField(
+        max_digits=AMOUNT_MAX_DIGITS, decimal_places=AMOUNT_PLACES, required=False
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.snapshot = self.context.get("snapshot")
+
+    def validate_from_currency(self, value):
+        if value not in self.snapshot:
+            raise ValidationError(self._invalid_choice(value))
+        return value
+
+    def validate(self, attrs):
+        if "items" not in attrs and not (
+            "from_currency" in attrs and "amount" in attrs
+        ):
+            raise ValidationError(
+                {"response": "Нужно передать items или from_currency и amount"}
+            )
+        return attrs
+
+    def to_representation(self, instance):
+        if "items" in instance:
+            return {"results": self._convert_items(instance["items"])}
+        converted = self.snapshot.fan_out(
+            instance["from_currency"],
+            instance["amount"],
+            rounding=settings.CURRENCY_ROUNDING,
+        )
+        places = fixedpoint.RESULT_PLACES
         return {
-            "result": "%.7f" % float(to_currency.rate / from_currency.rate * amount)
+            "from_currency": instance["from_currency"],
+            "amount": fixedpoint.plain(instance["amount"]),
+            "results": {
+                code: fixedpoint.format_units(v, places)
+                for code, v in converted.items()
+            },
         }
 
-    class Meta:
-        fields = "__all__"
+    def _convert_items(self, items):
+        results = [None] * len(items)
+        indexes, from_positions, to_positions, amounts = [], [], [], []
+        for i, item in enumerate(items):
+            parsed, errors = self._parse_item(item)
+            if errors:
+                results[i] = {"errors": errors}
+                continue
+            indexes.append(i)
+            from_positions.append(parsed[0])
+            to_positions.append(parsed[1])
+            amounts.append(parsed[2])
+        converted = self.snapshot.convert_many(
+            from_positions,
+            to_positions,
+            amounts,
+            rounding=settings.CURRENCY_ROUNDING,
+        )
+        places = fixedpoint.RESULT_PLACES
+        for i, value in zip(indexes, converted):
+            results[i] = {"result": fixedpoint.format_units(value, places)}
+        return results
+
+    def _parse_item(self, item):
+        if not isinstance(item, dict):
+            return None, {"non_field_errors": ["Элемент должен быть объектом"]}
+        errors = {}
+        positions = []
+        for field in ("from_currency", "to_currency"):
+            value = item.get(field)
+            position = None
+            if isinstance(value, str):
+                position = self.snapshot.position(value)
+            if value is None:
+                errors[field] = [serializers.Field.default_error_messages["required"]]
+            elif position is None:
+                errors[field] = [self._invalid_choice(value)]
+            positions.append(position)
+        amount = item.get("amount")
+        if amount is None:
+            errors["amount"] = [serializers.Field.default_error_messages["required"]]
+        else:
+            try:
+                amount = self.fields["amount"].to_internal_value(amount)
+            except ValidationError as e:
+                errors["amount"] = e.detail
+        if not errors and positions[0] == positions[1]:
+            errors["response"] = ["Нельзя указывать одинаковые валюты"]
+        elif not errors and not self.snapshot.connected(*positions):
+            errors["response"] = ["Нет маршрута конвертации"]
+        if errors:
+            return None, errors
+        return (positions[0], positions[1], amount), None
+
+    @staticmethod
+    def _invalid_choice(value):
+        message = serializers.ChoiceField.default_error_messages["invalid_choice"]
+        return message.format(input=value)
+
+
+class CurrencyMatrixSerializer(serializers.Serializer):
+    base = serializers.ChoiceField(choices=[], required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.snapshot = self.context.get("snapshot")
+        if self.snapshot is not None:
+            self.fields["base"].choices = self.snapshot.choices
+
+    def to_representation(self, instance):
+        base = instance.get("base")
+        if base:
+            return {
+                "base": base,
+                "version": self.snapshot.version,
+                "rates": self.snapshot.matrix_row(base),
+            }
+        return {
+            "version": self.snapshot.version,
+            "rates": {
+                code: self.snapshot.matrix_row(code)
+                for code, _ in self.snapshot.choices
+            },
+        }
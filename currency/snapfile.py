@@ -0,0 +1,172 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from datetime import date
+from decimal import Decimal
+from django.conf import settings
+from currency.graph import Quote
+
+# Файл снимка курсов для быстрого старта воркеров. Пишется задачей
+# синхронизации атомарно (временный файл + os.replace), воркеры отображают
+# его в память только для чтения и делят страницы через page cache.
+#
+# Формат: MAGIC, длина заголовка (uint32), заголовок JSON (версии, курсы,
+# котировки пар, коды валют истории), выравнивание до 8 байт, затем int64
+# в порядке байт машины: даты фиксингов (ordinal) и колонки курсов истории
+# с масштабом 10**RATE_PLACES, 0 - курса нет.
+
+MAGIC = b"CURSNAP1"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sI")
+_ITEM = "q"
+_ITEM_SIZE = array(_ITEM).itemsize
+
+logger = logging.getLogger(__name__)
+
+
+class MappedSnapshot:
+    __slots__ = ("version", "history_version", "_meta", "_buffer", "_stat")
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._stat = _stat_key(os.fstat(f.fileno()))
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, length = _HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: не файл снимка курсов")
+        meta = json.loads(buffer[_HEADER.size : _HEADER.size + length])
+        if meta["format"] != FORMAT_VERSION or meta["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path}: несовместимый формат снимка")
+        self._meta = meta
+        self._buffer = buffer
+        self.version = meta["version"]
+        history = meta["history"]
+        self.history_version = history["version"] if history else None
+
+    def rate_rows(self):
+        """Строки (валюта, курс, дата) для RateSnapshot."""
+        return [
+            (name, Decimal(rate), date.fromisoformat(actual_date))
+            for name, rate, actual_date in self._meta["rates"]
+        ]
+
+    def quotes(self):
+        """Котировки пар к другим базам (Quote) для RateSnapshot."""
+        return [
+            Quote(base, quote, units, date.fromisoformat(actual_date))
+            for base, quote, units, actual_date in self._meta.get("quotes", ())
+        ]
+
+    def history_arrays(self):
+        """
+        Даты фиксингов и колонки курсов истории - memoryview поверх
+        отображенного файла, без копирования.
+        """
+        history = self._meta["history"]
+        count = history["dates"]
+        view = memoryview(self._buffer)
+        offset = _data_offset(self._meta_length())
+        size = count * _ITEM_SIZE
+        dates = view[offset : offset + size].cast(_ITEM)
+        columns = {}
+        for code in history["codes"]:
+            offset += size
+            columns[code] = view[offset : offset + size].cast(_ITEM)
+        return dates, columns
+
+    def _meta_length(self):
+        return _HEADER.unpack_from(self._buffer)[1]
+
+
+_mapped = None
+
+
+def mapped():
+    """
+    Отображенный файл снимка из CURRENCY_SNAPSHOT_PATH или None.
+    Файл переоткрывается, только если его заменили.
+    """
+    global _mapped
+    path = settings.CURRENCY_SNAPSHOT_PATH
+    if not path:
+        return None
+    try:
+        stat = _stat_key(os.stat(path))
+    except FileNotFoundError:
+        return None
+    current = _mapped
+    if current is not None and current._stat == stat:
+        return current
+    try:
+        _mapped = MappedSnapshot(path)
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        logger.warning(f"Файл снимка курсов не прочитан: {e}")
+        return None
+    return _mapped
+
+
+def write(path, snapshot, history=None):
+    """
+    Атомарно записывает снимок курсов и индекс истории (RateHistoryIndex
+    или None) в path.
+    """
+    meta = {
+        "format": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "version": snapshot.version,
+        "rates": [
+            [r.currency_name, str(r.rate), r.actual_date.isoformat()]
+            for r in snapshot.records
+        ],
+        "quotes": [
+            [q.base, q.quote, q.units, q.actual_date.isoformat()]
+            for q in snapshot.quotes
+        ],
+        "history": None,
+    }
+    arrays = []
+    if history is not None:
+        codes = sorted(history.columns)
+        meta["history"] = {
+            "version": history.version,
+            "dates": len(history.dates),
+            "codes": codes,
+        }
+        arrays.append(array(_ITEM, history.dates))
+        arrays.extend(
+            array(_ITEM, (rate or 0 for rate in history.columns[code]))
+            for code in codes
+        )
+    header = json.dumps(meta, separators=(",", ":")).encode()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".rates-", suffix=".tmp")
+    try:
+        # mkstemp создает файл 0600, а читают его воркеры
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, len(header)))
+            f.write(header)
+            f.write(b"\0" * (_data_offset(len(header)) - _HEADER.size - len(header)))
+            for values in arrays:
+                values.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _data_offset(meta_length):
+    end = _HEADER.size + meta_length
+    return -(-end // _ITEM_SIZE) * _ITEM_SIZE
+
+
+def _stat_key(stat):
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
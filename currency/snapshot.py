@@ -0,0 +1,202 @@
+import hashlib
+from decimal import ROUND_HALF_EVEN, Decimal
+from currency import fixedpoint
+from currency.graph import Quote, RateGraph
+
+
+class RateRecord:
+    __slots__ = ("index", "currency_name", "rate", "actual_date")
+
+    def __init__(self, index, currency_name, rate, actual_date):
+        self.index = index
+        self.currency_name = currency_name
+        self.rate = rate
+        self.actual_date = actual_date
+
+    def __repr__(self):
+        return f"<RateRecord {self.currency_name}={self.rate}>"
+
+
+class RateSnapshot:
+    """
+    Неизменяемый снимок актуальных курсов (база - EUR).
+
+    Строится один раз на версию данных и используется конвертером,
+    калькулятором и валидацией без обращений к БД. Конвертация идет
+    по лучшим маршрутам графа котировок (currency.graph).
+    """
+
+    __slots__ = (
+        "version",
+        "actual_date",
+        "codes",
+        "index",
+        "rates",
+        "records",
+        "quotes",
+        "units",
+        "graph",
+        "matrix",
+        "_lookup",
+        "_ratios",
+        "_rows",
+    )
+
+    def __init__(self, rows, quotes=()):
+        records = tuple(
+            RateRecord(i, name, Decimal(str(rate)), actual_date)
+            for i, (name, rate, actual_date) in enumerate(rows)
+        )
+        self.records = records
+        self.quotes = tuple(quotes)
+        self.codes = tuple(r.currency_name for r in records)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.rates = tuple(r.rate for r in records)
+        self.version = self._make_version(records, self.quotes)
+        self.actual_date = max((r.actual_date for r in records), default=None)
+        # курсы как целые с масштабом 10**RATE_PLACES
+        self.units = tuple(fixedpoint.to_units(r) for r in self.rates)
+        # граф котировок: курсы к EUR и котировки других пар (quotes);
+        # EUR идет сразу после валют из rows, затем валюты только из quotes
+        self.graph = RateGraph(
+            (
+                *(
+                    Quote("EUR", r.currency_name, units, r.actual_date)
+                    for r, units in zip(records, self.units)
+                ),
+                *self.quotes,
+            ),
+            codes=(*self.codes, "EUR"),
+        )
+        self._lookup = self.graph.index
+        # точные курсы маршрутов (числитель, знаменатель) по позициям
+        self._ratios = tuple(
+            tuple(
+                (route.numerator, route.denominator) if route else None
+                for route in routes
+            )
+            for routes in self.graph.routes
+        )
+        # матрица кросс-курсов: matrix[from][to] = курс from -> to
+        # целыми с масштабом 10**CROSS_RATE_PLACES, None - маршрута нет
+        self.matrix = tuple(
+            tuple(route.cross_rate() if route else None for route in routes)
+            for routes in self.graph.routes
+        )
+        self._rows = {}
+
+    @classmethod
+    def from_currencies(cls, currencies, quotes=()):
+        return cls(
+            ((c.currency_name, c.rate, c.actual_date) for c in currencies), quotes
+        )
+
+    @staticmethod
+    def _make_version(records, quotes):
+        digest = hashlib.sha1()
+        for r in records:
+            digest.update(f"{r.currency_name}:{r.rate}:{r.actual_date};".encode())
+        for q in quotes:
+            digest.update(f"{q.base}/{q.quote}:{q.units}:{q.actual_date};".encode())
+        return digest.hexdigest()
+
+    @property
+    def choices(self):
+        return [(c, c) for c in self.graph.codes]
+
+    def position(self, currency_name):
+        return self._lookup.get(currency_name)
+
+    def cross_rate(self, from_currency, to_currency):
+        """Кросс-курс целым с масштабом 10**CROSS_RATE_PLACES."""
+        return self.matrix[self._lookup[from_currency]][self._lookup[to_currency]]
+
+    def connected(self, from_position, to_position):
+        return self._ratios[from_position][to_position] is not None
+
+    def ratio(self, from_position, to_position):
+        """Точный курс маршрута (числитель, знаменатель) или None."""
+        return self._ratios[from_position][to_position]
+
+    def route(self, from_currency, to_currency):
+        """Маршрут конвертации: путь и котировки по шагам с их датами."""
+        return self.graph.route(from_currency, to_currency)
+
+    def matrix_row(self, base):
+        """Курсы всех валют относительно base, отформатированные один раз."""
+        row = self._rows.get(base)
+        if row is None:
+            rates = self.matrix[self._lookup[base]]
+            places = fixedpoint.CROSS_RATE_PLACES
+            row = {
+                code: fixedpoint.format_units(rates[i], places)
+                for code, i in self._lookup.items()
+                if rates[i] is not None
+            }
+            self._rows[base] = row
+        return row
+
+    def convert(
+        self,
+        from_currency,
+        to_currency,
+        amount,
+        places=fixedpoint.RESULT_PLACES,
+        rounding=ROUND_HALF_EVEN,
+    ):
+        """Точная конвертация; результат - целое с масштабом 10**places."""
+        numerator, denominator = self._ratios[self._lookup[from_currency]][
+            self._lookup[to_currency]
+        ]
+        return fixedpoint.convert(
+            fixedpoint.split(amount), denominator, numerator, places, rounding
+        )
+
+    def convert_many(
+        self,
+        from_positions,
+        to_positions,
+        amounts,
+        places=fixedpoint.RESULT_PLACES,
+        rounding=ROUND_HALF_EVEN,
+    ):
+        """Конвертация пакета за один проход по точным курсам маршрутов."""
+        ratios = self._ratios
+        convert, split = fixedpoint.convert, fixedpoint.split
+        results = []
+        for f, t, amount in zip(from_positions, to_positions, amounts):
+            numerator, denominator = ratios[f][t]
+            results.append(
+                convert(split(amount), denominator, numerator, places, rounding)
+            )
+        return results
+
+    def fan_out(
+        self,
+        from_currency,
+        amount,
+        places=fixedpoint.RESULT_PLACES,
+        rounding=ROUND_HALF_EVEN,
+    ):
+        """Конвертация одной суммы во все остальные валюты."""
+        f = self._lookup[from_currency]
+        ratios, amount = self._ratios[f], fixedpoint.split(amount)
+        return {
+            code: fixedpoint.convert(
+                amount, ratios[t][1], ratios[t][0], places, rounding
+            )
+            for code, t in self._lookup.items()
+            if t != f and ratios[t] is not None
+        }
+
+    def get(self, currency_name):
+        i = self.index.get(currency_name)
+        if i is None:
+            return None
+        return self.records[i]
+
+    def __contains__(self, currency_name):
+        return self.position(currency_name) is not None
+
+    def __len__(self):
+        return len(self.records)
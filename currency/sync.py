@@ -0,0 +1,510 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from datetime import date
+from uuid import uuid4
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.db.models import F, Min
+from django.utils import timezone
+from currency import caching, fixedpoint, metrics, providers, snapfile, utils
+from currency.graph import Quote
+from currency.locks import CacheLock
+from currency.models import Currency, CurrencyQuote, CurrencyRate
+from currency.snapshot import RateSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+def check_cached_currencies():
+    """
+    Актуальные валюты. Запрос всегда обслуживается последними удачными
+    данными, а синхронизация с ЕЦБ при устаревании уходит в фон.
+    """
+    cache_data = caching.get(caching.currencies_key())
+    if not cache_data:
+        logging.debug("Кэш пуст")
+        metrics.CACHE_REQUESTS.labels("miss").inc()
+        queryset = Currency.objects.filter(deleted_date=None)
+        if not settings.CURRENCY_REFRESH_ASYNC or not queryset.exists():
+            return refresh_currencies()
+        logging.debug("Данные взяты из БД до фонового обновления")
+        cache_data = _set_cache(queryset, fresh=False)
+    elif caching.get("currencies_fresh"):
+        logging.debug("Данные получены из кеша")
+        metrics.CACHE_REQUESTS.labels("hit").inc()
+        return cache_data
+    else:
+        metrics.CACHE_REQUESTS.labels("stale").inc()
+    refreshed = refresh_currencies_async()
+    return cache_data if refreshed is None else refreshed
+
+
+def get_cached_currency(currency_name):
+    """Валюта из собственного ключа кеша или None, если такой нет."""
+    key = caching.currency_key(currency_name)
+    cached = caching.get_many([key, "currencies_fresh"])
+    obj = cached.get(key)
+    if obj is not None and cached.get("currencies_fresh"):
+        return obj
+    currencies = check_cached_currencies()
+    obj = next((c for c in currencies if c.currency_name == currency_name), None)
+    if obj is not None:
+        caching.set(key, obj, timeout=settings.CURRENCY_STALE_TIMEOUT)
+    return obj
+
+
+def invalidate_currencies(currency_names):
+    """
+    После ручного изменения валют: инвалидирует только зависимые записи
+    кеша и публикует набор из БД, без синхронизации с ЕЦБ.
+    """
+    caching.invalidate(currency_names)
+    return _set_cache(Currency.objects.filter(deleted_date=None), fresh=False)
+
+
+def refresh_currencies():
+    """
+    Синхронизация с ЕЦБ в единственном экземпляре на все воркеры:
+    остальные ждут результат или отдают предыдущие данные.
+    """
+    lock = CacheLock("currencies", timeout=settings.CURRENCY_REFRESH_LOCK_TIMEOUT)
+    if not lock.acquire():
+        logging.debug("Синхронизация уже выполняется другим воркером")
+        return _wait_for_refresh()
+    try:
+        return _store(sync_currencies_with_api_ecb(lock), lock)
+    finally:
+        lock.release()
+
+
+def _store(objects, lock):
+    if objects is None:
+        # источники ответили 304: продлевается только флаг свежести, без
+        # записи в БД и кеш курсов, пересборки снимка и рассылки инвалидации.
+        # fence - чтобы устаревший владелец блокировки не перезаписал кеш
+        if lock is not None and not lock.fence():
+            logging.debug("Устаревший fencing token, кеш не обновляется")
+        else:
+            cache.set("currencies_fresh", True, timeout=refresh_timeout())
+        return cache.get(caching.currencies_key())
+    return _set_cache(objects, lock=lock)
+
+
+def _wait_for_refresh():
+    deadline = time.monotonic() + settings.CURRENCY_REFRESH_WAIT
+    while True:
+        cache_data = cache.get(caching.currencies_key())
+        if cache_data:
+            return cache_data
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(0.05)
+    logging.debug("Синхронизация не завершилась, данные взяты из БД")
+    return Currency.objects.filter(deleted_date=None)
+
+
+_refresh_lock = threading.Lock()
+
+
+def refresh_currencies_async():
+    """
+    Запускает синхронизацию в фоновом потоке (не более одной на процесс).
+    Если фоновое обновление выключено, синхронизирует сразу.
+    """
+    if not settings.CURRENCY_REFRESH_ASYNC:
+        return refresh_currencies()
+    if not _refresh_lock.acquire(blocking=False):
+        return None
+    threading.Thread(
+        target=_refresh_in_background, name="currency-refresh", daemon=True
+    ).start()
+    return None
+
+
+def _refresh_in_background():
+    try:
+        refresh_currencies()
+    except Exception:
+        logger.exception("Фоновое обновление курсов не удалось")
+        # повтор не раньше, чем через CURRENCY_REFRESH_RETRY
+        cache.set("currencies_fresh", True, timeout=settings.CURRENCY_REFRESH_RETRY)
+    finally:
+        connections.close_all()
+        _refresh_lock.release()
+
+
+def refresh_timeout(snapshot=None):
+    """
+    Через сколько секунд данные устареют: к следующей публикации ЕЦБ
+    или через CURRENCY_REFRESH_RETRY, если свежая публикация еще не пришла.
+    """
+    snapshot = snapshot or _rate_snapshot
+    now = timezone.now()
+    expected = utils.last_ecb_publication(now).date()
+    if snapshot is None or not snapshot.actual_date or snapshot.actual_date < expected:
+        return settings.CURRENCY_REFRESH_RETRY
+    return int((utils.next_ecb_publication(now) - now).total_seconds()) + 1
+
+
+_rate_snapshot = None
+
+
+def get_rate_snapshot():
+    """
+    Снимок курсов текущего процесса. Пересобирается, только если в кеше
+    сменилась версия данных; при совпадении версии запросов к БД нет.
+    Сначала проверяется файл снимка (CURRENCY_SNAPSHOT_PATH).
+    """
+    global _rate_snapshot
+    snapshot = _rate_snapshot
+    cached = caching.get_many(["rate_snapshot_version", "currencies_fresh"])
+    version = cached.get("rate_snapshot_version")
+    if snapshot is not None and snapshot.version == version:
+        return _refresh_if_stale(cached)
+    # снимок из файла задачи синхронизации - без кеша курсов и БД
+    mapped = snapfile.mapped()
+    if mapped is not None and version is None:
+        # кеш пуст (например, после перезапуска Redis): версия берется
+        # из файла, если другой воркер не успел записать свою
+        cache.add(
+            "rate_snapshot_version",
+            mapped.version,
+            timeout=settings.CURRENCY_STALE_TIMEOUT,
+        )
+        version = cache.get("rate_snapshot_version")
+    if mapped is not None and mapped.version == version:
+        _rate_snapshot = RateSnapshot(mapped.rate_rows(), mapped.quotes())
+        return _refresh_if_stale(cached)
+    queryset = check_cached_currencies()
+    if _rate_snapshot is not snapshot:
+        # снимок уже собран при синхронизации
+        return _rate_snapshot
+    return _publish_rate_snapshot(queryset)
+
+
+def _refresh_if_stale(cached):
+    # как в check_cached_currencies: ответ по текущему снимку, синхронизация
+    # в фоне (или сразу, если фоновое обновление выключено)
+    if not cached.get("currencies_fresh"):
+        metrics.CACHE_REQUESTS.labels("stale").inc()
+        refresh_currencies_async()
+    return _rate_snapshot
+
+
+def _publish_rate_snapshot(currencies):
+    global _rate_snapshot
+    _rate_snapshot = RateSnapshot.from_currencies(currencies, get_quotes())
+    cache.set(
+        "rate_snapshot_version",
+        _rate_snapshot.version,
+        timeout=settings.CURRENCY_STALE_TIMEOUT,
+    )
+    return _rate_snapshot
+
+
+def get_quotes():
+    """Котировки пар к другим базам (Quote) для графа снимка курсов."""
+    quotes = caching.get("currency_quotes")
+    if quotes is None:
+        quotes = _load_quotes()
+    return quotes
+
+
+def _load_quotes():
+    quotes = [
+        Quote(q.base, q.currency_name, fixedpoint.to_units(q.rate), q.actual_date)
+        for q in CurrencyQuote.objects.order_by("base", "currency_name")
+    ]
+    caching.set("currency_quotes", quotes, timeout=settings.CURRENCY_STALE_TIMEOUT)
+    return quotes
+
+
+def sync_currencies_with_api_ecb(lock=None, rate_set=None):
+    """
+    Записывает курсы источников (rate_set или загруженные сейчас) в БД.
+    Возвращает актуальные валюты или None, если ни один источник не изменил
+    данных (304), кеш курсов заполнен, а в БД курсы на дату источников -
+    тогда записывать нечего.
+    """
+    if rate_set is None:
+        with metrics.ecb_fetch():
+            rate_set = providers.fetch_rates()
+    if (
+        rate_set.not_modified
+        and cache.get(caching.currencies_key())
+        and _stored_actual_date() == rate_set.actual_date
+    ):
+        logging.debug("Курсы в источниках не изменились")
+        metrics.SYNC_OUTCOMES.labels("fresh").inc()
+        return None
+    ingest_exchange_rates(rate_set.for_db(), lock)
+    if _holds(lock) and (lock is None or lock.fence()):
+        providers.save_validators(rate_set)
+    return Currency.objects.filter(deleted_date=None)
+
+
+def _stored_actual_date():
+    # как в ingest_exchange_rates: самая старая дата обновляемых из ЕЦБ валют
+    return Currency.objects.filter(deleted_date=None, is_modified=False).aggregate(
+        actual_date=Min("actual_date")
+    )["actual_date"]
+
+
+def import_exchange_rates(ecb_data):
+    """
+    Запись курсов для cron: под общей с веб-воркерами блокировкой
+    синхронизации и с прогревом кеша. Возвращает счетчики
+    ingest_exchange_rates и время записи и прогрева, сек.
+    """
+    lock = CacheLock("currencies", timeout=settings.CURRENCY_REFRESH_LOCK_TIMEOUT)
+    if not lock.acquire():
+        raise RuntimeError("Синхронизация уже выполняется другим процессом")
+    try:
+        start = time.perf_counter()
+        counts = ingest_exchange_rates(ecb_data, lock)
+        written = time.perf_counter()
+        _set_cache(Currency.objects.filter(deleted_date=None), lock=lock)
+        counts["write_seconds"] = written - start
+        counts["cache_seconds"] = time.perf_counter() - written
+        return counts
+    finally:
+        lock.release()
+
+
+def purge_deleted_currencies(before, chunk_size=500, archive=None):
+    """
+    Удаляет валюты, удаленные не позже before, пакетами по chunk_size строк,
+    каждый пакет - в своей короткой транзакции, чтобы не держать блокировку
+    записи. archive - файл, куда перед удалением пишутся строки (JSON Lines).
+    Возвращает число удаленных строк.
+    """
+    queryset = Currency.objects.filter(deleted_date__lte=before).order_by()
+    purged = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.values_list("id", flat=True)[:chunk_size])
+            if not ids:
+                return purged
+            if archive is not None:
+                for row in Currency.objects.filter(id__in=ids).values():
+                    archive.write(json.dumps(row, cls=DjangoJSONEncoder) + "\n")
+            purged += Currency.objects.filter(id__in=ids).delete()[0]
+        logging.debug(f"Удалено валют: {purged}")
+
+
+def ingest_exchange_rates(ecb_data, lock=None):
+    """
+    Записывает курсы ЕЦБ в БД: историю - одним upsert по (валюта, дата),
+    текущие курсы - кроме измененных вручную (is_modified) и удаленных.
+    Если курсы в БД уже на дату ленты, запись пропускается. Строки с base -
+    котировки к другим базам, они заменяют прежние котировки тех же пар.
+    Возвращает счетчики inserted/updated/unchanged курсов к EUR.
+    """
+    quotes = [item for item in ecb_data if "base" in item]
+    ecb_data = [item for item in ecb_data if "base" not in item]
+    if quotes and _holds(lock):
+        _ingest_quotes(quotes)
+    actual_date = date.fromisoformat(str(ecb_data[0]["actual_date"]))
+    counts = {"actual_date": actual_date, "inserted": 0, "updated": 0, "unchanged": 0}
+    # удаленная запись учитывается, только если нет активной с тем же именем
+    existing = {
+        obj.currency_name: obj
+        for obj in Currency.objects.order_by(F("deleted_date").asc(nulls_last=True))
+    }
+    # самая старая дата среди обновляемых из ЕЦБ валют
+    db_actual_date = min(
+        (
+            obj.actual_date
+            for obj in existing.values()
+            if not obj.is_modified and obj.deleted_date is None
+        ),
+        default=None,
+    )
+    if db_actual_date == actual_date:
+        logging.debug("Данные актуальны")
+        metrics.SYNC_OUTCOMES.labels("fresh").inc()
+        counts["unchanged"] = len(ecb_data)
+        return counts
+
+    to_create, to_update = [], []
+    for item in ecb_data:
+        obj = existing.get(item["currency_name"])
+        if obj is None:
+            to_create.append(Currency(**{**item, "actual_date": actual_date}))
+        elif obj.is_modified or obj.deleted_date:
+            logging.debug(f"Валюта {obj.currency_name} изменена вручную, пропуск")
+        elif obj.rate != item["rate"] or obj.actual_date != actual_date:
+            obj.rate, obj.actual_date = item["rate"], actual_date
+            to_update.append(obj)
+    if not _holds(lock):
+        return counts
+    CurrencyRate.objects.bulk_create(
+        [
+            CurrencyRate(
+                currency_name=item["currency_name"],
+                rate=item["rate"],
+                actual_date=actual_date,
+            )
+            for item in ecb_data
+        ],
+        update_conflicts=True,
+        unique_fields=["currency_name", "actual_date"],
+        update_fields=["rate"],
+    )
+    # индекс истории пересобирается только после записи истории
+    cache.set("rate_history_version", uuid4().hex, timeout=None)
+    # активная валюта уникальна по имени: параллельная вставка не дублирует
+    Currency.objects.bulk_create(to_create, ignore_conflicts=True)
+    Currency.objects.bulk_update(to_update, ["actual_date", "rate"])
+    caching.invalidate([obj.currency_name for obj in to_create + to_update])
+    metrics.SYNC_OUTCOMES.labels("updated" if existing else "created").inc()
+    counts["inserted"], counts["updated"] = len(to_create), len(to_update)
+    counts["unchanged"] = len(ecb_data) - len(to_create) - len(to_update)
+    logging.debug(
+        f"Курсы на {actual_date}: добавлено {counts['inserted']}, "
+        f"обновлено {counts['updated']}"
+    )
+    return counts
+
+
+def _ingest_quotes(quotes):
+    CurrencyQuote.objects.bulk_create(
+        [
+            CurrencyQuote(
+                base=item["base"],
+                currency_name=item["currency_name"],
+                rate=item["rate"],
+                actual_date=date.fromisoformat(str(item["actual_date"])),
+            )
+            for item in quotes
+        ],
+        update_conflicts=True,
+        unique_fields=["base", "currency_name"],
+        update_fields=["rate", "actual_date"],
+    )
+    # снимок, собранный следом, видит новые котировки
+    _load_quotes()
+
+
+def _holds(lock):
+    if lock is None or lock.is_current():
+        return True
+    logging.debug("Блокировка синхронизации потеряна, запись пропущена")
+    return False
+
+
+def _set_cache(objects, fresh=True, lock=None):
+    if lock is not None and not lock.fence():
+        logging.debug("Устаревший fencing token, кеш не перезаписывается")
+        return objects
+    logging.debug("Установка кеша")
+    cache.set(
+        caching.currencies_key(), objects, timeout=settings.CURRENCY_STALE_TIMEOUT
+    )
+    # матрица кросс-курсов пересчитывается сразу при смене данных
+    snapshot = _publish_rate_snapshot(objects)
+    if fresh:
+        cache.set("currencies_fresh", True, timeout=refresh_timeout(snapshot))
+    # новая версия снимка и флаг свежести видны воркерам сразу, не по TTL L1
+    caching.publish_invalidation()
+    return objects
+
+
+# Async-версии для ASGI: кеш читается через async API, курсы ЕЦБ
+# загружаются без блокировки event loop, в поток уходит только работа с БД.
+
+
+async def acheck_cached_currencies():
+    key = await caching.acurrencies_key()
+    cached = await caching.aget_many([key, "currencies_fresh"])
+    cache_data = cached.get(key)
+    if not cache_data:
+        logging.debug("Кэш пуст")
+        metrics.CACHE_REQUESTS.labels("miss").inc()
+        queryset = Currency.objects.filter(deleted_date=None)
+        if not settings.CURRENCY_REFRESH_ASYNC or not await queryset.aexists():
+            return await arefresh_currencies()
+        logging.debug("Данные взяты из БД до фонового обновления")
+        cache_data = await sync_to_async(_cache_from_db)()
+    elif cached.get("currencies_fresh"):
+        metrics.CACHE_REQUESTS.labels("hit").inc()
+        return cache_data
+    else:
+        metrics.CACHE_REQUESTS.labels("stale").inc()
+    if not settings.CURRENCY_REFRESH_ASYNC:
+        return await arefresh_currencies()
+    refresh_currencies_async()
+    return cache_data
+
+
+async def aget_cached_currency(currency_name):
+    key = await caching.acurrency_key(currency_name)
+    cached = await caching.aget_many([key, "currencies_fresh"])
+    obj = cached.get(key)
+    if obj is not None and cached.get("currencies_fresh"):
+        return obj
+    currencies = await acheck_cached_currencies()
+    obj = next((c for c in currencies if c.currency_name == currency_name), None)
+    if obj is not None:
+        await caching.aset(key, obj, timeout=settings.CURRENCY_STALE_TIMEOUT)
+    return obj
+
+
+async def arefresh_currencies():
+    lock = CacheLock("currencies", timeout=settings.CURRENCY_REFRESH_LOCK_TIMEOUT)
+    if not await lock.aacquire():
+        logging.debug("Синхронизация уже выполняется другим воркером")
+        return await _await_refresh()
+    try:
+        with metrics.ecb_fetch():
+            rate_set = await providers.afetch_rates()
+        return await sync_to_async(_store_rate_set)(rate_set, lock)
+    finally:
+        await lock.arelease()
+
+
+# списки, а не queryset: async-код не должен обращаться к БД при итерации
+
+
+def _store_rate_set(rate_set, lock):
+    return list(_store(sync_currencies_with_api_ecb(lock, rate_set), lock))
+
+
+def _cache_from_db():
+    return list(_set_cache(Currency.objects.filter(deleted_date=None), fresh=False))
+
+
+async def _await_refresh():
+    deadline = time.monotonic() + settings.CURRENCY_REFRESH_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        cache_data = await cache.aget(await caching.acurrencies_key())
+        if cache_data:
+            return cache_data
+    logging.debug("Синхронизация не завершилась, данные взяты из БД")
+    return [obj async for obj in Currency.objects.filter(deleted_date=None)]
+
+
+async def aget_rate_snapshot():
+    """
+    get_rate_snapshot для async-представлений: при совпадении версии - без
+    потока, пересборка (из файла снимка, кеша или БД) - в потоке.
+    """
+    snapshot = _rate_snapshot
+    cached = await caching.aget_many(["rate_snapshot_version", "currencies_fresh"])
+    if snapshot is None or snapshot.version != cached.get("rate_snapshot_version"):
+        return await sync_to_async(get_rate_snapshot)()
+    if cached.get("currencies_fresh"):
+        return snapshot
+    metrics.CACHE_REQUESTS.labels("stale").inc()
+    if not settings.CURRENCY_REFRESH_ASYNC:
+        await arefresh_currencies()
+    else:
+        refresh_currencies_async()
+    return _rate_snapshot
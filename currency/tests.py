@@ -3,15 +3,61 @@ from django.test.testcases import SimpleTestCase
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
-from django.db import connection
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
 from django.conf import settings
 from rest_framework.exceptions import ErrorDetail
-from currency.serializers import CurrencySerializer
-from currency.models import Currency
+from currency.serializers import (
+    CurrencyBatchConvertSerializer,
+    CurrencyConvertSerializer,
+    CurrencySerializer,
+)
+from currency.models import Currency, CurrencyQuote, CurrencyRate
 from datetime import date, timedelta
 from django.core.cache import cache
 from rest_framework.test import APIClient
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core.management import CommandError, call_command
+from unittest.mock import patch
+from prometheus_client import REGISTRY
+from io import StringIO
+from datetime import datetime
+from decimal import (
+    ROUND_CEILING,
+    ROUND_DOWN,
+    ROUND_FLOOR,
+    ROUND_HALF_DOWN,
+    ROUND_HALF_EVEN,
+    ROUND_HALF_UP,
+    ROUND_UP,
+    Decimal,
+    localcontext,
+)
+from currency import (
+    caching,
+    export,
+    fixedpoint,
+    history,
+    providers,
+    snapfile,
+    sync,
+    utils,
+)
+from currency.locks import FENCE_SCRIPT, RELEASE_SCRIPT, CacheLock
+from currency.history import import_history, get_history_index, save_snapshot_file
+from currency.graph import Quote
+from currency.snapshot import RateSnapshot
+from currency.views import calc_rates_script
+import asyncio
+import json
+import threading
+import random
+import re
+import requests
+import time
+import tempfile
+import zipfile
+import os
 
 settings.DEBUG = True
 
@@ -25,13 +71,13 @@ class CurrencyAPITestCase(TestCase):
     def test_ok(self):
         response = self.client.get(reverse("currency-list"), format="json")
         self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
-        self.assertEqual(4, len(connection.queries))
+        self.assertEqual(5, len(connection.queries))
         serializer_data = CurrencySerializer(Currency.objects.all(), many=True).data
         self.assertEqual(serializer_data, response.data)
 
     def test_get_from_cache(self):
         response = self.client.get(reverse("currency-list"), format="json")
-        self.assertEqual(4, len(connection.queries))
+        self.assertEqual(5, len(connection.queries))
         response = self.client.get(reverse("currency-list"), format="json")
         self.assertEqual(0, len(connection.queries))
 
@@ -58,6 +104,16 @@ class CurrencyAPITestCase(TestCase):
             response.data,
         )
 
+    def test_update_rejects_zero_rate(self):
+        response = self.client.patch(
+            reverse("currency-detail", kwargs={"currency": "usd"}),
+            data={"rate": "0"},
+            format="json",
+        )
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertIn("rate", response.data)
+        self.assertNotEqual(0, Currency.objects.get(currency_name="USD").rate)
+
     def test_update_currency(self):
         response = self.client.patch(
             reverse("currency-detail", kwargs={"currency": "zar"}),
@@ -247,6 +303,156 @@ class CurrencyAPITestCase(TestCase):
         result = "%.7f" % (2 / php)
         self.assertEqual(result, response.data.get("result"))
 
+    def test_convert_without_queries(self):
+        self.client.get(reverse("currency-list"), format="json")
+        response = self.client.post(
+            reverse("currency-convert"),
+            data={"from_currency": "USD", "to_currency": "TRY", "amount": 20},
+            format="json",
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        self.assertEqual(0, len(connection.queries))
+
+    def test_convert_deleted_currency(self):
+        self.client.delete(
+            reverse("currency-detail", kwargs={"currency": "usd"}), format="json"
+        )
+        response = self.client.post(
+            reverse("currency-convert"),
+            data={"from_currency": "USD", "to_currency": "TRY", "amount": 20},
+            format="json",
+        )
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual(
+            {
+                "from_currency": [
+                    ErrorDetail(
+                        string='"USD" is not a valid choice.', code="invalid_choice"
+                    )
+                ]
+            },
+            response.data,
+        )
+
+    def test_convert_batch(self):
+        self.client.get(reverse("currency-list"), format="json")
+        usd = float(Currency.objects.get(currency_name="USD").rate)
+        tryy = float(Currency.objects.get(currency_name="TRY").rate)
+        response = self.client.post(
+            reverse("currency-convert-batch"),
+            data={
+                "items": [
+                    {"from_currency": "USD", "to_currency": "TRY", "amount": 20},
+                    {"from_currency": "EUR", "to_currency": "USD", "amount": 100},
+                    {"from_currency": "BTC", "to_currency": "USD", "amount": "x"},
+                    {"from_currency": "USD", "to_currency": "USD", "amount": 1},
+                    {"to_currency": "USD", "amount": 1},
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        self.assertEqual(0, len(connection.queries))
+        results = response.data["results"]
+        self.assertEqual({"result": "%.7f" % float(tryy / usd * 20)}, results[0])
+        self.assertEqual({"result": "%.7f" % float(usd * 100)}, results[1])
+        self.assertEqual(
+            {
+                "from_currency": ['"BTC" is not a valid choice.'],
+                "amount": ["A valid number is required."],
+            },
+            results[2]["errors"],
+        )
+        self.assertEqual(
+            {"response": ["Нельзя указывать одинаковые валюты"]}, results[3]["errors"]
+        )
+        self.assertEqual(
+            {"from_currency": ["This field is required."]}, results[4]["errors"]
+        )
+
+    def test_convert_batch_fan_out(self):
+        response = self.client.post(
+            reverse("currency-convert-batch"),
+            data={"from_currency": "EUR", "amount": 2},
+            format="json",
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        results = response.data["results"]
+        self.assertEqual(30, len(results))
+        self.assertNotIn("EUR", results)
+        usd = Currency.objects.get(currency_name="USD")
+        self.assertEqual("%.7f" % float(usd.rate * 2), results["USD"])
+
+    def test_convert_batch_without_items(self):
+        response = self.client.post(
+            reverse("currency-convert-batch"), data={"amount": 2}, format="json"
+        )
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual(
+            {
+                "response": [
+                    ErrorDetail(
+                        string="Нужно передать items или from_currency и amount",
+                        code="invalid",
+                    )
+                ]
+            },
+            response.data,
+        )
+
+    def test_matrix_for_base(self):
+        response = self.client.get(
+            reverse("currency-matrix"), {"base": "usd"}, format="json"
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        usd = Currency.objects.get(currency_name="USD").rate
+        jpy = Currency.objects.get(currency_name="JPY").rate
+        self.assertEqual("USD", response.data["base"])
+        self.assertEqual(31, len(response.data["rates"]))
+        self.assertEqual("%.10f" % (jpy / usd), response.data["rates"]["JPY"])
+        self.assertEqual("%.10f" % (1 / usd), response.data["rates"]["EUR"])
+        response = self.client.get(
+            reverse("currency-matrix"), {"base": "USD"}, format="json"
+        )
+        self.assertEqual(0, len(connection.queries))
+
+    def test_full_matrix(self):
+        response = self.client.get(reverse("currency-matrix"), format="json")
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        rates = response.data["rates"]
+        self.assertEqual(31, len(rates))
+        self.assertEqual("1.0000000000", rates["TRY"]["TRY"])
+        usd = Currency.objects.get(currency_name="USD").rate
+        self.assertEqual("%.10f" % usd, rates["EUR"]["USD"])
+
+    def test_matrix_unknown_base(self):
+        response = self.client.get(
+            reverse("currency-matrix"), {"base": "btc"}, format="json"
+        )
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual(
+            {
+                "base": [
+                    ErrorDetail(
+                        string='"BTC" is not a valid choice.', code="invalid_choice"
+                    )
+                ]
+            },
+            response.data,
+        )
+
+    def test_matrix_follows_updated_rate(self):
+        self.client.get(reverse("currency-matrix"), {"base": "EUR"}, format="json")
+        self.client.patch(
+            reverse("currency-detail", kwargs={"currency": "usd"}),
+            data={"rate": "2.0000000"},
+            format="json",
+        )
+        response = self.client.get(
+            reverse("currency-matrix"), {"base": "EUR"}, format="json"
+        )
+        self.assertEqual("2.0000000000", response.data["rates"]["USD"])
+
     def test_check_required_values(self):
         response = self.client.post(
             reverse("currency-convert"),
@@ -319,7 +525,1911 @@ class CurrencyAPITestCase(TestCase):
 
 
 class CurrencyCalcTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+
     def test_html_calc_ok(self):
         response = self.client.get("/calc/")
         self.assertTemplateUsed(response, "calc.html")
         self.assertContains(response, "Calc Currencies")
+
+    def test_html_calc_post_ok(self):
+        self.client.get("/calc/")
+        response = self.client.post(
+            "/calc/", data={"from_currency": "EUR", "to_currency": "USD", "amount": 1}
+        )
+        self.assertEqual(0, len(connection.queries))
+        usd = Currency.objects.get(currency_name="USD")
+        self.assertContains(response, "Result: %.7f" % float(usd.rate))
+
+    def test_html_calc_embeds_rates(self):
+        self.client.get("/calc/")
+        response = self.client.get("/calc/")
+        self.assertEqual(0, len(connection.queries))
+        snapshot = sync.get_rate_snapshot()
+        match = re.search(
+            r'<script id="calc-rates" type="application/json">(.*?)</script>',
+            response.content.decode(),
+        )
+        data = json.loads(match.group(1))
+        self.assertEqual(snapshot.version, data["version"])
+        self.assertEqual(str(fixedpoint.RATE_SCALE), data["rates"]["EUR"])
+        self.assertEqual(len(snapshot.choices), len(data["rates"]))
+        self.assertEqual([], data["server_pairs"])
+        # браузер считает по тем же целым курсам, что и сервер
+        amount = Decimal("123.45")
+        self.assertEqual(
+            snapshot.convert("USD", "JPY", amount),
+            fixedpoint.convert(
+                fixedpoint.split(amount),
+                int(data["rates"]["USD"]),
+                int(data["rates"]["JPY"]),
+            ),
+        )
+        self.assertIn('id="calc-result" hidden', response.content.decode())
+
+
+class CurrencyCacheInvalidationTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+
+    def test_update_keeps_other_currencies_warm(self):
+        for currency in ("usd", "jpy"):
+            self.client.get(
+                reverse("currency-detail", kwargs={"currency": currency}),
+                format="json",
+            )
+        cache.set("unrelated", "value")
+        with patch("currency.providers.fetch_rates") as fetch:
+            self.client.patch(
+                reverse("currency-detail", kwargs={"currency": "usd"}),
+                data={"rate": "2.0000000"},
+                format="json",
+            )
+            response = self.client.get(
+                reverse("currency-detail", kwargs={"currency": "jpy"}), format="json"
+            )
+            self.assertEqual(0, len(connection.queries))
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            response = self.client.get(
+                reverse("currency-detail", kwargs={"currency": "usd"}), format="json"
+            )
+            self.assertEqual("2.0000000", response.data["rate"])
+            response = self.client.get(reverse("currency-list"), format="json")
+            self.assertEqual(0, len(connection.queries))
+            self.assertEqual("2.0000000", response.data[0]["rate"])
+            fetch.assert_not_called()
+        self.assertEqual("value", cache.get("unrelated"))
+
+    def test_delete_bumps_generation(self):
+        self.client.get(reverse("currency-list"), format="json")
+        generation = caching.generation()
+        usd_key = caching.currency_key("USD")
+        jpy_key = caching.currency_key("JPY")
+        self.client.delete(
+            reverse("currency-detail", kwargs={"currency": "usd"}), format="json"
+        )
+        self.assertEqual(generation + 1, caching.generation())
+        self.assertNotEqual(usd_key, caching.currency_key("USD"))
+        self.assertEqual(jpy_key, caching.currency_key("JPY"))
+        self.assertEqual(29, len(cache.get(caching.currencies_key())))
+
+    def test_counter_survives_eviction(self):
+        generation = caching.generation()
+        cache.delete(caching.GENERATION_KEY)
+        self.assertGreater(caching.generation(), generation)
+
+    def test_delete_unknown_currency(self):
+        response = self.client.delete(
+            reverse("currency-detail", kwargs={"currency": "btc"}), format="json"
+        )
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+
+class CurrencyConditionalGetTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+
+    def test_list_etag_and_not_modified(self):
+        response = self.client.get(reverse("currency-list"), format="json")
+        etag = response["ETag"]
+        self.assertTrue(etag.startswith('"'))
+        self.assertTrue(response["Cache-Control"].startswith("public, max-age="))
+        usd = Currency.objects.get(currency_name="USD")
+        self.assertIn(usd.actual_date.strftime("%d %b %Y"), response["Last-Modified"])
+        with patch.object(CurrencySerializer, "to_representation") as serialize:
+            response = self.client.get(
+                reverse("currency-list"), format="json", HTTP_IF_NONE_MATCH=etag
+            )
+            serialize.assert_not_called()
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+        self.assertEqual(b"", response.content)
+        self.assertEqual(etag, response["ETag"])
+        self.assertEqual(0, len(connection.queries))
+
+    def test_list_served_from_cached_body(self):
+        first = self.client.get(reverse("currency-list"), format="json")
+        with patch.object(CurrencySerializer, "to_representation") as serialize:
+            second = self.client.get(reverse("currency-list"), format="json")
+            serialize.assert_not_called()
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first.data, second.data)
+
+    def test_detail_etag_changes_only_for_edited_currency(self):
+        etags = {}
+        for currency in ("usd", "jpy"):
+            etags[currency] = self.client.get(
+                reverse("currency-detail", kwargs={"currency": currency}),
+                format="json",
+            )["ETag"]
+        self.client.patch(
+            reverse("currency-detail", kwargs={"currency": "usd"}),
+            data={"rate": "2.0000000"},
+            format="json",
+        )
+        response = self.client.get(
+            reverse("currency-detail", kwargs={"currency": "usd"}),
+            format="json",
+            HTTP_IF_NONE_MATCH=etags["usd"],
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertNotEqual(etags["usd"], response["ETag"])
+        response = self.client.get(
+            reverse("currency-detail", kwargs={"currency": "jpy"}),
+            format="json",
+            HTTP_IF_NONE_MATCH=etags["jpy"],
+        )
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+
+
+class CurrencyCacheableGetTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+
+    def test_get_convert(self):
+        url = reverse("currency-convert") + "?from=USD&to=TRY&amount=20"
+        # курсы ленты (04.04.2025) - последняя публикация ЕЦБ
+        published = datetime(2025, 4, 4, 16, 0, tzinfo=utils.ECB_TIMEZONE)
+        with patch("currency.utils.last_ecb_publication", return_value=published):
+            response = self.client.get(url, format="json")
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        usd = float(Currency.objects.get(currency_name="USD").rate)
+        tryy = float(Currency.objects.get(currency_name="TRY").rate)
+        self.assertEqual("%.7f" % float(tryy / usd * 20), response.data["result"])
+        max_age = int(response["Cache-Control"].split("max-age=")[1])
+        now = timezone.now()
+        until_publication = (utils.next_ecb_publication(now) - now).total_seconds()
+        self.assertAlmostEqual(until_publication, max_age, delta=5)
+
+    def test_max_age_before_publication_ingested(self):
+        # ЕЦБ уже опубликовал курсы новее ленты: ответ кешируется только
+        # до повторной попытки синхронизации
+        url = reverse("currency-convert") + "?from=USD&to=TRY&amount=20"
+        response = self.client.get(url, format="json")
+        self.assertEqual(
+            f"public, max-age={settings.CURRENCY_REFRESH_RETRY}",
+            response["Cache-Control"],
+        )
+
+    def test_get_convert_redirects_to_canonical_url(self):
+        response = self.client.get(
+            reverse("currency-convert"),
+            {"amount": "020", "to": "try", "from": "usd", "utm": "x"},
+            format="json",
+        )
+        self.assertEqual(status.HTTP_301_MOVED_PERMANENTLY, response.status_code)
+        self.assertEqual(
+            reverse("currency-convert") + "?from=USD&to=TRY&amount=20",
+            response["Location"],
+        )
+
+    def test_get_convert_errors_use_param_names(self):
+        response = self.client.get(
+            reverse("currency-convert"), {"from": "btc", "to": "usd"}, format="json"
+        )
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual(
+            {
+                "from": [
+                    ErrorDetail(
+                        string='"BTC" is not a valid choice.', code="invalid_choice"
+                    )
+                ],
+                "amount": [
+                    ErrorDetail(string="This field is required.", code="required")
+                ],
+            },
+            response.data,
+        )
+
+    def test_pair_rate(self):
+        url = reverse(
+            "currency-rate", kwargs={"from_currency": "USD", "to_currency": "JPY"}
+        )
+        response = self.client.get(url, format="json")
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        usd = Currency.objects.get(currency_name="USD")
+        jpy = Currency.objects.get(currency_name="JPY")
+        self.assertEqual(
+            {
+                "from_currency": "USD",
+                "to_currency": "JPY",
+                "rate": "%.10f" % (jpy.rate / usd.rate),
+                "path": ["USD", "EUR", "JPY"],
+                "hops": [
+                    {
+                        "from_currency": "USD",
+                        "to_currency": "EUR",
+                        "rate": "%.10f" % (1 / usd.rate),
+                        "actual_date": str(usd.actual_date),
+                    },
+                    {
+                        "from_currency": "EUR",
+                        "to_currency": "JPY",
+                        "rate": "%.10f" % jpy.rate,
+                        "actual_date": str(jpy.actual_date),
+                    },
+                ],
+            },
+            response.data,
+        )
+        self.assertIn("public, max-age=", response["Cache-Control"])
+        response = self.client.get(
+            reverse(
+                "currency-rate", kwargs={"from_currency": "usd", "to_currency": "jpy"}
+            ),
+            format="json",
+        )
+        self.assertEqual(status.HTTP_301_MOVED_PERMANENTLY, response.status_code)
+        self.assertEqual(url, response["Location"])
+
+
+class CurrencyAsyncTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+
+    def _drf_url(self, name, **kwargs):
+        # маршрут с суффиксом формата обслуживает представление DRF
+        return reverse(name, kwargs={**kwargs, "format": "json"})
+
+    def test_list_matches_drf_view(self):
+        with patch("currency.providers.fetch_exchange_rates_for_db") as fetch:
+            response = self.client.get(reverse("currency-list"))
+        # холодный кеш синхронизируется без блокирующего вызова в event loop
+        fetch.assert_not_called()
+        self.assertTrue(asyncio.iscoroutinefunction(response.resolver_match.func))
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        self.assertEqual("application/json", response["Content-Type"])
+        drf_response = self.client.get(self._drf_url("currency-list"))
+        self.assertFalse(asyncio.iscoroutinefunction(drf_response.resolver_match.func))
+        self.assertEqual(drf_response.content, response.content)
+        for header in ("ETag", "Cache-Control"):
+            self.assertEqual(drf_response[header], response[header])
+        self.assertEqual("Accept", response["Vary"])
+        response = self.client.get(
+            reverse("currency-list"), HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+
+    def test_detail(self):
+        response = self.client.get(
+            reverse("currency-detail", kwargs={"currency": "usd"})
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        serializer_data = CurrencySerializer(
+            Currency.objects.get(currency_name="USD")
+        ).data
+        self.assertEqual(serializer_data, response.json())
+        response = self.client.get(
+            reverse("currency-detail", kwargs={"currency": "btc"})
+        )
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        drf_response = self.client.get(self._drf_url("currency-detail", currency="btc"))
+        self.assertEqual(drf_response.content, response.content)
+
+    def test_convert_matches_drf_view(self):
+        url, drf_url = reverse("currency-convert"), self._drf_url("currency-convert")
+        data = {"from_currency": "USD", "to_currency": "TRY", "amount": 20}
+        for body in (data, {**data, "to_currency": "USD"}, {**data, "amount": "x"}):
+            response = self.client.post(url, data=body, format="json")
+            drf_response = self.client.post(drf_url, data=body, format="json")
+            self.assertEqual(drf_response.status_code, response.status_code)
+            self.assertEqual(drf_response.content, response.content)
+        self.assertEqual(
+            {"response": ["Нельзя указывать одинаковые валюты"]},
+            self.client.post(
+                url, data={**data, "to_currency": "USD"}, format="json"
+            ).json(),
+        )
+        query = {"from": "USD", "to": "TRY", "amount": "20"}
+        response = self.client.get(url, query)
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        self.assertEqual(
+            self.client.post(url, data, format="json").json(), response.json()
+        )
+        self.assertIn("public, max-age=", response["Cache-Control"])
+        response = self.client.get(url, {**query, "from": "usd"})
+        self.assertEqual(status.HTTP_301_MOVED_PERMANENTLY, response.status_code)
+        self.assertEqual(f"{url}?from=USD&to=TRY&amount=20", response["Location"])
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertIn("from", response.json())
+
+    def test_other_requests_go_to_drf(self):
+        url = reverse("currency-convert")
+        # ошибки разбора тела - как у парсеров DRF
+        response = self.client.post(url, data="{", content_type="application/json")
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertTrue(response.json()["detail"].startswith("JSON parse error"))
+        response = self.client.post(url, data="x", content_type="text/plain")
+        self.assertEqual(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, response.status_code)
+        # браузерный API и запись
+        response = self.client.get(reverse("currency-list"), HTTP_ACCEPT="text/html")
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTrue(response["Content-Type"].startswith("text/html"))
+        response = self.client.patch(
+            reverse("currency-detail", kwargs={"currency": "usd"}),
+            data={"rate": "2.0000000"},
+            format="json",
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        self.assertEqual(Decimal("2"), Currency.objects.get(currency_name="USD").rate)
+
+    def test_calc(self):
+        client = Client()
+        response = client.get(reverse("currency-calc"))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTrue(asyncio.iscoroutinefunction(response.resolver_match.func))
+        self.assertContains(response, 'action="/calc/"')
+        response = client.post(
+            reverse("currency-calc"),
+            data={"from_currency": "USD", "to_currency": "EUR", "amount": 10},
+        )
+        usd = Currency.objects.get(currency_name="USD").rate
+        self.assertContains(response, "Result: %.7f" % (10 / float(usd)))
+
+    async def test_concurrent_requests(self):
+        responses = await asyncio.gather(
+            *(self.async_client.get(reverse("currency-list")) for _ in range(20))
+        )
+        self.assertEqual({200}, {r.status_code for r in responses})
+        self.assertEqual(1, len({r.content for r in responses}))
+
+
+class CurrencyMetricsTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse("currency-list"), format="json")
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn(
+            'currency_http_request_duration_seconds_count{endpoint="currency-list",'
+            'method="GET",status="200"}',
+            body,
+        )
+        self.assertIn(
+            'currency_http_request_db_queries_count{endpoint="currency-list"}', body
+        )
+        self.assertIn("currency_rates_age_seconds ", body)
+        self.assertGreater(self.sample("currency_rates_age_seconds"), 0)
+
+    def test_request_queries(self):
+        before = self.sample(
+            "currency_http_request_db_queries_sum", endpoint="currency-list"
+        )
+        self.client.get(reverse("currency-list"), format="json")
+        self.client.get(reverse("currency-list"), format="json")
+        self.assertEqual(
+            5,
+            self.sample(
+                "currency_http_request_db_queries_sum", endpoint="currency-list"
+            )
+            - before,
+        )
+
+    def test_cache_and_sync_outcomes(self):
+        miss = self.sample("currency_cache_requests_total", result="miss")
+        hit = self.sample("currency_cache_requests_total", result="hit")
+        created = self.sample("currency_sync_total", outcome="created")
+        fresh = self.sample("currency_sync_total", outcome="fresh")
+        sync.check_cached_currencies()
+        sync.check_cached_currencies()
+        cache.clear()
+        sync.check_cached_currencies()
+        self.assertEqual(
+            2, self.sample("currency_cache_requests_total", result="miss") - miss
+        )
+        self.assertEqual(
+            1, self.sample("currency_cache_requests_total", result="hit") - hit
+        )
+        self.assertEqual(
+            1, self.sample("currency_sync_total", outcome="created") - created
+        )
+        self.assertEqual(1, self.sample("currency_sync_total", outcome="fresh") - fresh)
+
+    def test_ecb_fetch_failures(self):
+        failures = self.sample("currency_ecb_fetch_failures_total")
+        fetches = self.sample("currency_ecb_fetch_duration_seconds_count")
+        with patch(
+            "currency.providers.fetch_rates",
+            side_effect=requests.ConnectionError,
+        ):
+            with self.assertRaises(requests.ConnectionError):
+                sync.refresh_currencies()
+        self.assertEqual(1, self.sample("currency_ecb_fetch_failures_total") - failures)
+        self.assertEqual(
+            1, self.sample("currency_ecb_fetch_duration_seconds_count") - fetches
+        )
+
+
+class FixedPointTestCase(SimpleTestCase):
+    def test_divide_rounding_modes(self):
+        cases = {
+            ROUND_HALF_EVEN: (2, 2, 3, -2, -2, -3),
+            ROUND_HALF_UP: (2, 3, 3, -2, -3, -3),
+            ROUND_HALF_DOWN: (2, 2, 3, -2, -2, -3),
+            ROUND_UP: (3, 3, 3, -3, -3, -3),
+            ROUND_DOWN: (2, 2, 2, -2, -2, -2),
+            ROUND_CEILING: (3, 3, 3, -2, -2, -2),
+            ROUND_FLOOR: (2, 2, 2, -3, -3, -3),
+        }
+        # 2.25, 2.5, 2.75 и те же отрицательные
+        numerators = (9, 10, 11, -9, -10, -11)
+        for rounding, expected in cases.items():
+            with self.subTest(rounding=rounding):
+                self.assertEqual(
+                    expected,
+                    tuple(fixedpoint.divide(n, 4, rounding) for n in numerators),
+                )
+        self.assertEqual(4, fixedpoint.divide(14, 4, ROUND_HALF_EVEN))
+        self.assertEqual(5, fixedpoint.divide(20, 4, ROUND_UP))
+
+    def test_matches_decimal(self):
+        rng = random.Random(0)
+        for _ in range(2000):
+            amount = Decimal(rng.randint(-(10**12), 10**12)).scaleb(-rng.randint(0, 10))
+            from_rate = Decimal(rng.randint(1, 10**10)).scaleb(-7)
+            to_rate = Decimal(rng.randint(1, 10**10)).scaleb(-7)
+            places = rng.choice((0, 2, 7))
+            rounding = rng.choice(fixedpoint.ROUNDING_MODES)
+            result = fixedpoint.convert(
+                fixedpoint.split(amount),
+                fixedpoint.to_units(from_rate),
+                fixedpoint.to_units(to_rate),
+                places,
+                rounding,
+            )
+            with localcontext() as ctx:
+                ctx.prec = 100
+                expected = (amount * to_rate / from_rate).quantize(
+                    Decimal(1).scaleb(-places), rounding=rounding
+                )
+            formatted = fixedpoint.format_units(result, places)
+            # Decimal сохраняет знак у нуля, целые - нет
+            self.assertEqual(expected, Decimal(formatted))
+            self.assertEqual(expected.as_tuple().exponent, -places)
+            self.assertEqual(str(expected).lstrip("-"), formatted.lstrip("-"))
+
+    def test_units(self):
+        self.assertEqual((2469, 20), fixedpoint.split("123.45"))
+        self.assertEqual((-500, 1), fixedpoint.split(Decimal("-5E+2")))
+        self.assertEqual(-5000000000, fixedpoint.to_units(Decimal("-5E+2")))
+        self.assertEqual(11057000, fixedpoint.to_units(Decimal("1.1057")))
+        self.assertEqual(2, fixedpoint.to_units("0.00000015"))
+        self.assertEqual("0.0000012", fixedpoint.format_units(12, 7))
+        self.assertEqual("-1.50", fixedpoint.format_units(-150, 2))
+        self.assertEqual("161", fixedpoint.format_units(161, 0))
+        self.assertEqual("20.5", fixedpoint.plain(Decimal("20.5000000000")))
+        self.assertEqual(0, fixedpoint.minor_units("JPY"))
+        self.assertEqual(2, fixedpoint.minor_units("USD"))
+
+
+class CurrencyExactConvertTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.client.get(reverse("currency-list"), format="json")
+        self.usd = Currency.objects.get(currency_name="USD").rate
+        self.jpy = Currency.objects.get(currency_name="JPY").rate
+
+    def convert(self, **data):
+        response = self.client.post(
+            reverse("currency-convert"), data=data, format="json"
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        return response.data["result"]
+
+    def expected(self, amount, places, rounding=ROUND_HALF_EVEN):
+        with localcontext() as ctx:
+            ctx.prec = 100
+            value = Decimal(amount) * self.jpy / self.usd
+            return str(value.quantize(Decimal(1).scaleb(-places), rounding=rounding))
+
+    def test_fractional_amount(self):
+        result = self.convert(from_currency="USD", to_currency="JPY", amount="0.1")
+        self.assertEqual(self.expected("0.1", 7), result)
+
+    def test_rounding_and_minor_units(self):
+        data = {"from_currency": "USD", "to_currency": "JPY", "amount": "12.34"}
+        down = self.convert(**data, rounding="ROUND_DOWN", minor_units=True)
+        up = self.convert(**data, rounding="ROUND_UP", minor_units=True)
+        self.assertEqual(self.expected("12.34", 0, ROUND_DOWN), down)
+        self.assertEqual(self.expected("12.34", 0, ROUND_UP), up)
+        self.assertEqual(1, int(up) - int(down))
+        result = self.convert(
+            from_currency="JPY", to_currency="USD", amount=1000, minor_units=True
+        )
+        self.assertRegex(result, r"^\d+\.\d{2}$")
+
+    def test_get_canonical_options(self):
+        response = self.client.get(
+            reverse("currency-convert"),
+            {
+                "minor_units": "true",
+                "from": "usd",
+                "to": "jpy",
+                "amount": "12.3400",
+                "rounding": "ROUND_UP",
+            },
+        )
+        self.assertEqual(status.HTTP_301_MOVED_PERMANENTLY, response.status_code)
+        self.assertEqual(
+            reverse("currency-convert")
+            + "?from=USD&to=JPY&amount=12.34&rounding=ROUND_UP&minor_units=true",
+            response["Location"],
+        )
+        response = self.client.get(response["Location"])
+        self.assertEqual(self.expected("12.34", 0, ROUND_UP), response.data["result"])
+
+    def test_invalid_rounding(self):
+        response = self.client.post(
+            reverse("currency-convert"),
+            data={
+                "from_currency": "USD",
+                "to_currency": "JPY",
+                "amount": 1,
+                "rounding": "ROUND_05UP",
+            },
+            format="json",
+        )
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertIn("rounding", response.data)
+
+
+class ImportExchangeRatesCommandTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+
+    def import_rates(self):
+        out = StringIO()
+        call_command("import_exchange_rates", stdout=out)
+        return out.getvalue()
+
+    def test_inserts_and_warms_cache(self):
+        output = self.import_rates()
+        self.assertIn("добавлено 30, обновлено 0, без изменений 0", output)
+        self.assertIn("прогрев кеша", output)
+        self.assertEqual(30, Currency.objects.count())
+        self.assertEqual(30, CurrencyRate.objects.count())
+        self.assertEqual(30, len(cache.get(caching.currencies_key())))
+        self.assertTrue(cache.get("currencies_fresh"))
+        with self.assertNumQueries(0):
+            APIClient().get(reverse("currency-list"), format="json")
+
+    def test_unchanged_feed_skips_write(self):
+        self.import_rates()
+        with CaptureQueriesContext(connection) as queries:
+            output = self.import_rates()
+        self.assertIn("добавлено 0, обновлено 0, без изменений 30", output)
+        self.assertFalse(
+            [q for q in queries if q["sql"].startswith(("INSERT", "UPDATE"))]
+        )
+
+    def test_updates_respecting_manual_overrides(self):
+        self.import_rates()
+        Currency.objects.update(actual_date=date(2025, 4, 3))
+        Currency.objects.filter(currency_name="USD").update(
+            rate=Decimal("2"), is_modified=True
+        )
+        Currency.objects.filter(currency_name="JPY").update(rate=Decimal("100"))
+        CurrencyRate.objects.filter(currency_name="JPY").update(rate=Decimal("100"))
+        output = self.import_rates()
+        self.assertIn("добавлено 0, обновлено 29, без изменений 1", output)
+        usd = Currency.objects.get(currency_name="USD")
+        self.assertEqual((Decimal("2"), date(2025, 4, 3)), (usd.rate, usd.actual_date))
+        jpy = Currency.objects.get(currency_name="JPY")
+        self.assertEqual(Decimal("161.87"), jpy.rate)
+        # история - курсы ЕЦБ, в том числе для измененных вручную валют
+        self.assertEqual(30, CurrencyRate.objects.count())
+        self.assertEqual(
+            Decimal("161.87"), CurrencyRate.objects.get(currency_name="JPY").rate
+        )
+        self.assertEqual(
+            Decimal("1.1057"), CurrencyRate.objects.get(currency_name="USD").rate
+        )
+
+    def test_fetch_error(self):
+        with patch(
+            "currency.providers.fetch_exchange_rates_for_db",
+            side_effect=requests.ConnectionError("нет сети"),
+        ):
+            with self.assertRaisesMessage(CommandError, "Ошибка: нет сети"):
+                self.import_rates()
+        self.assertFalse(Currency.objects.exists())
+
+
+class CurrencySyncTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+
+    @override_settings(CURRENCY_REFRESH_ASYNC=True)
+    def test_stale_data_refreshed_in_background(self):
+        self.client.get(reverse("currency-list"), format="json")
+        cache.delete("currencies_fresh")
+        with patch("currency.sync.refresh_currencies") as refresh:
+            response = self.client.get(reverse("currency-list"), format="json")
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual(0, len(connection.queries))
+            with sync._refresh_lock:
+                refresh.assert_called_once()
+
+    @override_settings(CURRENCY_REFRESH_ASYNC=True)
+    def test_stale_snapshot_refreshed_in_background(self):
+        url = reverse(
+            "currency-rate", kwargs={"from_currency": "USD", "to_currency": "JPY"}
+        )
+        self.client.get(url)
+        cache.delete("currencies_fresh")
+        with patch("currency.sync.refresh_currencies") as refresh:
+            response = self.client.get(url)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            with sync._refresh_lock:
+                refresh.assert_called_once()
+
+    def test_not_modified_feed_only_rearms_fresh(self):
+        self.client.get(reverse("currency-list"), format="json")
+        version = cache.get("rate_snapshot_version")
+        cache.delete("currencies_fresh")
+        rate_set = providers.RateSet("ecb", date(2025, 4, 4), {}, not_modified=True)
+        with (
+            patch("currency.providers.fetch_rates", return_value=rate_set),
+            patch("currency.sync._publish_rate_snapshot") as rebuild,
+            patch("currency.caching.publish_invalidation") as publish,
+            CaptureQueriesContext(connection) as queries,
+        ):
+            self.assertEqual(30, len(sync.refresh_currencies()))
+        # только проверка даты курсов в БД
+        self.assertEqual(1, len(queries.captured_queries))
+        rebuild.assert_not_called()
+        publish.assert_not_called()
+        self.assertTrue(cache.get("currencies_fresh"))
+        self.assertEqual(version, cache.get("rate_snapshot_version"))
+
+    def test_not_modified_feed_ingested_if_db_older(self):
+        self.client.get(reverse("currency-list"), format="json")
+        Currency.objects.update(actual_date=date(2025, 4, 3))
+        rate_set = providers.RateSet(
+            "ecb", date(2025, 4, 4), {"USD": Decimal("1.1")}, not_modified=True
+        )
+        with patch("currency.providers.fetch_rates", return_value=rate_set):
+            sync.refresh_currencies()
+        self.assertEqual(
+            date(2025, 4, 4), Currency.objects.get(currency_name="USD").actual_date
+        )
+
+    def test_validators_saved_after_ingest(self):
+        rate_set = providers.RateSet(
+            "ecb",
+            date(2025, 4, 4),
+            {"USD": Decimal("1.1")},
+            validators=(("provider:test", ('"v1"', None, None)),),
+        )
+        lock = CacheLock("currencies", timeout=60)
+        lock.acquire()
+        cache.delete(lock.key)
+        sync.sync_currencies_with_api_ecb(lock, rate_set)
+        # запись пропущена: следующий запрос к источнику - без условий
+        self.assertIsNone(cache.get("provider:test"))
+        sync.sync_currencies_with_api_ecb(rate_set=rate_set)
+        self.assertEqual('"v1"', cache.get("provider:test")[0])
+
+    @override_settings(CURRENCY_REFRESH_ASYNC=True)
+    def test_cache_miss_served_from_db(self):
+        self.client.get(reverse("currency-list"), format="json")
+        cache.clear()
+        with patch("currency.sync.refresh_currencies") as refresh:
+            response = self.client.get(reverse("currency-list"), format="json")
+            with sync._refresh_lock:
+                refresh.assert_called_once()
+        serializer_data = CurrencySerializer(Currency.objects.all(), many=True).data
+        self.assertEqual(serializer_data, response.data)
+
+    @override_settings(CURRENCY_REFRESH_ASYNC=True)
+    def test_failed_background_refresh_keeps_data(self):
+        self.client.get(reverse("currency-list"), format="json")
+        cache.delete("currencies_fresh")
+        with patch(
+            "currency.sync.refresh_currencies", side_effect=ConnectionError
+        ) as refresh:
+            self.client.get(reverse("currency-list"), format="json")
+            with sync._refresh_lock:
+                refresh.assert_called_once()
+            self.assertTrue(cache.get("currencies_fresh"))
+            response = self.client.get(reverse("currency-list"), format="json")
+            self.assertEqual(30, len(response.data))
+            refresh.assert_called_once()
+
+    def test_ecb_publication_schedule(self):
+        tz = utils.ECB_TIMEZONE
+        friday_evening = datetime(2025, 4, 4, 17, 0, tzinfo=tz)
+        self.assertEqual(
+            datetime(2025, 4, 7, 16, 0, tzinfo=tz),
+            utils.next_ecb_publication(friday_evening),
+        )
+        self.assertEqual(
+            datetime(2025, 4, 4, 16, 0, tzinfo=tz),
+            utils.last_ecb_publication(friday_evening),
+        )
+        # Страстная пятница и Пасхальный понедельник 2025 - праздники TARGET
+        self.assertEqual(
+            datetime(2025, 4, 17, 16, 0, tzinfo=tz),
+            utils.last_ecb_publication(datetime(2025, 4, 22, 10, 0, tzinfo=tz)),
+        )
+        self.assertEqual(
+            datetime(2025, 4, 22, 16, 0, tzinfo=tz),
+            utils.next_ecb_publication(datetime(2025, 4, 17, 16, 30, tzinfo=tz)),
+        )
+
+    def test_refresh_command(self):
+        out = StringIO()
+        call_command("refresh_exchange_rates", stdout=out)
+        self.assertIn("Курсы валют обновлены", out.getvalue())
+        self.assertEqual(30, Currency.objects.count())
+        self.assertTrue(cache.get("currencies_fresh"))
+
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CurrencySingleFlightTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+
+    def test_lock_fencing_token(self):
+        first = CacheLock("test", timeout=60)
+        second = CacheLock("test", timeout=60)
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        # блокировка первого истекла и перехвачена вторым
+        cache.delete(first.key)
+        self.assertTrue(second.acquire())
+        self.assertGreater(second.token, first.token)
+        self.assertFalse(first.is_current())
+        self.assertTrue(second.fence())
+        self.assertFalse(first.fence())
+        first.release()
+        self.assertTrue(second.is_current())
+        second.release()
+        self.assertIsNone(cache.get(second.key))
+
+    def test_release_after_expiry_keeps_new_owner(self):
+        first = CacheLock("test", timeout=60)
+        second = CacheLock("test", timeout=60)
+        self.assertTrue(first.acquire())
+        cache.delete(first.key)
+        self.assertTrue(second.acquire())
+        first.release()
+        self.assertEqual(second.token, cache.get(second.key))
+        async_first = CacheLock("test", timeout=60)
+        async_first.token = first.token
+        asyncio.run(async_first.arelease())
+        self.assertTrue(second.is_current())
+
+    def test_redis_fence_and_release_are_atomic(self):
+        lock = CacheLock("test", timeout=60)
+        self.assertTrue(lock.acquire())
+        token = lock.token
+        with (
+            patch("currency.caching.redis_client") as redis,
+            patch.object(cache, "delete") as delete,
+        ):
+            redis.return_value.eval.return_value = 0
+            # перехваченная блокировка: скрипт отказал, запись не разрешена
+            self.assertFalse(lock.fence())
+            lock.release()
+        delete.assert_not_called()
+        self.assertEqual(
+            [
+                ((FENCE_SCRIPT, 1, cache.make_key(lock.committed_key), token),),
+                ((RELEASE_SCRIPT, 1, cache.make_key(lock.key), token),),
+            ],
+            redis.return_value.eval.call_args_list,
+        )
+
+    def test_concurrent_misses_sync_once(self):
+        objects = list(sync.refresh_currencies())
+        cache.clear()
+        calls = []
+
+        def slow_sync(lock=None):
+            calls.append(lock.token)
+            time.sleep(0.2)
+            return objects
+
+        results = []
+        with patch("currency.sync.sync_currencies_with_api_ecb", side_effect=slow_sync):
+            threads = [
+                threading.Thread(
+                    target=lambda: results.append(sync.check_cached_currencies())
+                )
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(1, len(calls))
+        self.assertEqual(8, len(results))
+        for result in results:
+            self.assertEqual(
+                [c.currency_name for c in objects], [c.currency_name for c in result]
+            )
+
+    def test_stale_holder_does_not_overwrite_cache(self):
+        objects = list(sync.refresh_currencies())
+        stale = CacheLock("currencies", timeout=60)
+        self.assertTrue(stale.acquire())
+        cache.delete(stale.key)
+        self.assertIsNotNone(sync.refresh_currencies())
+        sync._set_cache(objects[:1], lock=stale)
+        self.assertEqual(len(objects), len(cache.get(caching.currencies_key())))
+
+    def test_lost_lock_skips_db_write(self):
+        sync.refresh_currencies()
+        Currency.objects.update(actual_date=date(2025, 1, 1))
+        lock = CacheLock("currencies", timeout=60)
+        lock.acquire()
+        cache.delete(lock.key)
+        sync.sync_currencies_with_api_ecb(lock)
+        self.assertEqual(
+            date(2025, 1, 1), Currency.objects.get(currency_name="USD").actual_date
+        )
+
+
+HISTORY_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<gesmes:Envelope xmlns:gesmes="http://www.gesmes.org/xml/2002-08-01" xmlns="http://www.ecb.int/vocabulary/2002-08-01/eurofxref">
+<gesmes:subject>Reference rates</gesmes:subject>
+<Cube>
+<Cube time="2025-04-04"><Cube currency="USD" rate="1.1057"/><Cube currency="JPY" rate="161.87"/></Cube>
+<Cube time="2025-04-03"><Cube currency="USD" rate="1.1097"/><Cube currency="JPY" rate="162.04"/></Cube>
+<Cube time="2025-04-02"><Cube currency="USD" rate="1.0785"/><Cube currency="JPY" rate="161.97"/></Cube>
+</Cube>
+</gesmes:Envelope>
+"""
+
+HISTORY_CSV = """Date,USD,JPY,CYP,
+2025-04-04,1.1057,161.87,N/A,
+2025-04-03,1.1097,162.04,N/A,
+1999-01-04,1.1789,133.73,0.58231,
+"""
+
+
+class CurrencyHistoryTestCase(TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_iter_history_xml(self):
+        rows = list(utils.iter_history_rates(self._write("hist.xml", HISTORY_XML)))
+        self.assertEqual(6, len(rows))
+        self.assertEqual(("2025-04-04", "USD", "1.1057"), rows[0])
+        self.assertEqual(("2025-04-02", "JPY", "161.97"), rows[-1])
+
+    def test_iter_history_zip(self):
+        path = os.path.join(self.tmp.name, "hist.zip")
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("eurofxref-hist.csv", HISTORY_CSV)
+        rows = list(utils.iter_history_rates(path))
+        self.assertEqual(7, len(rows))
+        self.assertIn(("1999-01-04", "CYP", "0.58231"), rows)
+        self.assertNotIn("N/A", [rate for _, _, rate in rows])
+
+    def test_import_history_command(self):
+        path = self._write("hist.xml", HISTORY_XML)
+        out = StringIO()
+        call_command(
+            "import_exchange_rates_history", source=path, chunk_size=4, stdout=out
+        )
+        self.assertIn("Обработано курсов: 6, новых: 6", out.getvalue())
+        self.assertEqual(
+            "1.1097000",
+            str(
+                CurrencyRate.objects.get(
+                    currency_name="USD", actual_date=date(2025, 4, 3)
+                ).rate
+            ),
+        )
+        out = StringIO()
+        call_command("import_exchange_rates_history", source=path, stdout=out)
+        self.assertIn("Обработано курсов: 6, новых: 0", out.getvalue())
+        self.assertEqual(6, CurrencyRate.objects.count())
+        # ошибка - ненулевой код выхода для cron и CI
+        with self.assertRaisesMessage(CommandError, "Ошибка:"):
+            call_command(
+                "import_exchange_rates_history",
+                source=self._write("broken.xml", "<broken"),
+                stdout=StringIO(),
+            )
+
+
+class CurrencyAsOfTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        import_history(
+            [
+                ("2000-04-19", "USD", "1.1380"),
+                ("2000-04-19", "JPY", "161.85"),
+                ("2000-04-20", "USD", "1.1355"),
+                ("2000-04-20", "JPY", "161.65"),
+                # 21.04 и 24.04 - Страстная пятница и Пасхальный понедельник
+                ("2000-04-25", "USD", "1.1456"),
+                ("2000-04-25", "JPY", "161.06"),
+            ]
+        )
+
+    def _convert(self, day, from_currency="USD", to_currency="JPY"):
+        return self.client.post(
+            reverse("currency-convert"),
+            data={
+                "from_currency": from_currency,
+                "to_currency": to_currency,
+                "amount": 100,
+                "date": day,
+            },
+            format="json",
+        )
+
+    def test_convert_on_fixing_date(self):
+        response = self._convert("2000-04-19")
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        self.assertEqual("%.7f" % (161.85 / 1.1380 * 100), response.data["result"])
+        self.assertEqual("2000-04-19", response.data["rate_date"])
+
+    def test_convert_on_holidays_and_weekend(self):
+        for day in ("2000-04-21", "2000-04-22", "2000-04-24"):
+            response = self._convert(day, to_currency="EUR")
+            self.assertEqual("2000-04-20", response.data["rate_date"])
+            self.assertEqual("%.7f" % (100 / 1.1355), response.data["result"])
+
+    def test_convert_before_history(self):
+        response = self._convert("1998-12-31")
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual(
+            {
+                "date": [
+                    ErrorDetail(string="Нет курсов ЕЦБ на эту дату", code="invalid")
+                ]
+            },
+            response.data,
+        )
+
+    def test_convert_with_current_rates(self):
+        response = self._convert(
+            str(date.today()), from_currency="EUR", to_currency="USD"
+        )
+        usd = Currency.objects.get(currency_name="USD")
+        self.assertEqual("%.7f" % float(usd.rate * 100), response.data["result"])
+        self.assertEqual(str(usd.actual_date), response.data["rate_date"])
+
+    def test_index_lookup_without_queries(self):
+        self._convert("2000-04-19")
+        response = self._convert("2000-04-23")
+        self.assertEqual(0, len(connection.queries))
+        self.assertEqual("2000-04-20", response.data["rate_date"])
+        self.assertEqual(4, len(get_history_index()))
+
+    def test_index_kept_on_manual_update(self):
+        self._convert("2000-04-19")
+        index = get_history_index()
+        self.client.patch(
+            reverse("currency-detail", kwargs={"currency": "usd"}),
+            data={"rate": "2.0000000"},
+            format="json",
+        )
+        self.assertIs(index, get_history_index())
+        # запись истории синхронизацией индекс пересобирает
+        Currency.objects.update(actual_date=date(2025, 4, 3))
+        sync.refresh_currencies()
+        self.assertIsNot(index, get_history_index())
+
+
+class CurrencyHistoryRangeTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        import_history(
+            [
+                ("2000-04-19", "USD", "1.1380"),
+                ("2000-04-19", "JPY", "161.85"),
+                ("2000-04-20", "USD", "1.1355"),
+                ("2000-04-20", "JPY", "161.65"),
+                ("2000-04-25", "USD", "1.1456"),
+                ("2000-04-26", "USD", "1.1400"),
+                ("2000-04-26", "JPY", "160.00"),
+            ]
+        )
+
+    def _history(self, currency="usd", **params):
+        return self.client.get(
+            reverse("currency-history", kwargs={"currency": currency}),
+            data={"to": "2000-12-31", **params},
+            format="json",
+        )
+
+    def test_rows_and_columns(self):
+        response = self._history(**{"from": "2000-04-20"})
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        self.assertEqual(
+            {
+                "currency": "USD",
+                "base": "EUR",
+                "results": [
+                    {"date": "2000-04-20", "rate": "1.1355000"},
+                    {"date": "2000-04-25", "rate": "1.1456000"},
+                    {"date": "2000-04-26", "rate": "1.1400000"},
+                ],
+                "next": None,
+            },
+            response.data,
+        )
+        response = self._history(shape="columns", base="jpy")
+        self.assertEqual(
+            {
+                "currency": "USD",
+                "base": "JPY",
+                # 25.04 нет курса JPY
+                "dates": ["2000-04-19", "2000-04-20", "2000-04-26"],
+                "rates": [
+                    "%.10f" % (1.1380 / 161.85),
+                    "%.10f" % (1.1355 / 161.65),
+                    "%.10f" % (1.14 / 160),
+                ],
+                "next": None,
+            },
+            response.data,
+        )
+
+    def test_keyset_pages(self):
+        response = self._history(shape="columns", limit=2)
+        self.assertEqual(["2000-04-19", "2000-04-20"], response.data["dates"])
+        self.assertEqual(
+            reverse("currency-history", kwargs={"currency": "usd"})
+            + "?to=2000-12-31&shape=columns&limit=2&after=2000-04-20",
+            response.data["next"],
+        )
+        # следующая страница - по курсору, без запросов к БД
+        response = self.client.get(response.data["next"])
+        self.assertEqual(0, len(connection.queries))
+        self.assertEqual(["2000-04-25", "2000-04-26"], response.data["dates"])
+        self.assertIsNone(response.data["next"])
+
+    def test_invalid_params(self):
+        self.assertEqual(
+            status.HTTP_404_NOT_FOUND, self._history(currency="btc").status_code
+        )
+        response = self._history(**{"from": "2000-05-01", "to": "2000-04-01"})
+        self.assertEqual(["to"], list(response.data))
+        self.assertEqual(["base"], list(self._history(base="usd").data))
+        self.assertEqual(["limit"], list(self._history(limit=0).data))
+
+
+@override_settings(CURRENCY_EXPORT_CHUNK_SIZE=2)
+class ExportExchangeRatesTestCase(TestCase):
+    def setUp(self) -> None:
+        import_history(
+            [
+                ("2000-04-19", "USD", "1.1380"),
+                ("2000-04-19", "JPY", "161.85"),
+                ("2000-04-20", "USD", "1.1355"),
+                ("2000-04-20", "JPY", "161.65"),
+                ("2000-04-25", "USD", "1.1456"),
+            ]
+        )
+        Currency.objects.create(
+            currency_name="USD", rate=Decimal("1.1057"), actual_date=date(2025, 4, 4)
+        )
+        Currency.objects.create(
+            currency_name="GBP",
+            rate=Decimal("0.85"),
+            actual_date=date(2025, 4, 4),
+            deleted_date=date(2025, 4, 5),
+        )
+
+    def test_history_csv_in_chunks(self):
+        chunks = list(export.iter_export("history", "csv"))
+        # заголовок и пакеты по 2 строки
+        self.assertEqual(4, len(chunks))
+        self.assertEqual(
+            "currency_name,actual_date,rate\n"
+            "JPY,2000-04-19,161.8500000\n"
+            "JPY,2000-04-20,161.6500000\n"
+            "USD,2000-04-19,1.1380000\n"
+            "USD,2000-04-20,1.1355000\n"
+            "USD,2000-04-25,1.1456000\n",
+            "".join(chunks),
+        )
+
+    def test_command(self):
+        out = StringIO()
+        call_command(
+            "export_exchange_rates",
+            "history",
+            "--currency=usd",
+            "--from=2000-04-20",
+            stdout=out,
+        )
+        self.assertEqual(
+            [
+                {"currency_name": "USD", "actual_date": day, "rate": rate}
+                for day, rate in (
+                    ("2000-04-20", "1.1355000"),
+                    ("2000-04-25", "1.1456000"),
+                )
+            ],
+            [json.loads(line) for line in out.getvalue().splitlines()],
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "current.csv")
+            out = StringIO()
+            call_command(
+                "export_exchange_rates",
+                "current",
+                "--format=csv",
+                f"--output={path}",
+                stdout=out,
+            )
+            with open(path) as f:
+                self.assertEqual(
+                    "currency_name,rate,actual_date,is_modified\n"
+                    "USD,1.1057000,2025-04-04,False\n",
+                    f.read(),
+                )
+        self.assertIn("Выгружено строк: 1", out.getvalue())
+
+    async def test_streaming_endpoint(self):
+        response = await self.async_client.get(
+            reverse("currency-export", kwargs={"table": "current", "fmt": "ndjson"})
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTrue(response.streaming)
+        self.assertEqual("application/x-ndjson", response["Content-Type"])
+        body = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(
+            {
+                "currency_name": "USD",
+                "rate": "1.1057000",
+                "actual_date": "2025-04-04",
+                "is_modified": False,
+            },
+            json.loads(body),
+        )
+        response = await self.async_client.get(
+            reverse("currency-export", kwargs={"table": "history", "fmt": "csv"}),
+            {"to": "2000-13-01"},
+        )
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_streaming_endpoint_under_wsgi(self):
+        response = self.client.get(
+            reverse("currency-export", kwargs={"table": "history", "fmt": "csv"}),
+            {"currency": "jpy"},
+        )
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.is_async)
+        self.assertEqual(
+            "currency_name,actual_date,rate\n"
+            "JPY,2000-04-19,161.8500000\n"
+            "JPY,2000-04-20,161.6500000\n",
+            b"".join(response.streaming_content).decode(),
+        )
+
+
+class CurrencySchemaTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _create(self, name="USD", **kwargs):
+        return Currency.objects.create(
+            currency_name=name,
+            rate=Decimal("1.1"),
+            actual_date=date.today(),
+            **kwargs,
+        )
+
+    def test_active_currency_name_is_unique(self):
+        self._create()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self._create()
+
+    def test_deleted_duplicates_allowed(self):
+        self._create(deleted_date=date.today() - timedelta(days=1))
+        self._create(deleted_date=date.today())
+        self._create()
+        self.assertEqual(1, Currency.objects.filter(deleted_date=None).count())
+
+    def test_query_plans_use_indexes(self):
+        # get() и delete() сбрасывают сортировку по умолчанию
+        queries = {
+            "unique_active_currency_name": [
+                Currency.objects.filter(
+                    deleted_date=None, currency_name="USD"
+                ).order_by()
+            ],
+            "currency_ecb_actual_date_idx": [
+                Currency.objects.filter(deleted_date=None, is_modified=False).order_by(
+                    "actual_date"
+                )
+            ],
+            "currency_deleted_date_idx": [
+                Currency.objects.filter(deleted_date__lte=date.today()).order_by()
+            ],
+        }
+        for index, querysets in queries.items():
+            for queryset in querysets:
+                with self.subTest(query=str(queryset.query)):
+                    plan = queryset.explain()
+                    self.assertIn(index, plan)
+                    self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_ingest_updates_active_row_next_to_deleted(self):
+        self._create(deleted_date=date.today())
+        active = self._create()
+        sync.ingest_exchange_rates(
+            [
+                {
+                    "currency_name": "USD",
+                    "rate": Decimal("1.2"),
+                    "actual_date": "2026-01-02",
+                }
+            ]
+        )
+        active.refresh_from_db()
+        self.assertEqual(Decimal("1.2"), active.rate)
+        self.assertEqual(2, Currency.objects.filter(currency_name="USD").count())
+
+
+@override_settings(CURRENCY_LOCAL_CACHE_TTL=60, CURRENCY_LOCAL_CACHE_SIZE=100)
+class LocalCacheTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        # как без Redis: L1 согласован, рассылка инвалидации не нужна
+        patcher = patch.multiple(caching, _listener=False, _coherent=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        caching.local.clear()
+        self.addCleanup(caching.local.clear)
+
+    def test_hot_reads_skip_shared_cache(self):
+        url = reverse("currency-detail", kwargs={"currency": "usd"})
+        data = {"from_currency": "USD", "to_currency": "JPY", "amount": 1}
+
+        def round_trip():
+            return (
+                self.client.get(url, format="json"),
+                self.client.post(reverse("currency-convert"), data=data, format="json"),
+            )
+
+        # синхронизация при первом запросе сбрасывает L1, второй его заполняет
+        round_trip()
+        first, _ = round_trip()
+        with (
+            patch.object(cache, "get", side_effect=AssertionError),
+            patch.object(cache, "get_many", side_effect=AssertionError),
+        ):
+            response, convert = round_trip()
+        self.assertEqual(first.content, response.content)
+        self.assertEqual(status.HTTP_200_OK, convert.status_code)
+
+    def test_update_invalidates_local_cache(self):
+        url = reverse("currency-detail", kwargs={"currency": "usd"})
+        self.client.get(url, format="json")
+        self.assertTrue(len(caching.local))
+        self.client.patch(url, data={"rate": "2.0000000"}, format="json")
+        response = self.client.get(url, format="json")
+        self.assertEqual("2.0000000", response.data["rate"])
+
+    def test_invalidation_published(self):
+        caching.get(caching.currencies_key())
+        with patch("currency.caching.redis_client") as redis:
+            caching.invalidate(["USD"])
+        redis.return_value.publish.assert_called_once_with(
+            cache.make_key(caching.INVALIDATION_CHANNEL), b"1"
+        )
+        self.assertEqual(0, len(caching.local))
+
+    def test_lru_and_ttl(self):
+        local = caching.LocalCache()
+        for key in "abc":
+            local.set(key, key, 60, local.epoch, 2)
+        self.assertIsNone(local.get("a"))
+        self.assertEqual("c", local.get("c"))
+        local.set("d", "d", 0, local.epoch, 2)
+        self.assertIsNone(local.get("d"))
+        # значение, прочитанное из L2 до сброса, в L1 не попадает
+        epoch = local.epoch
+        local.clear()
+        local.set("e", "e", 60, epoch, 2)
+        self.assertIsNone(local.get("e"))
+
+
+class PurgeDeletedCurrenciesCommandTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        today = date.today()
+        for i, name in enumerate(("USD", "JPY", "GBP", "CHF", "SEK")):
+            Currency.objects.create(
+                currency_name=name,
+                rate=Decimal("1.5"),
+                actual_date=today,
+                deleted_date=today - timedelta(days=31 + i),
+            )
+        Currency.objects.create(
+            currency_name="NOK",
+            rate=Decimal("11.5"),
+            actual_date=today,
+            deleted_date=today - timedelta(days=29),
+        )
+        Currency.objects.create(
+            currency_name="USD", rate=Decimal("1.1"), actual_date=today
+        )
+
+    def purge(self, **options):
+        out = StringIO()
+        call_command("purge_deleted_currencies", stdout=out, **options)
+        return out.getvalue()
+
+    def test_purges_old_deleted_in_chunks(self):
+        with CaptureQueriesContext(connection) as queries:
+            output = self.purge(chunk_size=2)
+        self.assertIn(": 5 за", output)
+        deletes = [q for q in queries if q["sql"].startswith("DELETE")]
+        self.assertEqual(3, len(deletes))
+        self.assertEqual(
+            [("NOK", True), ("USD", False)],
+            [
+                (obj.currency_name, obj.deleted_date is not None)
+                for obj in Currency.objects.all()
+            ],
+        )
+
+    def test_archive(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "purged.jsonl")
+            self.purge(days=32, archive=path)
+            with open(path, encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f]
+        self.assertEqual(
+            ["JPY", "GBP", "CHF", "SEK"], [r["currency_name"] for r in rows]
+        )
+        self.assertEqual("1.5000000", rows[0]["rate"])
+        self.assertEqual(3, Currency.objects.count())
+
+    def test_sync_does_not_purge(self):
+        sync.sync_currencies_with_api_ecb()
+        self.assertEqual(6, Currency.objects.exclude(deleted_date=None).count())
+
+
+class SnapshotFileTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "rates.snapshot")
+        settings_override = override_settings(CURRENCY_SNAPSHOT_PATH=self.path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(self.reset_process)
+        APIClient().get(reverse("currency-list"), format="json")
+        import_history(
+            [
+                ("2000-04-19", "USD", "1.1380"),
+                ("2000-04-19", "JPY", "161.85"),
+                ("2000-04-20", "USD", "1.1355"),
+            ]
+        )
+
+    def reset_process(self):
+        # как в только что запущенном воркере
+        sync._rate_snapshot = None
+        history._history_index = None
+        snapfile._mapped = None
+
+    def test_worker_starts_warm_from_file(self):
+        self.assertEqual(self.path, save_snapshot_file())
+        snapshot, index = sync.get_rate_snapshot(), get_history_index()
+        self.reset_process()
+        with self.assertNumQueries(0):
+            mapped_snapshot = sync.get_rate_snapshot()
+            mapped_index = get_history_index()
+        self.assertEqual(snapshot.version, mapped_snapshot.version)
+        self.assertEqual(snapshot.matrix, mapped_snapshot.matrix)
+        self.assertEqual(index.version, mapped_index.version)
+        self.assertIsInstance(mapped_index.dates, memoryview)
+        self.assertEqual(list(index.dates), list(mapped_index.dates))
+        day = date(2000, 4, 20)
+        self.assertEqual(
+            index.fixing_rates("USD", "JPY", day),
+            mapped_index.fixing_rates("USD", "JPY", day),
+        )
+        self.assertIsNone(mapped_index.fixing_rates("USD", "JPY", day))
+        self.assertEqual(
+            (11380000, 1618500000, date(2000, 4, 19)),
+            mapped_index.fixing_rates("USD", "JPY", date(2000, 4, 19)),
+        )
+
+    @override_settings(CURRENCY_REFRESH_ASYNC=True)
+    def test_file_trusted_after_cache_loss(self):
+        save_snapshot_file()
+        snapshot, index = sync.get_rate_snapshot(), get_history_index()
+        self.reset_process()
+        cache.clear()
+        with (
+            patch("currency.sync.refresh_currencies") as refresh,
+            self.assertNumQueries(0),
+        ):
+            mapped_snapshot = sync.get_rate_snapshot()
+            mapped_index = get_history_index()
+            with sync._refresh_lock:
+                refresh.assert_called_once()
+        self.assertEqual(snapshot.version, mapped_snapshot.version)
+        self.assertEqual(snapshot.version, cache.get("rate_snapshot_version"))
+        self.assertEqual(index.version, mapped_index.version)
+        self.assertIsInstance(mapped_index.dates, memoryview)
+
+    def test_outdated_file_ignored(self):
+        snapfile.write(
+            self.path,
+            RateSnapshot([("USD", Decimal("9"), date(2000, 1, 3))]),
+        )
+        self.reset_process()
+        snapshot = sync.get_rate_snapshot()
+        self.assertEqual(cache.get("rate_snapshot_version"), snapshot.version)
+        self.assertEqual(30, len(snapshot))
+
+    def test_unchanged_file_kept(self):
+        save_snapshot_file()
+        first = snapfile.mapped()
+        save_snapshot_file(only_changed=True)
+        self.assertIs(first, snapfile.mapped())
+
+    def test_atomic_replace(self):
+        save_snapshot_file()
+        first = snapfile.mapped()
+        save_snapshot_file()
+        self.assertIsNot(first, snapfile.mapped())
+        # старое отображение остается читаемым после замены файла
+        self.assertEqual(30, len(first.rate_rows()))
+        self.assertEqual(["rates.snapshot"], os.listdir(os.path.dirname(self.path)))
+
+    def test_invalid_file(self):
+        with open(self.path, "wb") as f:
+            f.write(b"garbage")
+        with self.assertLogs("currency.snapfile", "WARNING"):
+            self.assertIsNone(snapfile.mapped())
+
+
+class StubProvider(providers.Provider):
+    def __init__(self, name, rates, actual_date=date(2025, 4, 4), delay=0, error=None):
+        super().__init__(timeout=5, name=name)
+        self.rates, self.actual_date = rates, actual_date
+        self.delay, self.error = delay, error
+
+    def fetch(self):
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return providers.RateSet(self.name, self.actual_date, dict(self.rates))
+
+
+class ProvidersTestCase(SimpleTestCase):
+    def fetch(self, *stubs, grace=0.05):
+        return providers.fetch_rates(list(stubs), grace=grace)
+
+    def test_priority_merge(self):
+        rate_set = self.fetch(
+            StubProvider("main", {"USD": Decimal("1.1")}),
+            StubProvider("backup", {"USD": Decimal("1.2"), "JPY": Decimal("160")}),
+            StubProvider(
+                "stale", {"GBP": Decimal("0.8")}, actual_date=date(2025, 4, 3)
+            ),
+        )
+        self.assertEqual(date(2025, 4, 4), rate_set.actual_date)
+        self.assertEqual({"USD": Decimal("1.1"), "JPY": Decimal("160")}, rate_set.rates)
+        self.assertEqual("main+backup", rate_set.source)
+
+    def test_newest_date_wins_over_priority(self):
+        rate_set = self.fetch(
+            StubProvider("main", {"USD": Decimal("1.1")}, actual_date=date(2025, 4, 3)),
+            StubProvider("backup", {"USD": Decimal("1.2")}),
+        )
+        self.assertEqual({"USD": Decimal("1.2")}, rate_set.rates)
+
+    def test_latency_bounded_by_fastest_source(self):
+        start = time.monotonic()
+        with self.assertLogs("currency.providers", "WARNING") as logs:
+            rate_set = self.fetch(
+                StubProvider("slow", {"USD": Decimal("1.1")}, delay=2),
+                StubProvider("fast", {"USD": Decimal("1.2")}),
+            )
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual("fast", rate_set.source)
+        self.assertIn("slow", logs.output[0])
+
+    def test_failed_source_skipped(self):
+        rate_set = self.fetch(
+            StubProvider("main", {}, error=requests.ConnectionError("нет сети")),
+            StubProvider("backup", {"USD": Decimal("1.2")}),
+        )
+        self.assertEqual("backup", rate_set.source)
+
+    def test_all_sources_failed(self):
+        with self.assertRaisesMessage(providers.ProviderError, "main: нет сети"):
+            self.fetch(
+                StubProvider("main", {}, error=requests.ConnectionError("нет сети"))
+            )
+
+    def test_hedged_request_to_mirror(self):
+        def slow():
+            time.sleep(2)
+            return "slow"
+
+        def broken():
+            raise requests.ConnectionError
+
+        start = time.monotonic()
+        self.assertEqual("mirror", providers.hedged([slow, lambda: "mirror"], 0.05))
+        # после ошибки зеркало запрашивается сразу, без ожидания hedge_after
+        self.assertEqual("mirror", providers.hedged([broken, lambda: "mirror"], 5))
+        self.assertLess(time.monotonic() - start, 1)
+        with self.assertRaises(requests.ConnectionError):
+            providers.hedged([broken, broken], 0.05)
+
+    def test_file_provider_formats(self):
+        fixture = os.path.join(
+            settings.BASE_DIR, "benchmarks", "fixtures", "eurofxref-daily.xml"
+        )
+        rate_set = providers.FileProvider(fixture).fetch()
+        self.assertEqual(30, len(rate_set.rates))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "rates.json")
+            with open(path, "w") as f:
+                json.dump(
+                    {
+                        "base": "USD",
+                        "date": "2025-04-04",
+                        "rates": {"EUR": 0.8, "JPY": 146.3},
+                    },
+                    f,
+                )
+            rate_set = providers.FileProvider(path).fetch()
+            self.assertEqual(
+                {"JPY": Decimal("182.8750000"), "USD": Decimal("1.2500000")},
+                rate_set.rates,
+            )
+            path = os.path.join(tmp, "eurofxref.csv")
+            with open(path, "w") as f:
+                f.write("Date, USD, JPY, \n04 April 2025, 1.1057, 161.87, \n")
+            rate_set = providers.FileProvider(path).fetch()
+            self.assertEqual(date(2025, 4, 4), rate_set.actual_date)
+            self.assertEqual(Decimal("161.87"), rate_set.rates["JPY"])
+
+    @override_settings(
+        CURRENCY_PROVIDERS=[
+            {
+                "provider": "currency.providers.ECBDailyProvider",
+                "timeout": 3,
+                "mirrors": ["http://127.0.0.1:1/eurofxref-daily.xml"],
+                "hedge_after": 0.2,
+            },
+            {"provider": "currency.providers.FileProvider", "path": "/nonexistent"},
+        ]
+    )
+    def test_configured(self):
+        ecb, file = providers.configured()
+        self.assertEqual(
+            [utils.ECB_URL, "http://127.0.0.1:1/eurofxref-daily.xml"], ecb.urls
+        )
+        self.assertEqual(3.2, ecb.deadline)
+        self.assertEqual("/nonexistent", file.path)
+
+    def test_conditional_request(self):
+        cache.clear()
+        with open(
+            os.path.join(
+                settings.BASE_DIR, "benchmarks", "fixtures", "eurofxref-daily.xml"
+            ),
+            "rb",
+        ) as f:
+            body = f.read()
+
+        def respond(url, headers, timeout):
+            response = requests.Response()
+            if headers.get("If-None-Match") == '"v1"':
+                response.status_code = 304
+            else:
+                response.status_code, response._content = 200, body
+            response.headers["ETag"] = '"v1"'
+            return response
+
+        provider = providers.ECBDailyProvider("http://ecb.test/daily.xml")
+        with (
+            patch("currency.providers.session") as session,
+            patch(
+                "currency.providers.parse_ecb_daily", wraps=providers.parse_ecb_daily
+            ) as parse,
+        ):
+            session.return_value.get.side_effect = respond
+            first = provider.fetch()
+            # ETag запоминается только после записи курсов
+            self.assertFalse(provider.fetch().not_modified)
+            providers.save_validators(first)
+            second = provider.fetch()
+            rate_set = providers.fetch_rates([provider])
+        self.assertFalse(first.not_modified)
+        self.assertTrue(second.not_modified)
+        self.assertTrue(rate_set.not_modified)
+        # на 304 лента не разбирается, курсы - из кеша
+        self.assertEqual(2, parse.call_count)
+        self.assertEqual(first.rates, second.rates)
+        self.assertEqual(first.actual_date, rate_set.actual_date)
+        headers = session.return_value.get.call_args.kwargs["headers"]
+        self.assertEqual({"If-None-Match": '"v1"'}, headers)
+        self.assertFalse(
+            providers.merge(
+                [second, providers.RateSet("other", first.actual_date, {})]
+            ).not_modified
+        )
+
+    def test_session_is_shared(self):
+        self.assertIs(providers.session(), providers.session())
+
+
+class PairQuotesSyncTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.addCleanup(setattr, sync, "_rate_snapshot", None)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        quotes = os.path.join(tmp.name, "usd.json")
+        with open(quotes, "w") as f:
+            json.dump(
+                {"base": "USD", "date": "2025-04-04", "rates": {"XAU": 0.0004}}, f
+            )
+        fixture = os.path.join(
+            settings.BASE_DIR, "benchmarks", "fixtures", "eurofxref-daily.xml"
+        )
+        settings_override = override_settings(
+            CURRENCY_PROVIDERS=[
+                {"provider": "currency.providers.FileProvider", "path": fixture},
+                {"provider": "currency.providers.FileProvider", "path": quotes},
+            ]
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_rate_routes_through_stored_quotes(self):
+        sync.refresh_currencies()
+        self.assertFalse(Currency.objects.filter(currency_name="XAU").exists())
+        self.assertEqual(
+            [("USD", "XAU", Decimal("0.0004000"))],
+            list(CurrencyQuote.objects.values_list("base", "currency_name", "rate")),
+        )
+        response = APIClient().get(
+            reverse(
+                "currency-rate", kwargs={"from_currency": "XAU", "to_currency": "USD"}
+            )
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        # 1 XAU = 2500 USD точно, без промежуточного курса XAU к EUR
+        self.assertEqual(["XAU", "USD"], response.data["path"])
+        self.assertEqual("2500.0000000000", response.data["rate"])
+        response = APIClient().get(
+            reverse(
+                "currency-rate", kwargs={"from_currency": "JPY", "to_currency": "XAU"}
+            )
+        )
+        self.assertEqual(["JPY", "EUR", "USD", "XAU"], response.data["path"])
+        # снимок из файла строится с теми же котировками
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "rates.snapshot")
+            snapfile.write(path, sync.get_rate_snapshot())
+            mapped = snapfile.MappedSnapshot(path)
+            self.assertEqual(
+                sync.get_rate_snapshot().version,
+                RateSnapshot(mapped.rate_rows(), mapped.quotes()).version,
+            )
+            mapped._buffer.close()
+
+
+class RateGraphTestCase(SimpleTestCase):
+    def setUp(self):
+        self.day = date(2025, 4, 4)
+        self.snapshot = RateSnapshot(
+            [
+                ("USD", Decimal("1.1057"), self.day),
+                ("JPY", Decimal("161.87"), self.day),
+                ("GBP", Decimal("0.85"), date(2025, 4, 1)),
+            ],
+            quotes=[
+                # золото котируется только к USD и GBP
+                Quote("USD", "XAU", fixedpoint.to_units("0.0004"), date(2025, 4, 3)),
+                Quote("GBP", "XAU", fixedpoint.to_units("0.0005"), self.day),
+                Quote("USD", "BTC", fixedpoint.to_units("0.00001"), self.day),
+                Quote("XAG", "XPT", fixedpoint.to_units("0.03"), self.day),
+            ],
+        )
+
+    def test_routes_via_eur_match_exact_cross_rate(self):
+        route = self.snapshot.route("USD", "JPY")
+        self.assertEqual(("USD", "EUR", "JPY"), route.path)
+        self.assertEqual(
+            fixedpoint.cross_rate(
+                fixedpoint.to_units("1.1057"), fixedpoint.to_units("161.87")
+            ),
+            self.snapshot.cross_rate("USD", "JPY"),
+        )
+        self.assertEqual(
+            fixedpoint.convert(
+                fixedpoint.split(Decimal("100")),
+                fixedpoint.to_units("1.1057"),
+                fixedpoint.to_units("161.87"),
+            ),
+            self.snapshot.convert("USD", "JPY", Decimal("100")),
+        )
+
+    def test_zero_rate_skipped(self):
+        snapshot = RateSnapshot(
+            [
+                ("USD", Decimal("0"), self.day),
+                ("JPY", Decimal("161.87"), self.day),
+            ],
+            quotes=[Quote("USD", "XAU", 0, self.day)],
+        )
+        # валюта без курса недостижима, остальные пары считаются
+        self.assertFalse(
+            snapshot.connected(snapshot.position("USD"), snapshot.position("JPY"))
+        )
+        self.assertIsNone(snapshot.route("XAU", "USD"))
+        self.assertEqual(
+            fixedpoint.convert(
+                fixedpoint.split(Decimal("100")),
+                fixedpoint.RATE_SCALE,
+                fixedpoint.to_units("161.87"),
+            ),
+            snapshot.convert("EUR", "JPY", Decimal("100")),
+        )
+
+    def test_fewest_hops_then_freshest(self):
+        # JPY -> EUR -> USD -> XAU и JPY -> EUR -> GBP -> XAU одной длины,
+        # на первом самая старая котировка от 03.04, на втором - от 01.04
+        route = self.snapshot.route("JPY", "XAU")
+        self.assertEqual(("JPY", "EUR", "USD", "XAU"), route.path)
+        self.assertEqual(date(2025, 4, 3), route.actual_date)
+        self.assertEqual(
+            [self.day, self.day, date(2025, 4, 3)],
+            [hop.actual_date for hop in route.hops],
+        )
+        self.assertEqual(("BTC", "USD"), self.snapshot.route("BTC", "USD").path)
+
+    def test_convert_through_pair_quotes(self):
+        # 2 XAU = 5000 USD = 5000 / 1.1057 EUR, округление одно
+        self.assertEqual(
+            fixedpoint.convert(
+                fixedpoint.split(Decimal("5000")),
+                fixedpoint.to_units("1.1057"),
+                fixedpoint.RATE_SCALE,
+            ),
+            self.snapshot.convert("XAU", "EUR", Decimal("2")),
+        )
+        self.assertEqual(
+            self.snapshot.convert("BTC", "XAU", Decimal("1")),
+            self.snapshot.convert_many(
+                [self.snapshot.position("BTC")],
+                [self.snapshot.position("XAU")],
+                [Decimal("1")],
+            )[0],
+        )
+
+    def test_disconnected_currencies(self):
+        self.assertIsNone(self.snapshot.route("USD", "XPT"))
+        self.assertNotIn("XPT", self.snapshot.fan_out("USD", Decimal("1")))
+        self.assertNotIn("XPT", self.snapshot.matrix_row("USD"))
+        serializer = CurrencyConvertSerializer(
+            data={"from_currency": "USD", "to_currency": "XPT", "amount": 1},
+            context={"snapshot": self.snapshot},
+        )
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(
+            {"response": [ErrorDetail("Нет маршрута конвертации", code="invalid")]},
+            serializer.errors,
+        )
+
+    def test_quote_only_currency_in_batch_fan_out(self):
+        serializer = CurrencyBatchConvertSerializer(
+            data={"from_currency": "XAU", "amount": 1},
+            context={"snapshot": self.snapshot},
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertIn("XAU", self.snapshot)
+        self.assertIn("EUR", self.snapshot)
+        self.assertNotIn("BTC2", self.snapshot)
+
+    def test_calc_script_leaves_other_routes_to_server(self):
+        snapshot = RateSnapshot(
+            [
+                ("USD", Decimal("1.1057"), self.day),
+                ("JPY", Decimal("161.87"), self.day),
+                ("GBP", Decimal("0.85"), self.day),
+            ],
+            quotes=[
+                Quote("USD", "JPY", fixedpoint.to_units("146.5"), self.day),
+                Quote("USD", "XAU", fixedpoint.to_units("0.0004"), self.day),
+            ],
+        )
+        script = calc_rates_script(snapshot)
+        data = json.loads(re.search(r">(.*)<", script).group(1))
+        # XAU - только котировка к USD, USD/JPY - прямая котировка
+        self.assertEqual(["USD", "JPY", "GBP", "EUR"], list(data["rates"]))
+        self.assertEqual(["USD/JPY", "JPY/USD"], data["server_pairs"])
+
+    def test_providers_merge_pair_quotes(self):
+        rate_set = providers.merge(
+            [
+                providers.RateSet("ecb", self.day, {"USD": Decimal("1.25")}),
+                providers.RateSet(
+                    "usd", self.day, {"XAU": Decimal("0.0004")}, base="USD"
+                ),
+                providers.RateSet(
+                    "old", date(2025, 4, 3), {"XAG": Decimal("0.03")}, base="USD"
+                ),
+            ]
+        )
+        # котировки к USD не пересчитываются в курсы к EUR
+        self.assertEqual({"USD": Decimal("1.25")}, rate_set.rates)
+        self.assertEqual(["usd"], [quotes.source for quotes in rate_set.quotes])
+        self.assertEqual("ecb+usd", rate_set.source)
+        self.assertEqual(
+            {
+                "base": "USD",
+                "currency_name": "XAU",
+                "rate": Decimal("0.0004"),
+                "actual_date": "2025-04-04",
+            },
+            rate_set.for_db()[-1],
+        )
+        with self.assertRaises(providers.ProviderError):
+            providers.merge([providers.RateSet("usd", self.day, {}, base="USD")])
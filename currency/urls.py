@@ -1,11 +1,32 @@
 from django.urls import re_path, path
 from django.urls.conf import include
 from rest_framework.routers import DefaultRouter
-from currency.views import CurrencyViewSet, CalcCurrencies
+from currency import async_views
+from currency.views import CurrencyViewSet, CalcCurrencies, metrics_view
 
 router = DefaultRouter()
 router.register("currencies", CurrencyViewSet, basename="currency")
+# чтение и конвертация - async-представления, запись и браузерный API
+# на тех же URL обслуживают представления DRF
+api_urls = async_views.with_async_views(
+    router.urls,
+    {
+        "currency-list": async_views.currency_list,
+        "currency-detail": async_views.currency_detail,
+        "currency-convert": async_views.currency_convert,
+    },
+)
 urlpatterns = [
-    path("api/", include(router.urls)),
-    re_path("calc/$", CalcCurrencies.as_view(), name="currency-calc"),
+    path("api/", include(api_urls)),
+    re_path(
+        "calc/$",
+        async_views.dispatch(async_views.calc, CalcCurrencies.as_view()),
+        name="currency-calc",
+    ),
+    re_path(
+        r"^api/export/(?P<table>current|history)\.(?P<fmt>ndjson|csv)$",
+        async_views.export_rates,
+        name="currency-export",
+    ),
+    path("metrics", metrics_view, name="metrics"),
 ]
@@ -1,53 +1,133 @@
+import csv
+import io
+import os
+import tempfile
 import xml.etree.ElementTree as ET
+import zipfile
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
 import requests
 
-ECB_URL = "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-daily.xml"
+# переопределяется через окружение, например для заглушки ЕЦБ в бенчмарках
+ECB_URL = os.environ.get(
+    "ECB_URL", "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-daily.xml"
+)
+ECB_HIST_URL = "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist.xml"
+# ЕЦБ публикует курсы около 16:00 CET по рабочим дням TARGET
+ECB_TIMEZONE = ZoneInfo("Europe/Berlin")
+ECB_PUBLICATION_TIME = time(16, 0)
 
 
-def fetch_exchange_rates():
-    response = requests.get(ECB_URL, timeout=10)
-    response.raise_for_status()
-    root = ET.fromstring(response.content)
-    namespaces = {
-        "gesmes": "http://www.gesmes.org/xml/2002-08-01",
-        "eurofxref": "http://www.ecb.int/vocabulary/2002-08-01/eurofxref",
-    }
+def iter_history_rates(source=ECB_HIST_URL, timeout=10):
+    """
+    Потоково читает историю курсов ЕЦБ (eurofxref-hist.xml или zip с CSV)
+    из файла или по URL. Отдает кортежи (дата, валюта, курс) строками,
+    не загружая документ целиком в память.
+    """
+    if source.startswith(("http://", "https://")):
+        with requests.get(source, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            if source.endswith(".zip"):
+                # zip читается с конца, поэтому сначала скачивается во временный файл
+                with tempfile.TemporaryFile() as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+                    f.seek(0)
+                    yield from _iter_history_zip(f)
+            else:
+                response.raw.decode_content = True
+                yield from _iter_history_xml(response.raw)
+        return
+    if source.endswith(".zip"):
+        with open(source, "rb") as f:
+            yield from _iter_history_zip(f)
+    elif source.endswith(".csv"):
+        with open(source, newline="") as f:
+            yield from iter_history_csv(f)
+    else:
+        with open(source, "rb") as f:
+            yield from _iter_history_xml(f)
 
-    actual_date = root.find(".//eurofxref:Cube[@time]", namespaces).attrib["time"]
-    return root, namespaces, actual_date
 
+def _iter_history_xml(stream):
+    actual_date = None
+    container = None
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        if not elem.tag.endswith("}Cube"):
+            continue
+        if event == "start":
+            if "time" in elem.attrib:
+                actual_date = elem.attrib["time"]
+            elif "currency" in elem.attrib:
+                yield actual_date, elem.attrib["currency"], elem.attrib["rate"]
+            elif container is None:
+                container = elem
+        elif "time" in elem.attrib and container is not None:
+            # разобранные дни сразу освобождаются
+            container.clear()
 
-def fetch_exchange_rates_cmd():
-    root, namespaces, actual_date = fetch_exchange_rates()
 
-    rates = []
-    for cube in root.findall(".//eurofxref:Cube[@currency]", namespaces):
-        currency = cube.attrib["currency"]
-        rate = cube.attrib["rate"]
-        rates.append({currency: rate})
+def _iter_history_zip(f):
+    with zipfile.ZipFile(f) as archive:
+        name = next(n for n in archive.namelist() if n.endswith(".csv"))
+        with archive.open(name) as member:
+            yield from iter_history_csv(io.TextIOWrapper(member, newline=""))
 
-    rates.append(actual_date)
 
-    return rates
+def iter_history_csv(f):
+    """Строки CSV в формате ЕЦБ (Date, USD, JPY, ...) в кортежи (дата, валюта, курс)."""
+    reader = csv.reader(f)
+    header = [column.strip() for column in next(reader)]
+    for row in reader:
+        actual_date = row[0].strip()
+        for currency, rate in zip(header[1:], row[1:]):
+            rate = rate.strip()
+            if currency and rate and rate != "N/A":
+                yield actual_date, currency, rate
 
 
-def fetch_exchange_rates_for_db():
-    root, namespaces, actual_date = fetch_exchange_rates()
+def _easter(year):
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
 
-    rates = []
-    for cube in enumerate(
-        root.findall(".//eurofxref:Cube[@currency]", namespaces), start=1
-    ):
-        id = cube[0]
-        currency = cube[1].attrib["currency"]
-        rate = float(cube[1].attrib["rate"])
-        rates.append(
-            {
-                "currency_name": currency,
-                "rate": rate,
-                "actual_date": actual_date,
-                "is_modified": False,
-            }
-        )
 
-    return rates
+def is_target_holiday(day):
+    if (day.month, day.day) in ((1, 1), (5, 1), (12, 25), (12, 26)):
+        return True
+    easter = _easter(day.year)
+    return day in (easter - timedelta(days=2), easter + timedelta(days=1))
+
+
+def is_ecb_business_day(day):
+    return day.weekday() < 5 and not is_target_holiday(day)
+
+
+def last_ecb_publication(now=None):
+    """Момент последней публикации курсов ЕЦБ не позже now."""
+    now = (now or datetime.now(timezone.utc)).astimezone(ECB_TIMEZONE)
+    day = now.date()
+    if now.time() < ECB_PUBLICATION_TIME:
+        day -= timedelta(days=1)
+    while not is_ecb_business_day(day):
+        day -= timedelta(days=1)
+    return datetime.combine(day, ECB_PUBLICATION_TIME, tzinfo=ECB_TIMEZONE)
+
+
+def next_ecb_publication(now=None):
+    """Момент ближайшей публикации курсов ЕЦБ после now."""
+    now = (now or datetime.now(timezone.utc)).astimezone(ECB_TIMEZONE)
+    day = now.date()
+    if now.time() >= ECB_PUBLICATION_TIME:
+        day += timedelta(days=1)
+    while not is_ecb_business_day(day):
+        day += timedelta(days=1)
+    return datetime.combine(day, ECB_PUBLICATION_TIME, tzinfo=ECB_TIMEZONE)
@@ -1,15 +1,28 @@
 from decimal import Decimal
-from django.utils import timezone
 from rest_framework import mixins, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.viewsets import GenericViewSet
 from rest_framework.decorators import action
-from rest_framework.renderers import TemplateHTMLRenderer
-from django.core.cache import cache
-from currency import utils
-from currency.serializers import CurrencySerializer, CurrencyConvertSerializer
+from rest_framework.renderers import JSONRenderer, TemplateHTMLRenderer
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils.html import json_script
+from urllib.parse import urlencode
+from currency import caching, fixedpoint, metrics, sync
+from currency.responses import PrerenderedResponse, cache_control, render_entry
+from currency.serializers import (
+    AMOUNT_MAX_DIGITS,
+    AMOUNT_PLACES,
+    CurrencySerializer,
+    CurrencyConvertSerializer,
+    CurrencyBatchConvertSerializer,
+    CurrencyHistorySerializer,
+    CurrencyMatrixSerializer,
+    CurrencyRateSerializer,
+)
 from currency.models import Currency
 from drf_spectacular.utils import (
     OpenApiExample,
@@ -18,14 +31,9 @@ from drf_spectacular.utils import (
     OpenApiResponse,
     extend_schema_view,
 )
-from datetime import date, timedelta
+from datetime import date
 import logging
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="[%(asctime)s] [%(name)s] [%(levelname)s] > %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
 logger = logging.getLogger(__name__)
 
 
@@ -92,36 +100,83 @@ class CurrencyViewSet(
     lookup_url_kwarg = "currency"
 
     def get_queryset(self):
-        queryset = _check_cached_currencies()
+        queryset = sync.check_cached_currencies()
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        if not isinstance(request.accepted_renderer, JSONRenderer):
+            return super().list(request, *args, **kwargs)
+        return PrerenderedResponse(request, _rendered_currencies())
+
+    def retrieve(self, request, *args, **kwargs):
+        if not isinstance(request.accepted_renderer, JSONRenderer):
+            return super().retrieve(request, *args, **kwargs)
+        currency_name = self._get_currency_name()
+        entry = _rendered_currency(currency_name)
+        if entry is None:
+            raise NotFound(f"Валюта {currency_name} не найдена")
+        return PrerenderedResponse(request, entry)
+
     def get_object(self):
         currency_name = self._get_currency_name()
+        if self.action == "retrieve":
+            obj = sync.get_cached_currency(currency_name)
+            if obj is None:
+                raise NotFound(f"Валюта {currency_name} не найдена")
+            return obj
         try:
             obj = self.get_queryset().get(currency_name=currency_name)
             return obj
         except Currency.DoesNotExist:
             raise NotFound(f"Валюта {currency_name} не найдена")
 
-    # when updating => restart cache
+    # when updating => invalidate only this currency and the whole-set entries
     def perform_update(self, serializer):
-        cache.clear()
         serializer.save()
+        sync.invalidate_currencies([serializer.instance.currency_name])
 
     def destroy(self, request, *args, **kwargs):
         currency_name = self._get_currency_name()
-        obj = self.get_queryset().get(currency_name=currency_name)
+        obj = self.get_object()
         obj.deleted_date, obj.is_modified = date.today(), True
         obj.save()
-        cache.clear()
+        sync.invalidate_currencies([currency_name])
         return Response(
             {"response": f"Currency {currency_name} successful deleted."},
             status=status.HTTP_204_NO_CONTENT,
         )
 
     @extend_schema(
+        methods=["GET"],
+        summary="Конвертация валют (кешируемый GET)",
+        description=(
+            "То же, что POST, но через параметры запроса. Неканонический URL "
+            "перенаправляется (301) на канонический, Cache-Control действует "
+            "до следующей публикации курсов ЕЦБ."
+        ),
+        tags=["Валюты"],
+        parameters=[
+            OpenApiParameter(name="from", required=True, type=str),
+            OpenApiParameter(name="to", required=True, type=str),
+            OpenApiParameter(name="amount", required=True, type=str),
+            OpenApiParameter(name="date", required=False, type=str),
+            OpenApiParameter(
+                name="rounding",
+                required=False,
+                type=str,
+                enum=fixedpoint.ROUNDING_MODES,
+            ),
+            OpenApiParameter(name="minor_units", required=False, type=bool),
+        ],
+    )
+    @extend_schema(
+        methods=["POST"],
         summary="Конвертация валют",
-        description="Конвертирует одну валюту в другую по последнему курсу.",
+        description=(
+            "Конвертирует одну валюту в другую по последнему курсу. "
+            "С необязательным date - по последнему фиксингу ЕЦБ не позже этой даты "
+            "(выходные и праздники TARGET)."
+        ),
         tags=["Валюты"],
         request=CurrencyConvertSerializer,
         examples=[
@@ -129,6 +184,15 @@ class CurrencyViewSet(
                 name="Пример конвертации",
                 value={"from_currency": "USD", "to_currency": "TRY", "amount": 20},
             ),
+            OpenApiExample(
+                name="Пример конвертации на дату",
+                value={
+                    "from_currency": "USD",
+                    "to_currency": "TRY",
+                    "amount": 20,
+                    "date": "2025-04-05",
+                },
+            ),
             OpenApiExample(
                 name="Пример ответа",
                 value={"result": 666.7777777},
@@ -136,18 +200,289 @@ class CurrencyViewSet(
             ),
         ],
     )
-    @action(("POST",), detail=False)
+    @action(("GET", "POST"), detail=False)
     def convert(self, request, *args, **kwargs):
-        self.get_queryset()
-        data = CurrencyConvertSerializer(data=request.data)
+        if request.method == "GET":
+            return self._cacheable_get(
+                request, CurrencyConvertSerializer, request.query_params
+            )
+        data = CurrencyConvertSerializer(
+            data=request.data, context={"snapshot": sync.get_rate_snapshot()}
+        )
         data.is_valid(raise_exception=True)
         return Response(data.data, status=status.HTTP_200_OK)
 
+    @extend_schema(
+        summary="Курс пары валют",
+        description=(
+            "Кросс-курс пары валют. Неканонический URL перенаправляется (301) "
+            "на канонический, Cache-Control действует до следующей публикации ЕЦБ."
+        ),
+        tags=["Валюты"],
+        parameters=[OpenApiParameter(name="date", required=False, type=str)],
+        examples=[
+            OpenApiExample(
+                name="Пример ответа",
+                value={
+                    "from_currency": "USD",
+                    "to_currency": "JPY",
+                    "rate": "146.3959483585",
+                },
+                response_only=True,
+            ),
+        ],
+    )
+    @action(
+        ("GET",),
+        detail=False,
+        url_path=r"rate/(?P<from_currency>[A-Za-z]{3})/(?P<to_currency>[A-Za-z]{3})",
+    )
+    def rate(self, request, from_currency, to_currency, *args, **kwargs):
+        params = {"from": from_currency, "to": to_currency}
+        if "date" in request.query_params:
+            params["date"] = request.query_params["date"]
+        return self._cacheable_get(
+            request, CurrencyRateSerializer, params, path="currency-rate"
+        )
+
+    @extend_schema(
+        summary="Пакетная конвертация валют",
+        description=(
+            "Конвертирует список пар валют за один проход по таблице курсов "
+            "либо одну сумму во все валюты. Ошибки возвращаются по каждому "
+            "элементу, не прерывая обработку пакета."
+        ),
+        tags=["Валюты"],
+        request=CurrencyBatchConvertSerializer,
+        examples=[
+            OpenApiExample(
+                name="Пример пакетной конвертации",
+                value={
+                    "items": [
+                        {"from_currency": "USD", "to_currency": "TRY", "amount": 20},
+                        {"from_currency": "BTC", "to_currency": "EUR", "amount": 1},
+                    ]
+                },
+            ),
+            OpenApiExample(
+                name="Пример конвертации во все валюты",
+                value={"from_currency": "USD", "amount": 100},
+            ),
+            OpenApiExample(
+                name="Пример ответа",
+                value={
+                    "results": [
+                        {"result": "666.7777777"},
+                        {"errors": {"from_currency": ['"BTC" is not a valid choice.']}},
+                    ]
+                },
+                response_only=True,
+            ),
+        ],
+    )
+    @action(("POST",), detail=False, url_path="convert/batch")
+    def convert_batch(self, request, *args, **kwargs):
+        data = CurrencyBatchConvertSerializer(
+            data=request.data, context={"snapshot": sync.get_rate_snapshot()}
+        )
+        data.is_valid(raise_exception=True)
+        return Response(data.data, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        summary="Матрица кросс-курсов",
+        description=(
+            "Кросс-курсы, рассчитанные один раз при изменении курсов. "
+            "С параметром base возвращает курсы всех валют относительно base, "
+            "без него - полную матрицу."
+        ),
+        tags=["Валюты"],
+        parameters=[
+            OpenApiParameter(
+                name="base", description="Базовая валюта", required=False, type=str
+            )
+        ],
+        examples=[
+            OpenApiExample(
+                name="Пример ответа",
+                value={
+                    "base": "USD",
+                    "version": "6f1ed002ab5595859014ebf0951522d9",
+                    "rates": {"JPY": "146.3959483585", "EUR": "0.9044044497"},
+                },
+                response_only=True,
+            ),
+        ],
+    )
+    @action(("GET",), detail=False)
+    def matrix(self, request, *args, **kwargs):
+        base = request.query_params.get("base")
+        data = CurrencyMatrixSerializer(
+            data={"base": base.upper()} if base else {},
+            context={"snapshot": sync.get_rate_snapshot()},
+        )
+        data.is_valid(raise_exception=True)
+        return Response(data.data, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        summary="История курса валюты",
+        description=(
+            "Курсы валюты к base (по умолчанию EUR) по фиксингам ЕЦБ за период "
+            "from..to по возрастанию даты. Страницы по limit курсов: next - "
+            "ссылка на следующую страницу (курсор after по дате, без смещений). "
+            "shape=columns возвращает даты и курсы двумя массивами."
+        ),
+        tags=["Валюты"],
+        parameters=[
+            OpenApiParameter(name="from", required=False, type=str),
+            OpenApiParameter(name="to", required=False, type=str),
+            OpenApiParameter(name="base", required=False, type=str),
+            OpenApiParameter(name="after", required=False, type=str),
+            OpenApiParameter(name="limit", required=False, type=int),
+            OpenApiParameter(
+                name="shape", required=False, type=str, enum=("rows", "columns")
+            ),
+        ],
+        examples=[
+            OpenApiExample(
+                name="Пример ответа (shape=columns)",
+                value={
+                    "currency": "USD",
+                    "base": "EUR",
+                    "dates": ["2025-04-03", "2025-04-04"],
+                    "rates": ["1.1097000", "1.1057000"],
+                    "next": "/api/currencies/USD/history/?shape=columns"
+                    "&limit=2&after=2025-04-04",
+                },
+                response_only=True,
+            ),
+        ],
+    )
+    @action(("GET",), detail=True)
+    def history(self, request, *args, **kwargs):
+        currency_name = self._get_currency_name()
+        params = request.query_params
+        data = {
+            field: params[param].upper() if param == "base" else params[param]
+            for param, field in HISTORY_PARAMS.items()
+            if param in params
+        }
+        serializer = CurrencyHistorySerializer(
+            data=data, context={"currency": currency_name}
+        )
+        if currency_name != "EUR" and currency_name not in serializer.index.columns:
+            raise NotFound(f"Валюта {currency_name} не найдена")
+        if not serializer.is_valid():
+            params_by_field = {field: param for param, field in HISTORY_PARAMS.items()}
+            raise ValidationError(
+                {params_by_field.get(k, k): v for k, v in serializer.errors.items()}
+            )
+        page = serializer.data
+        if page["next"]:
+            # курсор - дата последнего курса страницы, остальные параметры те же
+            query = {**params.dict(), "after": page["next"]}
+            page["next"] = f"{request.path}?{urlencode(query)}"
+        return Response(
+            page, status=status.HTTP_200_OK, headers={"Cache-Control": cache_control()}
+        )
+
+    def _cacheable_get(self, request, serializer_class, params, path=None):
+        serializer = cacheable_get_serializer(
+            serializer_class, params, sync.get_rate_snapshot()
+        )
+        serializer.is_valid()
+        return cacheable_get_response(request, serializer, path)
+
     def _get_currency_name(self):
         currency_name = self.kwargs.get(self.lookup_url_kwarg).upper()
         return currency_name
 
 
+# параметры GET-конвертации и соответствующие поля сериализатора
+GET_PARAMS = {
+    "from": "from_currency",
+    "to": "to_currency",
+    "amount": "amount",
+    "date": "date",
+    "rounding": "rounding",
+    "minor_units": "minor_units",
+}
+
+
+# параметры истории курса и соответствующие поля сериализатора
+HISTORY_PARAMS = {
+    "from": "from_date",
+    "to": "to_date",
+    "base": "base",
+    "after": "after",
+    "limit": "limit",
+    "shape": "shape",
+}
+
+
+def cacheable_get_serializer(serializer_class, params, snapshot):
+    """Сериализатор GET-конвертации по параметрам запроса (GET_PARAMS)."""
+    data = {
+        field: params[param].upper() if param in ("from", "to") else params[param]
+        for param, field in GET_PARAMS.items()
+        if param in params
+    }
+    return serializer_class(data=data, context={"snapshot": snapshot})
+
+
+def cacheable_get_response(request, serializer, path=None):
+    """
+    GET-конвертация для HTTP-кешей по проверенному сериализатору: параметры
+    приводятся к каноническому виду, неканонический URL перенаправляется
+    на канонический.
+    """
+    if serializer.errors:
+        params_by_field = {field: param for param, field in GET_PARAMS.items()}
+        raise ValidationError(
+            {params_by_field.get(k, k): v for k, v in serializer.errors.items()}
+        )
+    snapshot = serializer.context["snapshot"]
+    canonical = _canonical_url(serializer.validated_data, path)
+    if canonical != request.get_full_path():
+        return Response(
+            status=status.HTTP_301_MOVED_PERMANENTLY,
+            headers={
+                "Location": canonical,
+                "Cache-Control": cache_control(snapshot=snapshot),
+            },
+        )
+    return Response(
+        serializer.data,
+        status=status.HTTP_200_OK,
+        headers={"Cache-Control": cache_control(snapshot=snapshot)},
+    )
+
+
+def _canonical_url(validated, path=None):
+    if path:
+        url = reverse(
+            path,
+            kwargs={
+                "from_currency": validated["from_currency"],
+                "to_currency": validated["to_currency"],
+            },
+        )
+        query = {}
+    else:
+        url = reverse("currency-convert")
+        query = {
+            "from": validated["from_currency"],
+            "to": validated["to_currency"],
+            "amount": fixedpoint.plain(validated["amount"]),
+        }
+    if validated.get("date"):
+        query["date"] = validated["date"].isoformat()
+    if validated.get("rounding"):
+        query["rounding"] = validated["rounding"]
+    if validated.get("minor_units"):
+        query["minor_units"] = "true"
+    return f"{url}?{urlencode(query)}" if query else url
+
+
 @extend_schema(
     summary="HTML-калькулятор валют",
     tags=["Калькулятор"],
@@ -157,105 +492,131 @@ class CalcCurrencies(APIView):
     template_name = "calc.html"
 
     def get(self, request):
-        _check_cached_currencies()
-        serializer = CurrencyConvertSerializer()
-        return Response({"serializer": serializer})
+        snapshot = sync.get_rate_snapshot()
+        serializer = CurrencyConvertSerializer(context={"snapshot": snapshot})
+        return Response(
+            {"serializer": serializer, "rates_script": calc_rates_script(snapshot)}
+        )
 
     def post(self, request):
-        serializer = CurrencyConvertSerializer(data=request.data)
+        # расчет без JS; с JS браузер считает сам по курсам со страницы
+        snapshot = sync.get_rate_snapshot()
+        serializer = CurrencyConvertSerializer(
+            data=request.data, context={"snapshot": snapshot}
+        )
         if serializer.is_valid():
             result = serializer.data.get("result")
-            return Response({"serializer": serializer, "result": result})
+        else:
+            result = "Нельзя указывать одинаковые валюты"
         return Response(
-            {"serializer": serializer, "result": "Нельзя указывать одинаковые валюты"}
+            {
+                "serializer": serializer,
+                "result": result,
+                "rates_script": calc_rates_script(snapshot),
+            }
         )
 
 
-def _check_cached_currencies():
-    cache_data = cache.get("currencies")
-    if not cache_data:
-        logging.debug("Кэш пуст")
-        objects = _sync_currencies_with_api_ecb()
-        return _set_cache(objects)
-    logging.debug("Данные получены из кеша")
-    return cache_data
+_calc_rates = (None, None)
 
 
-def _sync_currencies_with_api_ecb():
-    Currency.objects.filter(
-        deleted_date__lte=timezone.now() - timedelta(days=30)
-    ).delete()
-    queryset = Currency.objects.filter(deleted_date=None)
-    db_actual_date = _db_actual_date(queryset)
-    ecb_data = utils.fetch_exchange_rates_for_db()
-    ecb_actual_date = ecb_data[0]["actual_date"]
+def calc_rates_script(snapshot):
+    """
+    Курсы снимка для расчета в калькуляторе на стороне браузера:
+    <script type="application/json" id="calc-rates">. Собирается один раз
+    на версию снимка, курсы - целые с масштабом 10**RATE_PLACES строками.
+    """
+    global _calc_rates
+    key = (snapshot.version, settings.CURRENCY_ROUNDING)
+    cached_key, script = _calc_rates
+    if cached_key == key:
+        return script
+    units = dict(zip(snapshot.codes, snapshot.units))
+    units["EUR"] = fixedpoint.RATE_SCALE
+    # браузер считает пару как units[to] / units[from], то есть через EUR;
+    # пары, лучший маршрут которых идет по котировкам к другим базам,
+    # и валюты без курса к EUR считает сервер
+    server_pairs = [
+        f"{from_code}/{to_code}"
+        for from_code, from_units in units.items()
+        for to_code, to_units in units.items()
+        if from_code != to_code
+        and not _routed_via_eur(snapshot, from_code, to_code, from_units, to_units)
+    ]
+    rates = {code: str(value) for code, value in units.items()}
+    script = json_script(
+        {
+            "version": snapshot.version,
+            "actual_date": (
+                snapshot.actual_date.isoformat() if snapshot.actual_date else None
+            ),
+            "rounding": settings.CURRENCY_ROUNDING,
+            "places": fixedpoint.RESULT_PLACES,
+            "minor_units": fixedpoint.MINOR_UNITS,
+            "default_minor_units": fixedpoint.DEFAULT_MINOR_UNITS,
+            "amount_places": AMOUNT_PLACES,
+            "amount_max_digits": AMOUNT_MAX_DIGITS,
+            "rates": rates,
+            "server_pairs": server_pairs,
+        },
+        "calc-rates",
+    )
+    _calc_rates = (key, script)
+    return script
 
-    if db_actual_date and (ecb_actual_date == str(db_actual_date)):
-        logging.debug("Данные актуальны")
-        return queryset
 
-    elif db_actual_date and (ecb_actual_date != str(db_actual_date)):
-        logging.debug("Не совпадают даты актуальности данных")
-        return _update_currencies(queryset, ecb_data)
+def _routed_via_eur(snapshot, from_code, to_code, from_units, to_units):
+    ratio = snapshot.ratio(snapshot.position(from_code), snapshot.position(to_code))
+    return ratio is not None and ratio[0] * from_units == ratio[1] * to_units
 
-    logging.debug("БД пуста, создание объектов на основе API ECB...")
-    return _create(ecb_data)
 
+def metrics_view(request):
+    """Метрики в формате Prometheus."""
+    body = metrics.render(sync.get_rate_snapshot().actual_date)
+    return HttpResponse(body, content_type=metrics.CONTENT_TYPE_LATEST)
 
-def _set_cache(objects):
-    logging.debug("Установка кеша продолжительностью 1 день")
-    cache.set("currencies", objects, timeout=86400)
-    return objects
 
+def _rendered_currencies():
+    """Готовое JSON-тело списка валют для текущего поколения данных."""
+    return _get_rendered(
+        lambda: f"{caching.currencies_key()}:rendered", build_currencies_entry
+    )
 
-def _create(ecb_data):
-    objects_to_create = [Currency(**i) for i in ecb_data]
-    created_objects = Currency.objects.bulk_create(objects_to_create)
-    logging.debug("Объекты успешно созданы и внесены в БД")
-    queryset = Currency.objects.filter(deleted_date=None)
-    return queryset
 
+def _rendered_currency(currency_name):
+    """Готовое JSON-тело валюты для ее текущей версии или None."""
+    return _get_rendered(
+        lambda: f"{caching.currency_key(currency_name)}:rendered",
+        lambda currencies: build_currency_entry(currencies, currency_name),
+    )
 
-def _db_actual_date(queryset):
-    if queryset:
-        logging.debug("Объекты в БД были найдены")
-        logging.debug("Получение актуальной даты валют из БД")
-        db_actual_date = (
-            queryset.filter(is_modified=False)[:1]
-            .values("actual_date")
-            .get()["actual_date"]
-        )
-        return db_actual_date
 
+def build_currencies_entry(currencies):
+    return render_entry(
+        list(CurrencySerializer(currencies, many=True).data),
+        max((c.actual_date for c in currencies), default=None),
+    )
+
+
+def build_currency_entry(currencies, currency_name):
+    obj = next((c for c in currencies if c.currency_name == currency_name), None)
+    if obj is None:
+        return None
+    return render_entry(dict(CurrencySerializer(obj).data), obj.actual_date)
 
-def _update_currencies(
-    queryset,
-    ecb_api_data,
-):
-    cache.clear()
-    logging.debug("Обновление данных в БД")
-    api_data_map = {item["currency_name"]: item for item in ecb_api_data}
-    to_update = []
-    for obj in queryset:
-        data = api_data_map.get(obj.currency_name)
-        if (
-            not obj.deleted_date
-            and not obj.is_modified
-            and obj.currency_name == data["currency_name"]
-        ):
-            logging.debug(
-                f"Обработка валюты {obj.currency_name} | rate: {data['rate']}"
-            )
-            obj.actual_date = data["actual_date"]
-            obj.rate = data["rate"]
-            to_update.append(obj)
-    if to_update:
-        Currency.objects.bulk_update(
-            to_update, ["actual_date", "rate"]
-        )
-        logging.debug(f"Обновлено валют: {len(to_update)}")
-    logging.debug("Данные успешно обновлены")
-    logging.debug("Получение всех валют")
-    queryset = Currency.objects.filter(deleted_date=None)
 
-    return queryset
+def _get_rendered(make_key, build):
+    key = make_key()
+    cached = caching.get_many([key, "currencies_fresh"])
+    entry = cached.get(key)
+    if entry is not None and cached.get("currencies_fresh"):
+        return entry
+    # данные устарели: запуск обновления, тело пересобирается,
+    # только если при этом сменилась версия
+    currencies = sync.check_cached_currencies()
+    if entry is not None and make_key() == key:
+        return entry
+    entry = build(currencies)
+    if entry is not None:
+        caching.set(make_key(), entry, timeout=settings.CURRENCY_STALE_TIMEOUT)
+    return entry